@@ -3,6 +3,7 @@ Django settings for ai_playground project.
 """
 
 import os
+import json
 from pathlib import Path
 from dotenv import load_dotenv
 
@@ -180,8 +181,17 @@ LOGGING = {
 }
 
 # File upload settings
+# Файлы больше FILE_UPLOAD_MAX_MEMORY_SIZE пишутся во временный файл, а не держатся в памяти
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10 * 1024 * 1024  # 10MB
+MAX_UPLOAD_SIZE = int(os.environ.get('MAX_UPLOAD_SIZE', str(100 * 1024 * 1024)))  # 100MB
+
+# Фоновая обработка загруженных файлов (очередь в базе данных)
+# 0 — воркеры не запускаются в веб-процессе, очередь разбирает manage.py process_ingestion_jobs
+INGESTION_INPROCESS_WORKERS = int(os.environ.get('INGESTION_INPROCESS_WORKERS', '1'))
+INGESTION_POLL_INTERVAL = float(os.environ.get('INGESTION_POLL_INTERVAL', '1'))
+INGESTION_JOB_TIMEOUT = int(os.environ.get('INGESTION_JOB_TIMEOUT', '600'))
+INGESTION_MAX_ATTEMPTS = int(os.environ.get('INGESTION_MAX_ATTEMPTS', '3'))
 
 # LLM API Settings
 PERPLEXITY_API_KEY = os.environ.get('PERPLEXITY_API_KEY')
@@ -189,6 +199,87 @@ GIGACHAT_API_KEY = os.environ.get('GIGACHAT_API_KEY')
 YANDEX_API_KEY = os.environ.get('YANDEX_API_KEY')
 DEFAULT_LLM_PROVIDER = os.environ.get('DEFAULT_LLM_PROVIDER', 'perplexity')
 
+# Пулы HTTP-соединений к API провайдеров (один пул на хост)
+LLM_HTTP_POOL_SIZE = int(os.environ.get('LLM_HTTP_POOL_SIZE', '10'))
+LLM_HTTP_POOL_BLOCK = os.environ.get('LLM_HTTP_POOL_BLOCK', 'False').lower() == 'true'
+LLM_HTTP_CONNECT_TIMEOUT = float(os.environ.get('LLM_HTTP_CONNECT_TIMEOUT', '5'))
+LLM_HTTP_READ_TIMEOUT = float(os.environ.get('LLM_HTTP_READ_TIMEOUT', '60'))
+# Повторы на уровне urllib3/httpx отключены: временные сбои повторяет chat.resilience
+LLM_HTTP_MAX_RETRIES = int(os.environ.get('LLM_HTTP_MAX_RETRIES', '0'))
+LLM_HTTP_BACKOFF_FACTOR = float(os.environ.get('LLM_HTTP_BACKOFF_FACTOR', '0.5'))
+
+# Повторы временных сбоев провайдеров и выключатель (circuit breaker)
+LLM_RETRY_MAX_RETRIES = int(os.environ.get('LLM_RETRY_MAX_RETRIES', '2'))
+LLM_RETRY_BASE_DELAY = float(os.environ.get('LLM_RETRY_BASE_DELAY', '0.5'))
+LLM_RETRY_MAX_DELAY = float(os.environ.get('LLM_RETRY_MAX_DELAY', '8'))
+LLM_RETRY_DEADLINE = float(os.environ.get('LLM_RETRY_DEADLINE', '90'))
+LLM_CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('LLM_CIRCUIT_FAILURE_THRESHOLD', '5'))
+LLM_CIRCUIT_RESET_TIMEOUT = float(os.environ.get('LLM_CIRCUIT_RESET_TIMEOUT', '30'))
+
+# Ограничение нагрузки на провайдеров LLM (0 - без ограничения)
+LLM_MAX_CONCURRENT = int(os.environ.get('LLM_MAX_CONCURRENT', '8'))
+LLM_REQUESTS_PER_MINUTE = int(os.environ.get('LLM_REQUESTS_PER_MINUTE', '0'))
+LLM_TOKENS_PER_MINUTE = int(os.environ.get('LLM_TOKENS_PER_MINUTE', '0'))
+LLM_QUEUE_TIMEOUT = float(os.environ.get('LLM_QUEUE_TIMEOUT', '10'))
+# Лимиты отдельных провайдеров в JSON, например {"gigachat": {"max_concurrent": 4, "requests_per_minute": 60}}
+LLM_PROVIDER_LIMITS = json.loads(os.environ.get('LLM_PROVIDER_LIMITS', '{}'))
+# local - лимиты в памяти процесса, cache - поминутные лимиты в кеше LLM_RATE_LIMIT_CACHE_ALIAS (общие для процессов)
+LLM_RATE_LIMIT_BACKEND = os.environ.get('LLM_RATE_LIMIT_BACKEND', 'local')
+LLM_RATE_LIMIT_CACHE_ALIAS = os.environ.get('LLM_RATE_LIMIT_CACHE_ALIAS', 'default')
+
+# Кеш ответов модели по точному совпадению запроса (включается для сессии или агента полем response_cache)
+LLM_RESPONSE_CACHE_ALIAS = 'llm_responses'
+LLM_RESPONSE_CACHE_TTL = int(os.environ.get('LLM_RESPONSE_CACHE_TTL', '86400'))
+LLM_RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('LLM_RESPONSE_CACHE_MAX_ENTRIES', '1000'))
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    # LocMemCache вытесняет давно не использованные записи при достижении MAX_ENTRIES;
+    # для общего кеша между процессами укажите, например, django.core.cache.backends.redis.RedisCache
+    LLM_RESPONSE_CACHE_ALIAS: {
+        'BACKEND': os.environ.get('LLM_RESPONSE_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('LLM_RESPONSE_CACHE_LOCATION', 'llm-responses'),
+        'TIMEOUT': LLM_RESPONSE_CACHE_TTL,
+        'OPTIONS': {
+            'MAX_ENTRIES': LLM_RESPONSE_CACHE_MAX_ENTRIES,
+        },
+    },
+}
+
+# Прогрев кодировок tiktoken при старте приложения
+TOKEN_COUNTER_WARMUP = os.environ.get('TOKEN_COUNTER_WARMUP', 'False').lower() == 'true'
+
+# Разбор PDF: пул процессов и бюджеты на документ
+PDF_EXTRACT_WORKERS = int(os.environ.get('PDF_EXTRACT_WORKERS', str(min(4, os.cpu_count() or 1))))
+PDF_EXTRACT_PAGES_PER_TASK = int(os.environ.get('PDF_EXTRACT_PAGES_PER_TASK', '10'))
+PDF_EXTRACT_MAX_PAGES = int(os.environ.get('PDF_EXTRACT_MAX_PAGES', '500'))
+PDF_EXTRACT_MAX_CHARS = int(os.environ.get('PDF_EXTRACT_MAX_CHARS', '2000000'))
+PDF_EXTRACT_TIMEOUT = float(os.environ.get('PDF_EXTRACT_TIMEOUT', '60'))
+
+# Поиск по фрагментам файлов сессии (BM25): в запрос добавляются top-k фрагментов в пределах бюджета токенов
+RETRIEVAL_CHUNK_CHARS = int(os.environ.get('RETRIEVAL_CHUNK_CHARS', '1200'))
+RETRIEVAL_CHUNK_OVERLAP = int(os.environ.get('RETRIEVAL_CHUNK_OVERLAP', '200'))
+RETRIEVAL_TOP_K = int(os.environ.get('RETRIEVAL_TOP_K', '5'))
+RETRIEVAL_TOKEN_BUDGET = int(os.environ.get('RETRIEVAL_TOKEN_BUDGET', '1500'))
+
+# История диалога в запросе к модели: последние сообщения сессии в пределах окна контекста модели
+CONTEXT_HISTORY_MAX_MESSAGES = int(os.environ.get('CONTEXT_HISTORY_MAX_MESSAGES', '50'))
+CONTEXT_HISTORY_MAX_TOKENS = int(os.environ.get('CONTEXT_HISTORY_MAX_TOKENS', '4000'))
+
+# Размер LRU-кеша результатов подсчета токенов (по кодировке и хешу текста)
+TOKEN_COUNT_CACHE_SIZE = int(os.environ.get('TOKEN_COUNT_CACHE_SIZE', '2048'))
+
+# JSON с коэффициентами оценки токенов GigaChat/Yandex GPT (результат calibrate_token_estimator)
+TOKEN_ESTIMATOR_COEFFICIENTS = os.environ.get('TOKEN_ESTIMATOR_COEFFICIENTS', '')
+
+# Сжатие длинной истории в краткое содержание (в фоне, после ответа модели)
+CONTEXT_SUMMARY_ENABLED = os.environ.get('CONTEXT_SUMMARY_ENABLED', 'False').lower() == 'true'
+CONTEXT_SUMMARY_TRIGGER_TOKENS = int(os.environ.get('CONTEXT_SUMMARY_TRIGGER_TOKENS', '3000'))
+CONTEXT_SUMMARY_KEEP_MESSAGES = int(os.environ.get('CONTEXT_SUMMARY_KEEP_MESSAGES', '6'))
+CONTEXT_SUMMARY_MAX_TOKENS = int(os.environ.get('CONTEXT_SUMMARY_MAX_TOKENS', '500'))
+
 # Available models (imported from chat.model_config)
 from chat.model_config import AVAILABLE_MODELS
 
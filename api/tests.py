@@ -0,0 +1,84 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from chat.models import Agent, ChatSession, Message
+
+
+class SessionsCursorTests(TestCase):
+    """Постраничная выдача сессий по курсору (updated_at, id)."""
+
+    def setUp(self):
+        now = timezone.now()
+        for i in range(7):
+            session = ChatSession.objects.create(session_id=f's{i}', model='gpt-4o-mini')
+            # Пары сессий с одинаковым updated_at: порядок внутри пары задает id
+            ChatSession.objects.filter(pk=session.pk).update(updated_at=now - timedelta(minutes=i // 2))
+
+    def _get(self, **params):
+        return self.client.get(reverse('api:sessions'), params, HTTP_HOST='localhost')
+
+    def test_pages_cover_all_sessions_in_order(self):
+        expected = [
+            str(pk) for pk in ChatSession.objects.order_by('-updated_at', '-id').values_list('id', flat=True)
+        ]
+        seen, cursor = [], None
+        while True:
+            params = {'limit': 2}
+            if cursor:
+                params['cursor'] = cursor
+            data = self._get(**params).json()
+            self.assertLessEqual(len(data['sessions']), 2)
+            seen.extend(session['id'] for session in data['sessions'])
+            cursor = data['next_cursor']
+            self.assertEqual(data['has_more'], cursor is not None)
+            if not cursor:
+                break
+        self.assertEqual(seen, expected)
+
+    def test_last_page_has_no_cursor(self):
+        data = self._get(limit=7).json()
+        self.assertEqual(len(data['sessions']), 7)
+        self.assertIsNone(data['next_cursor'])
+
+    def test_invalid_cursor_and_limit(self):
+        self.assertEqual(self._get(cursor='не-курсор').status_code, 400)
+        self.assertEqual(self._get(limit='x').status_code, 400)
+
+
+class TokenStatsTests(TestCase):
+    """Статистика токенов из почасовой сводки использования."""
+
+    def setUp(self):
+        self.agent = Agent.objects.create(name='Агент', model='gpt-4o-mini')
+        agent_session = ChatSession.objects.create(session_id='agent', model='gpt-4o-mini', agent=self.agent)
+        other_session = ChatSession.objects.create(session_id='other', model='gpt-4o')
+        day = datetime(2026, 1, 1, 10, tzinfo=dt_timezone.utc)
+        Message.objects.create(session=agent_session, role='user', content='a', content_tokens=1,
+                               timestamp=day, total_tokens=10, estimated_cost=0.001)
+        Message.objects.create(session=other_session, role='user', content='b', content_tokens=1,
+                               timestamp=day + timedelta(days=1), total_tokens=100, estimated_cost=0.01)
+
+    def _get(self, **params):
+        return self.client.get(reverse('api:token_stats'), params, HTTP_HOST='localhost')
+
+    def test_overview_and_models(self):
+        data = self._get().json()
+        self.assertEqual(data['overview']['total_sessions'], 2)
+        self.assertEqual(data['overview']['total_messages'], 2)
+        self.assertEqual(data['overview']['total_tokens'], 110)
+        self.assertEqual(set(data['by_model']), {'gpt-4o-mini', 'gpt-4o'})
+
+    def test_agent_filter(self):
+        data = self._get(agent=str(self.agent.pk), bucket='day', **{'from': '2026-01-01', 'to': '2026-01-02'}).json()
+        self.assertEqual(data['overview']['total_sessions'], 1)
+        self.assertEqual(data['overview']['total_tokens'], 10)
+        self.assertEqual(list(data['by_model']), ['gpt-4o-mini'])
+        self.assertEqual([point['total_tokens'] for point in data['trend']['points']], [10])
+        self.assertEqual(self._get(agent='x').status_code, 400)
+
+    def test_date_only_to_includes_the_day(self):
+        data = self._get(bucket='day', **{'from': '2026-01-01', 'to': '2026-01-02'}).json()
+        self.assertEqual([point['total_tokens'] for point in data['trend']['points']], [10, 100])
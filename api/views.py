@@ -1,6 +1,26 @@
+import uuid
+from datetime import datetime, time, timedelta
+
 from django.http import JsonResponse
 from django.conf import settings
-from chat.models import ChatSession, Message
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDay, TruncHour
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from chat.models import ChatSession, UsageRollup
+from chat.pagination import keyset_paginate, InvalidCursor
+
+MAX_SESSIONS_PAGE_SIZE = 100
+
+# Интервалы динамики статистики токенов и диапазоны по умолчанию
+TREND_BUCKETS = {
+    'day': TruncDay,
+    'hour': TruncHour,
+}
+TREND_DEFAULT_RANGE = {
+    'day': timedelta(days=30),
+    'hour': timedelta(hours=48),
+}
 
 
 def get_available_models(request):
@@ -11,8 +31,25 @@ def get_available_models(request):
 
 
 def get_sessions(request):
-    """API endpoint для получения списка сессий."""
-    sessions = ChatSession.objects.all()[:20]  # Последние 20 сессий
+    """
+    API endpoint для получения списка сессий.
+
+    Постраничная выдача по курсору: параметр limit (по умолчанию 20, максимум 100)
+    и cursor из поля next_cursor предыдущего ответа. Каждая страница — один запрос.
+    """
+    try:
+        limit = min(max(int(request.GET.get('limit', 20)), 1), MAX_SESSIONS_PAGE_SIZE)
+    except ValueError:
+        return JsonResponse({'error': 'Invalid limit'}, status=400)
+    
+    sessions = ChatSession.objects.only(
+        'id', 'session_id', 'title', 'model', 'created_at', 'updated_at', 'message_count'
+    )
+    try:
+        sessions, next_cursor = keyset_paginate(sessions, request.GET.get('cursor'), limit)
+    except InvalidCursor:
+        return JsonResponse({'error': 'Invalid cursor'}, status=400)
+    
     sessions_data = []
     
     for session in sessions:
@@ -23,51 +60,142 @@ def get_sessions(request):
             'model': session.model,
             'created_at': session.created_at.isoformat(),
             'updated_at': session.updated_at.isoformat(),
-            'message_count': session.messages.count(),
+            'message_count': session.message_count,
         })
     
     return JsonResponse({
-        'sessions': sessions_data
+        'sessions': sessions_data,
+        'next_cursor': next_cursor,
+        'has_more': next_cursor is not None,
     })
 
 
+def _parse_range_bound(value, end=False):
+    """
+    Разбирает границу диапазона: дата (YYYY-MM-DD) или дата и время в ISO 8601.
+
+    Конец диапазона исключается из выборки, поэтому дата без времени в конце
+    диапазона (end=True) означает начало следующего дня: указанный день
+    входит в диапазон целиком.
+    """
+    parsed_date = parse_date(value)
+    if parsed_date is not None:
+        if end:
+            parsed_date += timedelta(days=1)
+        parsed = datetime.combine(parsed_date, time.min)
+    else:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f'Invalid date: {value}')
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed)
+    return parsed
+
+
+def _token_trend(rollups, bucket, date_from, date_to):
+    """Динамика токенов и стоимости по интервалам и моделям из почасовой сводки использования."""
+    trunc = TREND_BUCKETS[bucket]
+    rows = (
+        rollups
+        .filter(bucket__gte=date_from, bucket__lt=date_to)
+        .annotate(interval=trunc('bucket'))
+        .values('interval', 'model')
+        .annotate(
+            messages=Sum('messages'),
+            input_tokens=Sum('input_tokens'),
+            output_tokens=Sum('output_tokens'),
+            total_tokens=Sum('total_tokens'),
+            cost=Sum('estimated_cost'),
+        )
+        .order_by('interval', 'model')
+    )
+    return [{
+        'bucket': row['interval'].isoformat(),
+        'model': row['model'],
+        'messages': row['messages'],
+        'input_tokens': row['input_tokens'] or 0,
+        'output_tokens': row['output_tokens'] or 0,
+        'total_tokens': row['total_tokens'] or 0,
+        'cost': float(row['cost'] or 0),
+    } for row in rows]
+
+
 def get_token_stats(request):
-    """API endpoint для получения статистики токенов."""
+    """
+    API endpoint для получения статистики токенов.
+
+    Статистика читается из почасовой сводки UsageRollup, а не из сообщений.
+    Необязательные параметры: bucket=day|hour — динамика по интервалам,
+    from/to — диапазон дат для динамики (по умолчанию последние 30 дней
+    для day и последние 48 часов для hour), agent — статистика только
+    по сессиям агента.
+    """
+    bucket = request.GET.get('bucket')
+    if bucket and bucket not in TREND_BUCKETS:
+        return JsonResponse({'error': 'Invalid bucket, expected day or hour'}, status=400)
+    
+    sessions = ChatSession.objects.all()
+    rollups = UsageRollup.objects.all()
+    if request.GET.get('agent'):
+        try:
+            agent_id = uuid.UUID(request.GET['agent'])
+        except ValueError:
+            return JsonResponse({'error': 'Invalid agent'}, status=400)
+        sessions = sessions.filter(agent_id=agent_id)
+        rollups = rollups.filter(agent_id=agent_id)
+    
     # Общая статистика по всем сессиям
-    total_sessions = ChatSession.objects.count()
-    total_messages = Message.objects.count()
+    total_sessions = sessions.count()
     
     # Агрегированная статистика токенов
-    from django.db.models import Sum
-    token_stats = Message.objects.aggregate(
+    token_stats = rollups.aggregate(
+        total_messages=Sum('messages'),
         total_input_tokens=Sum('input_tokens'),
         total_output_tokens=Sum('output_tokens'),
         total_tokens=Sum('total_tokens'),
         total_cost=Sum('estimated_cost')
     )
     
-    # Статистика по моделям
+    # Статистика по моделям — одним GROUP BY по сводке
     model_stats = {}
-    for session in ChatSession.objects.all():
-        model = session.model
-        if model not in model_stats:
-            model_stats[model] = {
-                'sessions': 0,
-                'total_tokens': 0,
-                'total_cost': 0
-            }
-        model_stats[model]['sessions'] += 1
-        model_stats[model]['total_tokens'] += session.total_tokens
-        model_stats[model]['total_cost'] += float(session.total_estimated_cost)
+    for row in rollups.values('model').annotate(
+        sessions=Count('session', distinct=True),
+        total_tokens=Sum('total_tokens'),
+        total_cost=Sum('estimated_cost'),
+    ).order_by('model'):
+        model_stats[row['model']] = {
+            'sessions': row['sessions'],
+            'total_tokens': row['total_tokens'] or 0,
+            'total_cost': float(row['total_cost'] or 0),
+        }
     
-    return JsonResponse({
+    response = {
         'overview': {
             'total_sessions': total_sessions,
-            'total_messages': total_messages,
+            'total_messages': token_stats['total_messages'] or 0,
             'total_input_tokens': token_stats['total_input_tokens'] or 0,
             'total_output_tokens': token_stats['total_output_tokens'] or 0,
             'total_tokens': token_stats['total_tokens'] or 0,
             'total_cost': float(token_stats['total_cost'] or 0),
         },
         'by_model': model_stats
-    })
+    }
+    
+    if bucket:
+        try:
+            date_to = _parse_range_bound(request.GET['to'], end=True) if request.GET.get('to') else timezone.now()
+            date_from = (
+                _parse_range_bound(request.GET['from']) if request.GET.get('from')
+                else date_to - TREND_DEFAULT_RANGE[bucket]
+            )
+        except ValueError as e:
+            return JsonResponse({'error': str(e)}, status=400)
+        
+        response['trend'] = {
+            'bucket': bucket,
+            'from': date_from.isoformat(),
+            'to': date_to.isoformat(),
+            'points': _token_trend(rollups, bucket, date_from, date_to),
+        }
+    
+    return JsonResponse(response)
@@ -1,6 +1,22 @@
+import logging
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
 
 
 class ChatConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'chat'
+
+    def ready(self):
+        # Прогрев кодировок tiktoken в фоне, чтобы первый запрос не ждал их загрузки
+        if getattr(settings, 'TOKEN_COUNTER_WARMUP', False):
+            from .token_counter import TokenCounter
+            threading.Thread(
+                target=TokenCounter().warm_up,
+                name='token-counter-warmup',
+                daemon=True,
+            ).start()
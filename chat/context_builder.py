@@ -0,0 +1,92 @@
+import logging
+from typing import Dict, Any, List, Iterable
+
+from django.conf import settings
+
+from .model_config import get_context_window
+from .models import Message
+from .token_counter import TokenCounter
+
+logger = logging.getLogger(__name__)
+
+# Роли сообщений, которые попадают в историю диалога
+HISTORY_ROLES = ('user', 'assistant')
+
+# Токены форматирования одного сообщения (роль и разделители), как в TokenCounter.count_messages_tokens
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def history_budget(session, messages: List[Dict[str, Any]]) -> int:
+    """
+    Бюджет токенов на историю: окно контекста модели за вычетом max_tokens
+    на ответ и уже собранных сообщений (системный промпт и текущий вопрос),
+    но не больше CONTEXT_HISTORY_MAX_TOKENS.
+    """
+    used = TokenCounter().count_messages_tokens(messages, session.model)
+    budget = get_context_window(session.model) - session.max_tokens - used
+    if settings.CONTEXT_HISTORY_MAX_TOKENS:
+        budget = min(budget, settings.CONTEXT_HISTORY_MAX_TOKENS)
+    return max(budget, 0)
+
+
+def load_history(session, budget: int, exclude_ids: Iterable = ()) -> List[Dict[str, Any]]:
+    """
+    Возвращает последние сообщения сессии, помещающиеся в бюджет токенов,
+    в хронологическом порядке.
+
+    Сообщения перебираются от новых к старым, окно заканчивается на первом
+    сообщении, которое уже не помещается. Количество токенов сообщения
+    берется из Message.content_tokens; для старых сообщений без него оно
+    считается один раз и сохраняется.
+    """
+    if budget <= 0:
+        return []
+
+    recent = session.messages.filter(role__in=HISTORY_ROLES).exclude(id__in=list(exclude_ids))
+    if session.summary_until:
+        # Более ранние сообщения уже вошли в краткое содержание
+        recent = recent.filter(timestamp__gt=session.summary_until)
+    recent = (
+        recent
+        .order_by('-timestamp')
+        .only('id', 'role', 'content', 'content_tokens')
+        [:settings.CONTEXT_HISTORY_MAX_MESSAGES]
+    )
+
+    token_counter = TokenCounter()
+    history = []
+    counted = []
+    for message in recent:
+        if message.content_tokens is None:
+            message.content_tokens = token_counter.count_tokens(message.content, session.model)
+            counted.append(message)
+        tokens = message.content_tokens + MESSAGE_OVERHEAD_TOKENS
+        if tokens > budget:
+            break
+        budget -= tokens
+        history.append({'role': message.role, 'content': message.content, 'tokens': message.content_tokens})
+
+    if counted:
+        Message.objects.bulk_update(counted, ['content_tokens'])
+
+    history.reverse()
+    logger.info(f"История диалога: {len(history)} сообщений, остаток бюджета {budget} токенов")
+    return history
+
+
+def build_messages(session, system_content: str, user_content: str,
+                   exclude_ids: Iterable = ()) -> List[Dict[str, Any]]:
+    """
+    Собирает сообщения для запроса к модели: системный промпт (с кратким
+    содержанием ранней части диалога, если оно есть), история диалога
+    в пределах окна контекста модели и текущее сообщение пользователя.
+
+    exclude_ids — сообщения, которые не должны попасть в историю (как правило,
+    только что сохраненное текущее сообщение пользователя).
+    """
+    if session.summary:
+        system_content = f"{system_content}\n\nКраткое содержание предыдущей части диалога:\n{session.summary}"
+    system_message = {'role': 'system', 'content': system_content}
+    user_message = {'role': 'user', 'content': user_content}
+    budget = history_budget(session, [system_message, user_message])
+    return [system_message, *load_history(session, budget, exclude_ids), user_message]
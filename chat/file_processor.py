@@ -1,12 +1,22 @@
 import os
 import mimetypes
 import base64
+import hashlib
+import logging
 from typing import Tuple, Dict, Any
 from django.core.files.uploadedfile import UploadedFile
+from django.db import IntegrityError, transaction
 from PIL import Image
-import PyPDF2
 import io
 
+from .pdf_extractor import PDFExtractor
+
+logger = logging.getLogger(__name__)
+
+# Версия логики разбора файлов. Увеличивается при изменении обработчиков,
+# чтобы закешированные результаты разбора пересчитывались.
+PROCESSOR_VERSION = '2'
+
 
 class FileProcessor:
     """Класс для обработки загруженных файлов."""
@@ -86,6 +96,109 @@ class FileProcessor:
         except Exception as e:
             return {'error': f'Ошибка при обработке файла: {str(e)}'}
     
+    def get_file_type(self, filename: str) -> str:
+        """Определяет тип файла по расширению ('unknown' для неподдерживаемых)."""
+        file_extension = os.path.splitext(filename.lower())[1]
+        return self.allowed_extensions.get(file_extension, 'unknown')
+    
+    def process_upload(self, file: UploadedFile) -> Dict[str, Any]:
+        """
+        Обрабатывает загруженный файл с кешированием по содержимому.
+
+        Содержимое хешируется (sha256) и хранится в одном экземпляре FileBlob,
+        а результат разбора кешируется в FileExtraction по (sha256, версия
+        обработчика, тип файла). Повторная загрузка тех же байтов не приводит
+        ни к повторному сохранению, ни к повторному разбору.
+
+        Возвращает словарь с ключами file_type, content_preview, training_data и blob.
+        """
+        file_type = self.get_file_type(file.name)
+        if file_type == 'unknown':
+            return {
+                'file_type': 'unknown',
+                'content_preview': 'Неподдерживаемый тип файла',
+                'training_data': {'error': 'Неподдерживаемый тип файла'},
+                'blob': None,
+            }
+        
+        blob = self.store_blob(file)
+        extraction = self.extract_cached(blob, file_type, file)
+        
+        return {
+            'file_type': extraction.file_type,
+            'content_preview': extraction.content_preview,
+            'training_data': extraction.training_data,
+            'blob': blob,
+        }
+    
+    def get_cached_extraction(self, blob, file_type: str):
+        """Возвращает сохраненный результат разбора содержимого или None."""
+        from .models import FileExtraction
+        
+        return FileExtraction.objects.filter(
+            blob=blob, processor_version=PROCESSOR_VERSION, file_type=file_type
+        ).first()
+    
+    def extract_cached(self, blob, file_type: str, file):
+        """Возвращает результат разбора содержимого, выполняя разбор только при промахе кеша."""
+        from .models import FileExtraction
+        
+        extraction = self.get_cached_extraction(blob, file_type)
+        if extraction is not None:
+            logger.debug(f"Результат разбора файла {file.name} взят из кеша: {blob.sha256}")
+            return extraction
+        
+        file.seek(0)
+        _, content_preview = self.process_file(file)
+        training_data = self.process_file_for_training(file)
+        try:
+            with transaction.atomic():
+                extraction = FileExtraction.objects.create(
+                    blob=blob,
+                    processor_version=PROCESSOR_VERSION,
+                    file_type=file_type,
+                    content_preview=content_preview,
+                    training_data=training_data
+                )
+        except IntegrityError:
+            # Тот же файл параллельно разобран другим запросом
+            extraction = self.get_cached_extraction(blob, file_type)
+        return extraction
+    
+    def store_blob(self, file: UploadedFile):
+        """Сохраняет содержимое файла, переиспользуя уже сохраненные одинаковые байты."""
+        return self._get_or_create_blob(file, self.compute_sha256(file))
+    
+    @staticmethod
+    def compute_sha256(file: UploadedFile) -> str:
+        """Вычисляет sha256 содержимого файла, читая его по частям."""
+        file.seek(0)
+        digest = hashlib.sha256()
+        for chunk in file.chunks():
+            digest.update(chunk)
+        file.seek(0)
+        return digest.hexdigest()
+    
+    def _get_or_create_blob(self, file: UploadedFile, sha256: str):
+        """Возвращает FileBlob для содержимого, сохраняя байты только при первой загрузке."""
+        from .models import FileBlob
+        
+        blob = FileBlob.objects.filter(sha256=sha256).first()
+        if blob is not None:
+            return blob
+        
+        blob = FileBlob(sha256=sha256, size=file.size)
+        file.seek(0)
+        blob.file.save(file.name, file, save=False)
+        try:
+            with transaction.atomic():
+                blob.save()
+        except IntegrityError:
+            # Тот же файл параллельно сохранен другим запросом
+            blob.file.delete(save=False)
+            blob = FileBlob.objects.get(sha256=sha256)
+        return blob
+    
     def _process_text_file(self, file: UploadedFile) -> Tuple[str, str]:
         """Обработка текстового файла."""
         try:
@@ -110,12 +223,9 @@ class FileProcessor:
         """Обработка PDF файла."""
         try:
             file.seek(0)  # Сбрасываем позицию файла
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            
-            for page_num in range(min(len(pdf_reader.pages), 5)):  # Ограничиваем первыми 5 страницами
-                page = pdf_reader.pages[page_num]
-                text += page.extract_text() + "\n"
+            # Для превью достаточно первых 5 страниц
+            result = PDFExtractor().extract(file.read(), max_pages=5, max_chars=2001)
+            text = result['text']
             
             # Ограничиваем превью до 2000 символов
             preview = text[:2000] + '...' if len(text) > 2000 else text
@@ -219,17 +329,16 @@ class FileProcessor:
         """Обработка PDF файла для обучения."""
         try:
             file.seek(0)
-            pdf_reader = PyPDF2.PdfReader(file)
-            text = ""
-            
-            for page in pdf_reader.pages:
-                text += page.extract_text() + "\n"
+            # Страницы разбираются параллельно в пуле процессов с ограничением объема и времени
+            result = PDFExtractor().extract(file.read())
             
             return {
                 'type': 'pdf',
-                'content': text,
-                'size': len(text),
-                'pages': len(pdf_reader.pages)
+                'content': result['text'],
+                'size': len(result['text']),
+                'pages': result['pages'],
+                'pages_processed': result['pages_processed'],
+                'truncated': result['truncated']
             }
         except Exception as e:
             return {'error': f'Ошибка при обработке PDF: {str(e)}'}
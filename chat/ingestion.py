@@ -0,0 +1,218 @@
+import os
+import socket
+import logging
+import threading
+from datetime import timedelta
+from typing import Optional
+
+from django.conf import settings
+from django.core.files import File
+from django.db import close_old_connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .file_processor import FileProcessor
+from .models import IngestionJob, UploadedFile
+from .retrieval import index_extraction
+
+logger = logging.getLogger(__name__)
+
+
+def enqueue_upload(session, file) -> IngestionJob:
+    """
+    Сохраняет загруженный файл и ставит задачу на извлечение его содержимого.
+
+    Разбор файла не выполняется: сохраняется только содержимое (один экземпляр
+    на sha256). Если это содержимое уже разбиралось текущей версией обработчика,
+    результат берется из кеша и задача сразу создается в статусе ready.
+    """
+    processor = FileProcessor()
+    file_type = processor.get_file_type(file.name)
+    blob = processor.store_blob(file)
+    extraction = processor.get_cached_extraction(blob, file_type)
+
+    with transaction.atomic():
+        uploaded_file = UploadedFile.objects.create(
+            session=session,
+            file=blob.file.name,
+            blob=blob,
+            filename=file.name,
+            file_type=file_type,
+            file_size=file.size,
+            extraction=extraction,
+            content_preview=extraction.content_preview if extraction else ''
+        )
+        if extraction is not None:
+            now = timezone.now()
+            job = IngestionJob.objects.create(
+                uploaded_file=uploaded_file,
+                status=IngestionJob.STATUS_READY,
+                progress=100,
+                started_at=now,
+                finished_at=now
+            )
+        else:
+            job = IngestionJob.objects.create(uploaded_file=uploaded_file)
+
+    if extraction is None:
+        ensure_inprocess_workers()
+
+    return job
+
+
+def claim_next_job(worker_name: str) -> Optional[IngestionJob]:
+    """
+    Забирает самую старую задачу из очереди.
+
+    Захват выполняется условным UPDATE по статусу, поэтому одну задачу не могут
+    взять два воркера, даже если они работают в разных процессах.
+    """
+    candidates = IngestionJob.objects.filter(
+        status=IngestionJob.STATUS_PENDING
+    ).order_by('created_at').values_list('id', flat=True)[:5]
+
+    for job_id in candidates:
+        claimed = IngestionJob.objects.filter(
+            id=job_id, status=IngestionJob.STATUS_PENDING
+        ).update(
+            status=IngestionJob.STATUS_EXTRACTING,
+            progress=10,
+            attempts=F('attempts') + 1,
+            worker=worker_name,
+            started_at=timezone.now()
+        )
+        if claimed:
+            return IngestionJob.objects.select_related('uploaded_file').get(id=job_id)
+    return None
+
+
+def requeue_stale_jobs() -> int:
+    """
+    Возвращает в очередь задачи, зависшие в статусе extracting (например, после
+    падения воркера). Задачи, исчерпавшие попытки, переводятся в error.
+    """
+    deadline = timezone.now() - timedelta(seconds=settings.INGESTION_JOB_TIMEOUT)
+    stale = IngestionJob.objects.filter(status=IngestionJob.STATUS_EXTRACTING, started_at__lt=deadline)
+
+    failed = stale.filter(attempts__gte=settings.INGESTION_MAX_ATTEMPTS).update(
+        status=IngestionJob.STATUS_ERROR,
+        error='Превышено время обработки',
+        finished_at=timezone.now()
+    )
+    requeued = stale.filter(attempts__lt=settings.INGESTION_MAX_ATTEMPTS).update(
+        status=IngestionJob.STATUS_PENDING,
+        progress=0,
+        worker=''
+    )
+    if failed or requeued:
+        logger.warning(f"Зависшие задачи обработки файлов: возвращено в очередь {requeued}, завершено с ошибкой {failed}")
+    return requeued
+
+
+def process_job(job: IngestionJob):
+    """
+    Извлекает содержимое файла задачи и сохраняет результат.
+
+    Состояние задачи обновляется, только пока она принадлежит этому воркеру:
+    задачу, возвращенную в очередь по таймауту и взятую другим воркером,
+    завершившийся позже первый воркер не перезаписывает.
+    """
+    uploaded_file = job.uploaded_file
+    processor = FileProcessor()
+    owned = IngestionJob.objects.filter(id=job.id, worker=job.worker, status=IngestionJob.STATUS_EXTRACTING)
+
+    try:
+        blob = uploaded_file.blob
+        with uploaded_file.file.open('rb') as stored:
+            # Тип определяется по исходному имени: одинаковое содержимое может быть загружено под разными именами
+            source = File(stored, name=uploaded_file.filename)
+            extraction = processor.extract_cached(blob, uploaded_file.file_type, source)
+
+        owned.update(progress=60)
+
+        # Фрагменты и инвертированный индекс для поиска по содержимому файла
+        index_extraction(extraction)
+        owned.update(progress=90)
+
+        with transaction.atomic():
+            if not owned.update(
+                status=IngestionJob.STATUS_READY,
+                progress=100,
+                error='',
+                finished_at=timezone.now()
+            ):
+                logger.warning(f"Задача {job.id} уже возвращена в очередь или взята другим воркером, результат не сохранен")
+                return
+            UploadedFile.objects.filter(id=uploaded_file.id).update(
+                extraction=extraction,
+                content_preview=extraction.content_preview
+            )
+        logger.info(f"Файл обработан: {uploaded_file.filename} (задача {job.id})")
+    except Exception as e:
+        logger.error(f"Ошибка обработки файла {uploaded_file.filename} (задача {job.id}): {str(e)}")
+        owned.update(
+            status=IngestionJob.STATUS_ERROR,
+            error=str(e),
+            finished_at=timezone.now()
+        )
+
+
+class IngestionWorker:
+    """Воркер, разбирающий очередь задач обработки файлов из базы данных."""
+
+    def __init__(self, name: Optional[str] = None, poll_interval: Optional[float] = None):
+        self.name = name or f"{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}"
+        self.poll_interval = poll_interval if poll_interval is not None else settings.INGESTION_POLL_INTERVAL
+        self._stop = threading.Event()
+
+    def stop(self):
+        self._stop.set()
+
+    def run_once(self) -> int:
+        """Обрабатывает все задачи, находящиеся в очереди, и возвращает их количество."""
+        processed = 0
+        requeue_stale_jobs()
+        while not self._stop.is_set():
+            job = claim_next_job(self.name)
+            if job is None:
+                break
+            process_job(job)
+            processed += 1
+        return processed
+
+    def run(self):
+        """Обрабатывает очередь, пока воркер не остановлен, опрашивая базу с интервалом poll_interval."""
+        logger.info(f"Воркер обработки файлов запущен: {self.name}")
+        while not self._stop.is_set():
+            try:
+                close_old_connections()
+                self.run_once()
+            except Exception as e:
+                logger.error(f"Ошибка воркера обработки файлов {self.name}: {str(e)}")
+            finally:
+                close_old_connections()
+            self._stop.wait(self.poll_interval)
+        logger.info(f"Воркер обработки файлов остановлен: {self.name}")
+
+
+_inprocess_workers = []
+_inprocess_lock = threading.Lock()
+
+
+def ensure_inprocess_workers():
+    """
+    Запускает воркеры в фоновых потоках текущего процесса (INGESTION_INPROCESS_WORKERS).
+
+    Потоки стартуют при первой постановке задачи. При значении 0 очередь
+    разбирается отдельным процессом: python manage.py process_ingestion_jobs.
+    """
+    count = settings.INGESTION_INPROCESS_WORKERS
+    if count <= 0 or len(_inprocess_workers) >= count:
+        return
+
+    with _inprocess_lock:
+        while len(_inprocess_workers) < count:
+            thread_name = f'ingestion-worker-{len(_inprocess_workers)}'
+            worker = IngestionWorker(name=f"{socket.gethostname()}:{os.getpid()}:{thread_name}")
+            threading.Thread(target=worker.run, name=thread_name, daemon=True).start()
+            _inprocess_workers.append(worker)
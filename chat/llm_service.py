@@ -1,29 +1,930 @@
 import os
+import time
+import uuid
+import hashlib
 import requests
 import json
 import logging
-from typing import List, Dict, Any
+import threading
+import asyncio
+import weakref
+from dataclasses import dataclass
+from typing import List, Dict, Any, Tuple, Optional, Iterator, AsyncIterator
+from urllib.parse import urlparse
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
+from .model_config import UnknownModelError, require_model_spec
+from .rate_limiter import ProviderLimiter, get_limiter
+from .resilience import (
+    RETRYABLE_STATUSES, ProviderAuthError, ProviderConfigError, acall_with_retries, call_with_retries,
+    classify_error, get_breaker, remaining_time,
+)
 from .token_counter import TokenCounter
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
 
+GIGACHAT_AUTH_URL = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
+GIGACHAT_API_URL = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
+YANDEX_API_URL = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
+SEARCH_API_URL = "https://api.duckduckgo.com/"
+
+
+class PoolStats:
+    """Счетчики использования пула соединений одного хоста."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.new_connections = 0
+        self.wait_time = 0.0
+        self.max_wait_time = 0.0
+
+    def record_checkout(self, wait_time: float):
+        with self._lock:
+            self.requests += 1
+            self.wait_time += wait_time
+            self.max_wait_time = max(self.max_wait_time, wait_time)
+
+    def record_new_connection(self):
+        with self._lock:
+            self.new_connections += 1
+
+    def as_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'hits': max(self.requests - self.new_connections, 0),
+                'new_connections': self.new_connections,
+                'total_wait_ms': round(self.wait_time * 1000, 2),
+                'avg_wait_ms': round(self.wait_time * 1000 / self.requests, 2) if self.requests else 0.0,
+                'max_wait_ms': round(self.max_wait_time * 1000, 2),
+            }
+
+
+def _instrumented_pool_class(base, stats: PoolStats):
+    """Создает класс пула urllib3, который учитывает выдачу и создание соединений."""
+
+    class InstrumentedPool(base):
+        def _get_conn(self, timeout=None):
+            started = time.monotonic()
+            try:
+                return super()._get_conn(timeout=timeout)
+            finally:
+                stats.record_checkout(time.monotonic() - started)
+
+        def _new_conn(self):
+            stats.record_new_connection()
+            return super()._new_conn()
+
+    return InstrumentedPool
+
+
+class InstrumentedHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter с пулом соединений, собирающим статистику."""
+
+    def __init__(self, stats: PoolStats, **kwargs):
+        self.stats = stats
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            'http': _instrumented_pool_class(HTTPConnectionPool, self.stats),
+            'https': _instrumented_pool_class(HTTPSConnectionPool, self.stats),
+        }
+
+
+class ProviderHTTPClient:
+    """
+    Общий HTTP-клиент для обращений к API провайдеров.
+
+    Для каждого хоста создается своя requests.Session с keep-alive пулом
+    соединений, поэтому повторные запросы не открывают заново TCP+TLS.
+    Размер пула, таймауты и политика повторов берутся из настроек Django.
+    """
+
+    def __init__(self, pool_size: int = None, pool_block: bool = None,
+                 connect_timeout: float = None, read_timeout: float = None,
+                 max_retries: int = None, backoff_factor: float = None):
+        self.pool_size = pool_size if pool_size is not None else getattr(settings, 'LLM_HTTP_POOL_SIZE', 10)
+        self.pool_block = pool_block if pool_block is not None else getattr(settings, 'LLM_HTTP_POOL_BLOCK', False)
+        self.connect_timeout = connect_timeout if connect_timeout is not None else getattr(settings, 'LLM_HTTP_CONNECT_TIMEOUT', 5.0)
+        self.read_timeout = read_timeout if read_timeout is not None else getattr(settings, 'LLM_HTTP_READ_TIMEOUT', 60.0)
+        self.max_retries = max_retries if max_retries is not None else getattr(settings, 'LLM_HTTP_MAX_RETRIES', 0)
+        self.backoff_factor = backoff_factor if backoff_factor is not None else getattr(settings, 'LLM_HTTP_BACKOFF_FACTOR', 0.5)
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, requests.Session] = {}
+        self._stats: Dict[str, PoolStats] = {}
+
+    def _build_retry(self) -> Retry:
+        """Повторяем ошибки соединения и временные ответы сервера (429, 5xx)."""
+        return Retry(
+            total=self.max_retries,
+            connect=self.max_retries,
+            read=0,
+            status=self.max_retries,
+            status_forcelist=(429, 502, 503, 504),
+            allowed_methods=frozenset({'GET', 'POST'}),
+            backoff_factor=self.backoff_factor,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+
+    def get_session(self, host: str) -> requests.Session:
+        """Возвращает сессию с пулом соединений для указанного хоста."""
+        with self._lock:
+            session = self._sessions.get(host)
+            if session is None:
+                stats = PoolStats()
+                adapter = InstrumentedHTTPAdapter(
+                    stats,
+                    pool_connections=1,
+                    pool_maxsize=self.pool_size,
+                    pool_block=self.pool_block,
+                    max_retries=self._build_retry(),
+                )
+                session = requests.Session()
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._sessions[host] = session
+                self._stats[host] = stats
+                logger.info(f"Создан пул соединений для {host} (размер: {self.pool_size})")
+            return session
+
+    def request(self, method: str, url: str, **kwargs) -> requests.Response:
+        """Выполняет запрос через пул соединений хоста из URL."""
+        if 'timeout' not in kwargs:
+            kwargs['timeout'] = self._timeouts()
+        session = self.get_session(urlparse(url).hostname)
+        return session.request(method, url, **kwargs)
+
+    def _timeouts(self) -> Tuple[float, float]:
+        """Таймауты (соединение, чтение), не выходящие за дедлайн текущего вызова провайдера."""
+        remaining = remaining_time()
+        if remaining is None:
+            return self.connect_timeout, self.read_timeout
+        remaining = max(remaining, 0.1)
+        return min(self.connect_timeout, remaining), min(self.read_timeout, remaining)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Возвращает статистику пулов по хостам."""
+        with self._lock:
+            stats = dict(self._stats)
+        result = {}
+        for host, host_stats in stats.items():
+            result[host] = host_stats.as_dict()
+            result[host]['pool_size'] = self.pool_size
+        return result
+
+    def close(self):
+        """Закрывает все пулы соединений."""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._sessions.clear()
+            self._stats.clear()
+
+
+# Общий для процесса HTTP-клиент с пулами соединений по хостам провайдеров
+http_client = ProviderHTTPClient()
+
+
+class AsyncProviderHTTPClient:
+    """
+    Неблокирующий HTTP-клиент (httpx) для асинхронных обращений к провайдерам.
+
+    Настройки пула и таймаутов совпадают с ProviderHTTPClient. Клиенты httpx
+    привязаны к циклу событий, поэтому пулы хранятся отдельно для каждого
+    цикла и для каждого хоста и закрываются, когда цикл завершается
+    (asyncio.run и async_to_sync вызывают loop.shutdown_asyncgens).
+
+    Соединения переиспользуются только под ASGI, где цикл событий один на
+    процесс. Под WSGI асинхронные представления выполняются через
+    async_to_sync в новом цикле на каждый запрос, поэтому пул живет
+    один запрос.
+    """
+
+    def __init__(self, sync_client: ProviderHTTPClient):
+        self.sync_client = sync_client
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[Dict[Tuple[str, bool], httpx.AsyncClient], AsyncIterator[None]]]" = weakref.WeakKeyDictionary()
+
+    async def _loop_lifetime(self, loop: asyncio.AbstractEventLoop,
+                             clients: Dict[Tuple[str, bool], httpx.AsyncClient]) -> AsyncIterator[None]:
+        """
+        Асинхронный генератор, который цикл событий закрывает при завершении
+        (shutdown_asyncgens): в этот момент закрываются клиенты цикла.
+        """
+        try:
+            yield
+        finally:
+            # Клиенты httpx ссылаются на цикл, поэтому запись удаляется явно, а не только по слабой ссылке
+            self._clients.pop(loop, None)
+            for client in list(clients.values()):
+                await client.aclose()
+            clients.clear()
+
+    async def get_client(self, host: str, verify: bool = True) -> httpx.AsyncClient:
+        """Возвращает клиент с пулом соединений для хоста в текущем цикле событий."""
+        loop = asyncio.get_running_loop()
+        entry = self._clients.get(loop)
+        if entry is None:
+            clients = {}
+            lifetime = self._loop_lifetime(loop, clients)
+            # Первый шаг регистрирует генератор в цикле; ссылка на него хранится, пока жив цикл
+            await lifetime.__anext__()
+            entry = self._clients[loop] = (clients, lifetime)
+        clients = entry[0]
+        client = clients.get((host, verify))
+        if client is None:
+            pool_size = self.sync_client.pool_size
+            # Повторы транспорта httpx покрывают только ошибки установки соединения
+            transport = httpx.AsyncHTTPTransport(
+                verify=verify,
+                limits=httpx.Limits(max_connections=pool_size, max_keepalive_connections=pool_size),
+                retries=self.sync_client.max_retries,
+            )
+            client = httpx.AsyncClient(
+                transport=transport,
+                timeout=httpx.Timeout(self.sync_client.read_timeout, connect=self.sync_client.connect_timeout),
+            )
+            clients[(host, verify)] = client
+        return client
+
+    async def request(self, method: str, url: str, verify: bool = True, **kwargs) -> httpx.Response:
+        client = await self.get_client(urlparse(url).hostname, verify)
+        if 'timeout' not in kwargs and remaining_time() is not None:
+            connect_timeout, read_timeout = self.sync_client._timeouts()
+            kwargs['timeout'] = httpx.Timeout(read_timeout, connect=connect_timeout)
+        return await client.request(method, url, **kwargs)
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request('GET', url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request('POST', url, **kwargs)
+
+
+async_http_client = AsyncProviderHTTPClient(http_client)
+
+
+class GigaChatAuthError(ProviderAuthError):
+    """Ошибка получения токена доступа GigaChat."""
+
+    def __init__(self, message: str, retryable: bool = False, status_code: Optional[int] = None):
+        super().__init__(message, 'gigachat', retryable=retryable, status_code=status_code)
+
+
+class GigaChatTokenCache:
+    """
+    Потокобезопасный кэш токенов доступа GigaChat на уровне процесса.
+
+    Токены хранятся по ключу (api key, scope) вместе с моментом истечения
+    из ответа OAuth. Незадолго до истечения токен обновляется в фоновом
+    потоке, а одновременные запросы без действующего токена ждут одно
+    общее обновление вместо того, чтобы запрашивать токен каждый сам.
+    """
+
+    def __init__(self, refresh_margin: float = 120.0, min_valid: float = 5.0):
+        # За сколько секунд до истечения запускать фоновое обновление
+        self.refresh_margin = refresh_margin
+        # Токен, которому осталось жить меньше этого, считается истекшим
+        self.min_valid = min_valid
+        self._lock = threading.Lock()
+        self._tokens: Dict[Tuple[str, str], Tuple[str, float]] = {}
+        self._key_locks: Dict[Tuple[str, str], threading.Lock] = {}
+        self._background: Dict[Tuple[str, str], threading.Thread] = {}
+
+    def get_token(self, api_key: str, scope: str) -> str:
+        """Возвращает действующий токен, при необходимости получая новый."""
+        key = (api_key, scope)
+        token = self._get_valid(key)
+        if token:
+            return token
+
+        # Только один поток выполняет обновление, остальные ждут его результат
+        with self._get_key_lock(key):
+            token = self._get_valid(key)
+            if token:
+                return token
+            return self._refresh(key)
+
+    def invalidate(self, api_key: str, scope: str):
+        """Удаляет токен из кэша (например, после ответа 401)."""
+        with self._lock:
+            self._tokens.pop((api_key, scope), None)
+
+    def clear(self):
+        """Очищает кэш токенов."""
+        with self._lock:
+            self._tokens.clear()
+
+    def _get_key_lock(self, key: Tuple[str, str]) -> threading.Lock:
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def _get_valid(self, key: Tuple[str, str]) -> Optional[str]:
+        """Возвращает токен из кэша, если он еще действует."""
+        with self._lock:
+            cached = self._tokens.get(key)
+        if not cached:
+            return None
+
+        token, expires_at = cached
+        remaining = expires_at - time.time()
+        if remaining <= self.min_valid:
+            return None
+        if remaining <= self.refresh_margin:
+            self._schedule_background_refresh(key)
+        return token
+
+    def _schedule_background_refresh(self, key: Tuple[str, str]):
+        """Запускает фоновое обновление токена, если оно еще не запущено."""
+        with self._lock:
+            thread = self._background.get(key)
+            if thread and thread.is_alive():
+                return
+            thread = threading.Thread(
+                target=self._background_refresh,
+                args=(key,),
+                name="gigachat-token-refresh",
+                daemon=True,
+            )
+            self._background[key] = thread
+        thread.start()
+
+    def _background_refresh(self, key: Tuple[str, str]):
+        lock = self._get_key_lock(key)
+        if not lock.acquire(blocking=False):
+            # Обновление уже выполняется в другом потоке
+            return
+        try:
+            with self._lock:
+                cached = self._tokens.get(key)
+            if cached and cached[1] - time.time() > self.refresh_margin:
+                return
+            self._refresh(key)
+        except GigaChatAuthError as e:
+            logger.warning(f"Фоновое обновление токена GigaChat не удалось: {e}")
+        finally:
+            lock.release()
+
+    def _refresh(self, key: Tuple[str, str]) -> str:
+        """Запрашивает новый токен и сохраняет его в кэше. Вызывается под блокировкой ключа."""
+        token, expires_at = self._request_token(*key)
+        with self._lock:
+            self._tokens[key] = (token, expires_at)
+        logger.info(f"Токен доступа GigaChat обновлен, действует {int(expires_at - time.time())} сек.")
+        return token
+
+    def _request_token(self, api_key: str, scope: str) -> Tuple[str, float]:
+        """Получает токен доступа через OAuth endpoint GigaChat."""
+        auth_headers = {
+            'Content-Type': 'application/x-www-form-urlencoded',
+            'Accept': 'application/json',
+            'RqUID': str(uuid.uuid4()),
+            'Authorization': f'Basic {api_key}'
+        }
+
+        try:
+            auth_response = http_client.post(
+                GIGACHAT_AUTH_URL, data={"scope": scope}, headers=auth_headers, verify=False
+            )
+        except requests.RequestException as e:
+            raise GigaChatAuthError(
+                f"Ошибка авторизации GigaChat: {str(e)}",
+                retryable=isinstance(e, (requests.ConnectionError, requests.ConnectTimeout)),
+            )
+
+        logger.info(f"Статус ответа авторизации: {auth_response.status_code}")
+        if auth_response.status_code != 200:
+            logger.error(f"Текст ответа авторизации: {auth_response.text}")
+            raise GigaChatAuthError(
+                f"Ошибка авторизации GigaChat: {auth_response.status_code} - {auth_response.text}",
+                retryable=auth_response.status_code in RETRYABLE_STATUSES,
+                status_code=auth_response.status_code,
+            )
+
+        auth_result = auth_response.json()
+        access_token = auth_result.get('access_token')
+        if not access_token:
+            raise GigaChatAuthError("Не удалось получить токен доступа GigaChat")
+
+        # GigaChat возвращает expires_at в миллисекундах; по документации токен живет 30 минут
+        expires_at = auth_result.get('expires_at')
+        if expires_at:
+            expires_at = float(expires_at)
+            if expires_at > 1e11:
+                expires_at /= 1000
+        else:
+            expires_at = time.time() + 30 * 60
+
+        return access_token, expires_at
+
+
+# Общий для всех экземпляров LLMService кэш токенов
+gigachat_token_cache = GigaChatTokenCache()
+
+
+class ResponseCache:
+    """
+    Кеш ответов модели по точному совпадению запроса.
+
+    Ключ — sha256 канонического JSON из модели, сообщений, параметров
+    сэмплирования и функций. Хранилище — алиас LLM_RESPONSE_CACHE_ALIAS
+    кеш-фреймворка Django (TTL и вытеснение давно не использованных
+    записей задаются в CACHES). Пустые ответы не кешируются; ошибки провайдера
+    передаются исключениями и в кеш не попадают.
+    """
+    
+    KEY_PREFIX = 'llm-response'
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+    
+    @property
+    def cache(self):
+        return caches[getattr(settings, 'LLM_RESPONSE_CACHE_ALIAS', 'llm_responses')]
+    
+    def make_key(self, model: str, messages: List[Dict[str, str]], temperature: float, top_p: float,
+                 max_tokens: int, functions: List[Dict[str, Any]] = None) -> str:
+        """Строит ключ по нормализованному запросу."""
+        payload = {
+            'model': model,
+            'messages': [{'role': m['role'], 'content': m['content'].strip()} for m in messages],
+            'temperature': round(float(temperature), 4),
+            'top_p': round(float(top_p), 4),
+            'max_tokens': int(max_tokens),
+            # Порядок функций в запросе не влияет на ответ
+            'functions': sorted(
+                json.dumps(f, sort_keys=True, ensure_ascii=False) for f in (functions or [])
+            ),
+        }
+        canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+        return f"{self.KEY_PREFIX}:{hashlib.sha256(canonical.encode('utf-8')).hexdigest()}"
+    
+    @staticmethod
+    def is_cacheable(result: Dict[str, Any]) -> bool:
+        return bool(result.get('content'))
+    
+    def _count(self, hit: bool):
+        with self._lock:
+            if hit:
+                self._hits += 1
+            else:
+                self._misses += 1
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        cached = self.cache.get(key)
+        self._count(cached is not None)
+        return cached
+    
+    async def aget(self, key: str) -> Optional[Dict[str, Any]]:
+        cached = await self.cache.aget(key)
+        self._count(cached is not None)
+        return cached
+    
+    def set(self, key: str, result: Dict[str, Any]):
+        if self.is_cacheable(result):
+            self.cache.set(key, result)
+    
+    async def aset(self, key: str, result: Dict[str, Any]):
+        if self.is_cacheable(result):
+            await self.cache.aset(key, result)
+    
+    def get_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses}
+
+
+response_cache = ResponseCache()
+
+
+@dataclass
+class ProviderResult:
+    """
+    Результат вызова провайдера.
+
+    usage — количество токенов по данным провайдера (input_tokens,
+    output_tokens, total_tokens) или None, если провайдер его не вернул.
+    """
+    content: str
+    usage: Optional[Dict[str, int]] = None
+    finish_reason: Optional[str] = None
+    latency_ms: float = 0.0
+
+
+def _gigachat_usage(data: Dict[str, Any]) -> Optional[Dict[str, int]]:
+    """Извлекает usage из ответа GigaChat (в формате OpenAI)."""
+    usage = data.get('usage')
+    if not usage:
+        return None
+    return {
+        'input_tokens': int(usage.get('prompt_tokens', 0)),
+        'output_tokens': int(usage.get('completion_tokens', 0)),
+        'total_tokens': int(usage.get('total_tokens', 0)),
+    }
+
+
+def _yandex_usage(data: Dict[str, Any]) -> Optional[Dict[str, int]]:
+    """Извлекает result.usage из ответа Yandex GPT (значения приходят строками)."""
+    usage = data.get('result', {}).get('usage')
+    if not usage:
+        return None
+    return {
+        'input_tokens': int(usage.get('inputTextTokens', 0)),
+        'output_tokens': int(usage.get('completionTokens', 0)),
+        'total_tokens': int(usage.get('totalTokens', 0)),
+    }
+
+
+class ProviderAdapter:
+    """
+    Адаптер провайдера LLM: формирует запросы к API провайдера и разбирает ответы.
+
+    Подкласс регистрируется декоратором register_provider под именем name,
+    которое совпадает с ключом провайдера в model_config.AVAILABLE_MODELS.
+    Учетные данные читаются из окружения при создании экземпляра.
+    """
+    name = None
+    
+    def call(self, model: str, messages: List[Dict[str, str]],
+             temperature: float, top_p: float, max_tokens: int,
+             functions: List[Dict[str, Any]] = None) -> ProviderResult:
+        raise NotImplementedError
+    
+    async def acall(self, model: str, messages: List[Dict[str, str]],
+                    temperature: float, top_p: float, max_tokens: int,
+                    functions: List[Dict[str, Any]] = None) -> ProviderResult:
+        raise NotImplementedError
+    
+    def stream(self, model: str, messages: List[Dict[str, str]],
+               temperature: float, top_p: float, max_tokens: int,
+               functions: List[Dict[str, Any]] = None,
+               result: Optional[ProviderResult] = None) -> Iterator[str]:
+        raise NotImplementedError
+
+
+# Адаптеры провайдеров по имени провайдера
+PROVIDER_ADAPTERS: Dict[str, type] = {}
+
+
+def register_provider(adapter_class):
+    """Регистрирует класс адаптера провайдера под его именем (декоратор)."""
+    if not adapter_class.name:
+        raise ValueError(f"У адаптера {adapter_class.__name__} не задано имя провайдера")
+    PROVIDER_ADAPTERS[adapter_class.name] = adapter_class
+    return adapter_class
+
+
+@register_provider
+class GigaChatAdapter(ProviderAdapter):
+    """Адаптер GigaChat API."""
+    name = 'gigachat'
+    
+    def __init__(self):
+        self.api_key = os.environ.get('GIGACHAT_API_KEY')
+        self.client_secret = os.environ.get('GIGACHAT_CLIENT_SECRET')
+        self.scope = os.environ.get('GIGACHAT_SCOPE', 'GIGACHAT_API_PERS')
+    
+    def _check_config(self):
+        if not self.api_key:
+            raise ProviderConfigError("API ключ GigaChat не настроен", self.name)
+    
+    def build_request(self, model: str, messages: List[Dict[str, str]],
+                      temperature: float, top_p: float, max_tokens: int,
+                      functions: List[Dict[str, Any]] = None, stream: bool = False) -> Dict[str, Any]:
+        """Формирует тело запроса к GigaChat API."""
+        # Преобразуем сообщения в формат GigaChat
+        gigachat_messages = []
+        for msg in messages:
+            gigachat_messages.append({
+                "role": msg["role"],
+                "content": msg["content"]
+            })
+        
+        api_data = {
+            "model": model,
+            "messages": gigachat_messages,
+            "temperature": temperature,
+            "top_p": top_p,
+            "max_tokens": max_tokens
+        }
+        
+        if stream:
+            api_data["stream"] = True
+        
+        # Добавляем функции если они есть
+        if functions:
+            api_data["functions"] = [func.get('json_definition', func) for func in functions]
+            api_data["function_call"] = "auto"
+        
+        return api_data
+    
+    def _post(self, api_data: Dict[str, Any], stream: bool = False) -> requests.Response:
+        """Отправляет запрос к GigaChat API с токеном из кэша."""
+        access_token = gigachat_token_cache.get_token(self.api_key, self.scope)
+        api_headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json"
+        }
+        if stream:
+            api_headers["Accept"] = "text/event-stream"
+        
+        logger.info(f"URL: {GIGACHAT_API_URL}")
+        logger.info(f"Данные запроса: {json.dumps(api_data, ensure_ascii=False, indent=2)}")
+        api_response = http_client.post(GIGACHAT_API_URL, headers=api_headers, json=api_data, verify=False, stream=stream)
+        logger.info(f"Статус ответа API: {api_response.status_code}")
+
+        # Токен мог быть отозван раньше срока - получаем новый и повторяем запрос один раз
+        if api_response.status_code == 401:
+            logger.warning("GigaChat отклонил токен доступа, обновляем токен")
+            api_response.close()
+            gigachat_token_cache.invalidate(self.api_key, self.scope)
+            access_token = gigachat_token_cache.get_token(self.api_key, self.scope)
+            api_headers["Authorization"] = f"Bearer {access_token}"
+            api_response = http_client.post(GIGACHAT_API_URL, headers=api_headers, json=api_data, verify=False, stream=stream)
+            logger.info(f"Статус повторного ответа API: {api_response.status_code}")
+        try:
+            api_response.raise_for_status()
+        except requests.HTTPError:
+            # Тело потокового ответа с ошибкой не читается: закрываем ответ, чтобы соединение вернулось в пул
+            api_response.close()
+            raise
+        return api_response
+    
+    def call(self, model: str, messages: List[Dict[str, str]],
+             temperature: float, top_p: float, max_tokens: int, functions: List[Dict[str, Any]] = None) -> ProviderResult:
+        """Вызов GigaChat API."""
+        self._check_config()
+        logger.info(f"API Key (первые 20 символов): {self.api_key[:20]}...")
+        
+        started = time.monotonic()
+        logger.info("Получаем токен доступа GigaChat")
+        api_data = self.build_request(model, messages, temperature, top_p, max_tokens, functions)
+        api_response = self._post(api_data)
+        api_result = api_response.json()
+        
+        logger.info("Успешно получен ответ от GigaChat API")
+        result = self.parse_response(api_result, started)
+        logger.info(f"Ответ GigaChat: {result.content[:200]}...")
+        return result
+    
+    @staticmethod
+    def parse_response(api_result: Dict[str, Any], started: float) -> ProviderResult:
+        choice = api_result['choices'][0]
+        return ProviderResult(
+            content=choice['message']['content'],
+            usage=_gigachat_usage(api_result),
+            finish_reason=choice.get('finish_reason'),
+            latency_ms=(time.monotonic() - started) * 1000,
+        )
+    
+    def stream(self, model: str, messages: List[Dict[str, str]],
+               temperature: float, top_p: float, max_tokens: int,
+               functions: List[Dict[str, Any]] = None,
+               result: Optional[ProviderResult] = None) -> Iterator[str]:
+        """
+        Потоковый вызов GigaChat API: отдает фрагменты ответа по мере их получения.
+
+        usage и finish_reason из событий потока записываются в result.
+        """
+        self._check_config()
+        api_data = self.build_request(model, messages, temperature, top_p, max_tokens, functions, stream=True)
+        api_response = self._post(api_data, stream=True)
+        
+        # GigaChat отдает события SSE вида "data: {...}" и завершает поток "data: [DONE]"
+        with api_response:
+            for line in api_response.iter_lines(decode_unicode=True):
+                if not line or not line.startswith('data:'):
+                    continue
+                payload = line[len('data:'):].strip()
+                if payload == '[DONE]':
+                    break
+                chunk = json.loads(payload)
+                if result is not None:
+                    result.usage = _gigachat_usage(chunk) or result.usage
+                for choice in chunk.get('choices', []):
+                    if result is not None and choice.get('finish_reason'):
+                        result.finish_reason = choice['finish_reason']
+                    delta = choice.get('delta', {}).get('content')
+                    if delta:
+                        yield delta
+    
+    async def _apost(self, api_data: Dict[str, Any]) -> httpx.Response:
+        """Асинхронно отправляет запрос к GigaChat API с токеном из кэша."""
+        # Токен почти всегда берется из кэша; обновление выполняется вне цикла событий
+        get_token = sync_to_async(gigachat_token_cache.get_token, thread_sensitive=False)
+        access_token = await get_token(self.api_key, self.scope)
+        api_headers = {
+            "Authorization": f"Bearer {access_token}",
+            "Content-Type": "application/json"
+        }
+        
+        api_response = await async_http_client.post(GIGACHAT_API_URL, headers=api_headers, json=api_data, verify=False)
+        logger.info(f"Статус ответа API: {api_response.status_code}")
+        
+        # Токен мог быть отозван раньше срока - получаем новый и повторяем запрос один раз
+        if api_response.status_code == 401:
+            logger.warning("GigaChat отклонил токен доступа, обновляем токен")
+            gigachat_token_cache.invalidate(self.api_key, self.scope)
+            access_token = await get_token(self.api_key, self.scope)
+            api_headers["Authorization"] = f"Bearer {access_token}"
+            api_response = await async_http_client.post(GIGACHAT_API_URL, headers=api_headers, json=api_data, verify=False)
+            logger.info(f"Статус повторного ответа API: {api_response.status_code}")
+        api_response.raise_for_status()
+        return api_response
+    
+    async def acall(self, model: str, messages: List[Dict[str, str]],
+                    temperature: float, top_p: float, max_tokens: int,
+                    functions: List[Dict[str, Any]] = None) -> ProviderResult:
+        """Асинхронный вызов GigaChat API."""
+        self._check_config()
+        started = time.monotonic()
+        api_data = self.build_request(model, messages, temperature, top_p, max_tokens, functions)
+        api_response = await self._apost(api_data)
+        api_result = api_response.json()
+        
+        logger.info("Успешно получен ответ от GigaChat API")
+        return self.parse_response(api_result, started)
+
+
+@register_provider
+class YandexAdapter(ProviderAdapter):
+    """Адаптер Yandex GPT API."""
+    name = 'yandex'
+    
+    def __init__(self):
+        self.api_key = os.environ.get('YANDEX_API_KEY')
+        self.folder_id = os.environ.get('YANDEX_FOLDER_ID')
+    
+    def _check_config(self):
+        if not self.api_key:
+            raise ProviderConfigError("API ключ Yandex не настроен", self.name)
+        if not self.folder_id:
+            raise ProviderConfigError("Folder ID Yandex не настроен", self.name)
+    
+    def build_request(self, model: str, messages: List[Dict[str, str]],
+                      temperature: float, top_p: float, max_tokens: int,
+                      stream: bool = False) -> Dict[str, Any]:
+        """Формирует тело запроса к Yandex GPT API."""
+        # Преобразуем сообщения в формат Yandex GPT
+        yandex_messages = []
+        for msg in messages:
+            yandex_messages.append({
+                "role": msg["role"],
+                "text": msg["content"]
+            })
+        
+        # Определяем правильное имя модели
+        if model == 'yandexgpt':
+            model_name = 'yandexgpt-lite'
+        else:
+            model_name = model
+            
+        # Yandex GPT поддерживает temperature только в диапазоне [0, 1]
+        yandex_temperature = min(temperature, 1.0)
+        if temperature > 1.0:
+            logger.info(f"Yandex GPT: ограничиваем temperature с {temperature} до {yandex_temperature}")
+        
+        # Yandex GPT поддерживает top_p только в диапазоне [0, 1]
+        yandex_top_p = min(top_p, 1.0)
+        if top_p > 1.0:
+            logger.info(f"Yandex GPT: ограничиваем top_p с {top_p} до {yandex_top_p}")
+        
+        # Используем folder_id (основной идентификатор)
+        logger.info(f"Используем folder_id: {self.folder_id}")
+        return {
+            "modelUri": f"gpt://{self.folder_id}/{model_name}",
+            "completionOptions": {
+                "stream": stream,
+                "temperature": yandex_temperature,
+                "topP": yandex_top_p,
+                "maxTokens": max_tokens
+            },
+            "messages": yandex_messages
+        }
+    
+    def _headers(self) -> Dict[str, str]:
+        return {
+            "Authorization": f"Api-Key {self.api_key}",
+            "Content-Type": "application/json",
+            "x-data-logging-enabled": "false"
+        }
+    
+    def call(self, model: str, messages: List[Dict[str, str]],
+             temperature: float, top_p: float, max_tokens: int, functions: List[Dict[str, Any]] = None) -> ProviderResult:
+        """Вызов Yandex GPT API."""
+        self._check_config()
+        logger.info("Отправляем запрос к Yandex GPT API")
+        data = self.build_request(model, messages, temperature, top_p, max_tokens)
+        
+        started = time.monotonic()
+        logger.info(f"URL: {YANDEX_API_URL}")
+        logger.info(f"Данные запроса: {json.dumps(data, ensure_ascii=False, indent=2)}")
+        response = http_client.post(YANDEX_API_URL, headers=self._headers(), json=data)
+        logger.info(f"Статус ответа: {response.status_code}")
+        logger.info(f"Текст ответа: {response.text}")
+        response.raise_for_status()
+        result = response.json()
+        logger.info("Успешно получен ответ от Yandex GPT API")
+        provider_result = self.parse_response(result, started)
+        logger.info(f"Ответ Yandex: {provider_result.content[:200]}...")
+        return provider_result
+    
+    @staticmethod
+    def parse_response(result: Dict[str, Any], started: float) -> ProviderResult:
+        alternative = result['result']['alternatives'][0]
+        return ProviderResult(
+            content=alternative['message']['text'],
+            usage=_yandex_usage(result),
+            finish_reason=alternative.get('status'),
+            latency_ms=(time.monotonic() - started) * 1000,
+        )
+    
+    async def acall(self, model: str, messages: List[Dict[str, str]],
+                    temperature: float, top_p: float, max_tokens: int,
+                    functions: List[Dict[str, Any]] = None) -> ProviderResult:
+        """Асинхронный вызов Yandex GPT API."""
+        self._check_config()
+        data = self.build_request(model, messages, temperature, top_p, max_tokens)
+        
+        started = time.monotonic()
+        response = await async_http_client.post(YANDEX_API_URL, headers=self._headers(), json=data)
+        logger.info(f"Статус ответа: {response.status_code}")
+        response.raise_for_status()
+        result = response.json()
+        logger.info("Успешно получен ответ от Yandex GPT API")
+        return self.parse_response(result, started)
+    
+    def stream(self, model: str, messages: List[Dict[str, str]],
+               temperature: float, top_p: float, max_tokens: int,
+               functions: List[Dict[str, Any]] = None,
+               result: Optional[ProviderResult] = None) -> Iterator[str]:
+        """
+        Потоковый вызов Yandex GPT API: отдает фрагменты ответа по мере их получения.
+
+        usage и статус альтернативы из последнего объекта потока записываются в result.
+        """
+        self._check_config()
+        data = self.build_request(model, messages, temperature, top_p, max_tokens, stream=True)
+        logger.info(f"URL: {YANDEX_API_URL} (stream)")
+        response = http_client.post(YANDEX_API_URL, headers=self._headers(), json=data, stream=True)
+        logger.info(f"Статус ответа: {response.status_code}")
+        
+        # Yandex GPT отдает JSON-объекты построчно, в каждом - весь текст, накопленный к этому моменту
+        sent = 0
+        # Ответ закрывается и при ошибке HTTP: непрочитанное тело иначе удерживает соединение пула
+        with response:
+            response.raise_for_status()
+            for line in response.iter_lines(decode_unicode=True):
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if result is not None:
+                    result.usage = _yandex_usage(chunk) or result.usage
+                alternatives = chunk.get('result', {}).get('alternatives', [])
+                if not alternatives:
+                    continue
+                if result is not None:
+                    result.finish_reason = alternatives[0].get('status', result.finish_reason)
+                text = alternatives[0].get('message', {}).get('text', '')
+                if len(text) > sent:
+                    yield text[sent:]
+                    sent = len(text)
+
 
 class LLMService:
     """Сервис для работы с различными LLM API."""
     
     def __init__(self):
-        self.gigachat_api_key = os.environ.get('GIGACHAT_API_KEY')
-        self.gigachat_client_secret = os.environ.get('GIGACHAT_CLIENT_SECRET')
-        self.gigachat_scope = os.environ.get('GIGACHAT_SCOPE', 'GIGACHAT_API_PERS')
-        self.yandex_api_key = os.environ.get('YANDEX_API_KEY')
-        self.yandex_folder_id = os.environ.get('YANDEX_FOLDER_ID')
         self.token_counter = TokenCounter()
+        self._adapters: Dict[str, ProviderAdapter] = {}
     
     def generate_response(self, model: str, messages: List[Dict[str, str]], 
                          temperature: float = 0.7, top_p: float = 1.0, max_tokens: int = 4000,
-                         files: List[Dict[str, Any]] = None, functions: List[Dict[str, Any]] = None) -> Dict[str, Any]:
-        """Генерирует ответ от LLM и возвращает ответ с информацией о токенах."""
+                         files: List[Dict[str, Any]] = None, functions: List[Dict[str, Any]] = None,
+                         use_cache: bool = False) -> Dict[str, Any]:
+        """
+        Генерирует ответ от LLM и возвращает ответ с информацией о токенах.
+
+        При use_cache=True одинаковые запросы обслуживаются из кеша ответов
+        без обращения к провайдеру; такой результат имеет нулевую стоимость
+        и cache['hit'] = True.
+        """
         
         logger.info(f"=== НАЧИНАЕМ ГЕНЕРАЦИЮ ОТВЕТА ===")
         logger.info(f"Модель: '{model}'")
@@ -38,51 +939,229 @@ class LLMService:
         if files:
             messages = self._process_files_for_messages(messages, files)
         
-        # Подсчитываем токены на входе
-        input_tokens = self.token_counter.count_messages_tokens(messages, model)
-        logger.info(f"Входящие токены: {input_tokens}")
+        cache_key = None
+        if use_cache:
+            cache_key = response_cache.make_key(model, messages, temperature, top_p, max_tokens, functions)
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                return self._cached_result(model, cached, cache_key)
         
-        # Определяем провайдера по модели
-        logger.info(f"Модель для выбора API: '{model}'")
+        adapter = self.get_adapter(model)
+        limiter = get_limiter(adapter.name)
+        reserved_tokens = self._reserved_tokens(limiter, model, messages, max_tokens)
         
-        if 'gigachat' in model.lower():
-            logger.info("Используем GigaChat API")
-            response_text = self._call_gigachat(model, messages, temperature, top_p, max_tokens, functions)
-        elif 'yandex' in model.lower():
-            logger.info("Используем Yandex GPT API")
-            response_text = self._call_yandex(model, messages, temperature, top_p, max_tokens, functions)
-        else:
-            # По умолчанию используем GigaChat
-            logger.warning(f"Неизвестная модель '{model}', используем GigaChat API (по умолчанию)")
-            response_text = self._call_gigachat(model, messages, temperature, top_p, max_tokens, functions)
+        def attempt():
+            with limiter.acquire(reserved_tokens) as usage:
+                provider_result = adapter.call(model, messages, temperature, top_p, max_tokens, functions)
+                
+                logger.info(f"Получен ответ длиной: {len(provider_result.content)} символов")
+                
+                result = self._build_result(model, messages, provider_result)
+                usage['tokens'] = result['total_tokens']
+                return result
+        
+        # Временные сбои повторяются; ошибка провайдера передается исключением ProviderError
+        result = call_with_retries(adapter.name, attempt)
+        if cache_key:
+            response_cache.set(cache_key, result)
+            result['cache'] = {'hit': False, 'key': cache_key}
+        return result
+    
+    def generate_response_stream(self, model: str, messages: List[Dict[str, str]],
+                                 temperature: float = 0.7, top_p: float = 1.0, max_tokens: int = 4000,
+                                 files: List[Dict[str, Any]] = None,
+                                 functions: List[Dict[str, Any]] = None,
+                                 use_cache: bool = False) -> Iterator[Dict[str, Any]]:
+        """
+        Потоковая генерация ответа.
+
+        Отдает события {'type': 'delta', 'content': ...} по мере получения
+        фрагментов от провайдера, затем одно событие {'type': 'done', ...}
+        с полным текстом и статистикой токенов (как у generate_response)
+        либо {'type': 'error', 'error': ProviderError} при обрыве потока после
+        первого фрагмента. Ошибка до начала ответа вызывает ProviderError.
+        """
+        logger.info(f"=== НАЧИНАЕМ ПОТОКОВУЮ ГЕНЕРАЦИЮ ОТВЕТА === Модель: '{model}'")
+        
+        if files:
+            messages = self._process_files_for_messages(messages, files)
+        
+        cache_key = None
+        if use_cache:
+            cache_key = response_cache.make_key(model, messages, temperature, top_p, max_tokens, functions)
+            cached = response_cache.get(cache_key)
+            if cached is not None:
+                # Ответ из кеша отдается одним фрагментом
+                result = self._cached_result(model, cached, cache_key)
+                yield {'type': 'delta', 'content': result['content']}
+                result['type'] = 'done'
+                yield result
+                return
         
-        logger.info(f"Получен ответ длиной: {len(response_text)} символов")
+        adapter = self.get_adapter(model)
+        limiter = get_limiter(adapter.name)
+        # Слот провайдера занят, пока поток не будет прочитан до конца
+        with limiter.acquire(self._reserved_tokens(limiter, model, messages, max_tokens)) as usage:
+            # Поток заполняет usage и finish_reason, если провайдер передал их в последних событиях
+            provider_result = ProviderResult(content='')
+            started = time.monotonic()
+            
+            def open_stream():
+                # Запрос отправляется при получении первого фрагмента, поэтому повторяется до начала ответа
+                stream = adapter.stream(model, messages, temperature, top_p, max_tokens, functions, provider_result)
+                return stream, next(stream, None)
+            
+            stream, first_delta = call_with_retries(adapter.name, open_stream)
+            
+            parts = []
+            try:
+                if first_delta is not None:
+                    parts.append(first_delta)
+                    yield {'type': 'delta', 'content': first_delta}
+                for delta in stream:
+                    parts.append(delta)
+                    yield {'type': 'delta', 'content': delta}
+            except Exception as e:
+                # Часть ответа уже отправлена клиенту, поэтому обрыв потока не повторяется
+                error = classify_error(adapter.name, e)
+                get_breaker(adapter.name).record(error)
+                logger.error(f"Ошибка потоковой генерации ответа модели '{model}': {str(error)}")
+                yield {'type': 'error', 'error': error}
+                return
+            
+            provider_result.content = ''.join(parts)
+            provider_result.latency_ms = (time.monotonic() - started) * 1000
+            logger.info(f"Потоковый ответ завершен, длина: {len(provider_result.content)} символов")
+            
+            result = self._build_result(model, messages, provider_result)
+            usage['tokens'] = result['total_tokens']
+        if cache_key:
+            response_cache.set(cache_key, result)
+            result['cache'] = {'hit': False, 'key': cache_key}
+        result['type'] = 'done'
+        yield result
+    
+    async def agenerate_response(self, model: str, messages: List[Dict[str, str]],
+                                 temperature: float = 0.7, top_p: float = 1.0, max_tokens: int = 4000,
+                                 files: List[Dict[str, Any]] = None,
+                                 functions: List[Dict[str, Any]] = None,
+                                 use_cache: bool = False) -> Dict[str, Any]:
+        """Асинхронная версия generate_response: ожидание ответа провайдера не занимает поток."""
+        logger.info(f"=== НАЧИНАЕМ АСИНХРОННУЮ ГЕНЕРАЦИЮ ОТВЕТА === Модель: '{model}'")
         
-        # Подсчитываем токены в ответе
-        output_tokens = self.token_counter.count_tokens(response_text, model)
+        if files:
+            messages = self._process_files_for_messages(messages, files)
+        
+        cache_key = None
+        if use_cache:
+            cache_key = response_cache.make_key(model, messages, temperature, top_p, max_tokens, functions)
+            cached = await response_cache.aget(cache_key)
+            if cached is not None:
+                return self._cached_result(model, cached, cache_key)
+        
+        adapter = self.get_adapter(model)
+        limiter = get_limiter(adapter.name)
+        reserved_tokens = self._reserved_tokens(limiter, model, messages, max_tokens)
+        
+        async def attempt():
+            async with limiter.aacquire(reserved_tokens) as usage:
+                provider_result = await adapter.acall(model, messages, temperature, top_p, max_tokens, functions)
+                
+                logger.info(f"Получен ответ длиной: {len(provider_result.content)} символов")
+                
+                result = self._build_result(model, messages, provider_result)
+                usage['tokens'] = result['total_tokens']
+                return result
+        
+        result = await acall_with_retries(adapter.name, attempt)
+        if cache_key:
+            await response_cache.aset(cache_key, result)
+            result['cache'] = {'hit': False, 'key': cache_key}
+        return result
+    
+    def get_adapter(self, model: str) -> ProviderAdapter:
+        """
+        Возвращает адаптер провайдера модели по реестру моделей.
+
+        Для модели, отсутствующей в реестре, вызывает UnknownModelError.
+        """
+        provider = require_model_spec(model).provider
+        adapter = self._adapters.get(provider)
+        if adapter is None:
+            adapter_class = PROVIDER_ADAPTERS.get(provider)
+            if adapter_class is None:
+                raise UnknownModelError(f"Для провайдера '{provider}' модели '{model}' не зарегистрирован адаптер")
+            adapter = self._adapters[provider] = adapter_class()
+        logger.info(f"Модель '{model}': провайдер {provider}")
+        return adapter
+    
+    def _reserved_tokens(self, limiter: ProviderLimiter, model: str,
+                         messages: List[Dict[str, str]], max_tokens: int) -> int:
+        """Токены, резервируемые в поминутном лимите до ответа: запрос и максимальная длина ответа."""
+        if not limiter.limits_tokens:
+            return 0
+        return self.token_counter.count_messages_tokens(messages, model) + max_tokens
+    
+    def _build_result(self, model: str, messages: List[Dict[str, str]],
+                      provider_result: ProviderResult) -> Dict[str, Any]:
+        """
+        Собирает результат генерации с токенами и стоимостью.
+
+        Используется количество токенов, которое вернул провайдер (token_source
+        = 'provider'); локальный подсчет TokenCounter выполняется, только если
+        провайдер его не передал (token_source = 'local').
+        """
+        usage = provider_result.usage
+        if usage:
+            input_tokens = usage['input_tokens']
+            output_tokens = usage['output_tokens']
+            token_source = 'provider'
+        else:
+            input_tokens = self.token_counter.count_messages_tokens(messages, model)
+            output_tokens = self.token_counter.count_tokens(provider_result.content, model)
+            token_source = 'local'
         total_tokens = input_tokens + output_tokens
         
         # Оцениваем стоимость
         cost_info = self.token_counter.estimate_cost(input_tokens, output_tokens, model)
         
-        logger.info(f"Итоговые токены: входящие={input_tokens}, исходящие={output_tokens}, всего={total_tokens}")
+        logger.info(f"Итоговые токены ({token_source}): входящие={input_tokens}, исходящие={output_tokens}, всего={total_tokens}")
         logger.info(f"Оценка стоимости: {cost_info}")
         
         return {
-            'content': response_text,
+            'content': provider_result.content,
             'input_tokens': input_tokens,
             'output_tokens': output_tokens,
             'total_tokens': total_tokens,
             'cost': cost_info,
-            'model': model
+            'model': model,
+            'token_source': token_source,
+            'finish_reason': provider_result.finish_reason,
+            'latency_ms': round(provider_result.latency_ms, 1),
         }
     
+    def _cached_result(self, model: str, cached: Dict[str, Any], cache_key: str) -> Dict[str, Any]:
+        """Результат из кеша ответов: провайдер не вызывался, поэтому стоимость нулевая."""
+        logger.info(f"Ответ модели '{model}' взят из кеша: {cache_key}")
+        result = dict(cached)
+        result['cost'] = self.token_counter.estimate_cost(0, 0, model)
+        result['cache'] = {
+            'hit': True,
+            'key': cache_key,
+            'saved_cost': cached['cost']['total_cost'],
+        }
+        return result
+    
     def _process_files_for_messages(self, messages: List[Dict[str, str]], files: List[Dict[str, Any]]) -> List[Dict[str, str]]:
-        """Обрабатывает файлы и добавляет их содержимое к сообщениям."""
+        """Обрабатывает файлы и добавляет их содержимое к текущему (последнему) сообщению пользователя."""
         processed_messages = []
+        last_user_index = max(
+            (index for index, message in enumerate(messages) if message['role'] == 'user'),
+            default=None
+        )
         
-        for message in messages:
-            if message['role'] == 'user' and files:
+        for index, message in enumerate(messages):
+            if index == last_user_index and files:
                 # Добавляем содержимое файлов к пользовательскому сообщению
                 file_content = self._format_files_content(files)
                 if file_content:
@@ -141,220 +1220,40 @@ class LLMService:
         
         return "\n\n".join(content_parts)
     
-    def _call_gigachat(self, model: str, messages: List[Dict[str, str]], 
-                      temperature: float, top_p: float, max_tokens: int, functions: List[Dict[str, Any]] = None) -> str:
-        """Вызов GigaChat API."""
-        if not self.gigachat_api_key:
-            logger.error("API ключ GigaChat не настроен")
-            return "Ошибка: API ключ GigaChat не настроен"
-        
-        logger.info(f"API Key (первые 20 символов): {self.gigachat_api_key[:20]}...")
+    def search_web(self, query: str, max_results: int = 5) -> List[Dict[str, str]]:
+        """Выполняет поиск в интернете по запросу."""
+        logger.info(f"Выполняем поиск в интернете: '{query}'")
         
         try:
-            logger.info("Получаем токен доступа GigaChat")
-            
-            # Генерируем уникальный RqUID согласно документации
-            import uuid
-            rq_uid = str(uuid.uuid4())
-            logger.info(f"RqUID: {rq_uid}")
-            
-            # URL для авторизации согласно документации
-            auth_url = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"
-            
-            # Данные для авторизации согласно документации
-            auth_data = {
-                "scope": self.gigachat_scope
-            }
-            
-            # Заголовки согласно документации
-            auth_headers = {
-                'Content-Type': 'application/x-www-form-urlencoded',
-                'Accept': 'application/json',
-                'RqUID': rq_uid,
-                'Authorization': f'Basic {self.gigachat_api_key}'
-            }
-            
-            logger.info(f"URL авторизации: {auth_url}")
-            logger.info(f"Данные авторизации: {auth_data}")
-            logger.info(f"Заголовки авторизации: {auth_headers}")
-            
-            # Отправляем запрос согласно документации
-            auth_response = requests.post(auth_url, data=auth_data, headers=auth_headers, timeout=30, verify=False)
-            logger.info(f"Статус ответа авторизации: {auth_response.status_code}")
-            
-            if auth_response.status_code != 200:
-                logger.error(f"Ошибка авторизации: {auth_response.status_code}")
-                logger.error(f"Заголовки ответа: {dict(auth_response.headers)}")
-                logger.error(f"Текст ответа: {auth_response.text}")
-                return f"Ошибка авторизации GigaChat: {auth_response.status_code} - {auth_response.text}"
-            
-            auth_result = auth_response.json()
-            access_token = auth_result.get('access_token')
-            
-            if not access_token:
-                logger.error("Не удалось получить токен доступа GigaChat")
-                return "Ошибка: не удалось получить токен доступа GigaChat"
-            
-            logger.info("Токен доступа получен, отправляем запрос к GigaChat API")
-            # Отправляем запрос к API
-            api_url = "https://gigachat.devices.sberbank.ru/api/v1/chat/completions"
-            api_headers = {
-                "Authorization": f"Bearer {access_token}",
-                "Content-Type": "application/json"
-            }
-            
-            # Преобразуем сообщения в формат GigaChat
-            gigachat_messages = []
-            for msg in messages:
-                gigachat_messages.append({
-                    "role": msg["role"],
-                    "content": msg["content"]
-                })
-            
-            api_data = {
-                "model": model,
-                "messages": gigachat_messages,
-                "temperature": temperature,
-                "top_p": top_p,
-                "max_tokens": max_tokens
-            }
-            
-            # Добавляем функции если они есть
-            if functions:
-                api_data["functions"] = [func.get('json_definition', func) for func in functions]
-                api_data["function_call"] = "auto"
-            
-            logger.info(f"URL: {api_url}")
-            logger.info(f"Данные запроса: {json.dumps(api_data, ensure_ascii=False, indent=2)}")
-            api_response = requests.post(api_url, headers=api_headers, json=api_data, timeout=30, verify=False)
-            logger.info(f"Статус ответа API: {api_response.status_code}")
-            api_response.raise_for_status()
-            api_result = api_response.json()
+            # Используем DuckDuckGo API для поиска (бесплатный и не требует API ключа)
+            search_url = SEARCH_API_URL
+            params = self._search_params(query)
             
-            logger.info("Успешно получен ответ от GigaChat API")
-            response_content = api_result['choices'][0]['message']['content']
-            logger.info(f"Ответ GigaChat: {response_content[:200]}...")
-            return response_content
+            response = http_client.get(search_url, params=params, timeout=(http_client.connect_timeout, 10))
+            response.raise_for_status()
+            results = self._parse_search_results(response.json(), max_results)
             
-        except Exception as e:
-            logger.error(f"Ошибка при обращении к GigaChat API: {str(e)}")
-            return f"Ошибка при обращении к GigaChat API: {str(e)}"
-    
-    def _call_yandex(self, model: str, messages: List[Dict[str, str]], 
-                     temperature: float, top_p: float, max_tokens: int, functions: List[Dict[str, Any]] = None) -> str:
-        """Вызов Yandex GPT API."""
-        if not self.yandex_api_key:
-            logger.error("API ключ Yandex не настроен")
-            return "Ошибка: API ключ Yandex не настроен"
-        
-        if not self.yandex_folder_id:
-            logger.error("Folder ID Yandex не настроен")
-            return "Ошибка: Folder ID Yandex не настроен"
-        
-        logger.info("Отправляем запрос к Yandex GPT API")
-        url = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
-        headers = {
-            "Authorization": f"Api-Key {self.yandex_api_key}",
-            "Content-Type": "application/json",
-            "x-data-logging-enabled": "false"
-        }
-        
-        # Преобразуем сообщения в формат Yandex GPT
-        yandex_messages = []
-        for msg in messages:
-            yandex_messages.append({
-                "role": msg["role"],
-                "text": msg["content"]
-            })
-        
-        # Определяем правильное имя модели
-        if model == 'yandexgpt':
-            model_name = 'yandexgpt-lite'
-        else:
-            model_name = model
+            logger.info(f"Найдено результатов поиска: {len(results)}")
+            return results
             
-        # Yandex GPT поддерживает temperature только в диапазоне [0, 1]
-        yandex_temperature = min(temperature, 1.0)
-        if temperature > 1.0:
-            logger.info(f"Yandex GPT: ограничиваем temperature с {temperature} до {yandex_temperature}")
-        
-        # Yandex GPT поддерживает top_p только в диапазоне [0, 1]
-        yandex_top_p = min(top_p, 1.0)
-        if top_p > 1.0:
-            logger.info(f"Yandex GPT: ограничиваем top_p с {top_p} до {yandex_top_p}")
-        
-        data = {
-            "modelUri": f"gpt://{self.yandex_folder_id}/{model_name}",
-            "completionOptions": {
-                "stream": False,
-                "temperature": yandex_temperature,
-                "topP": yandex_top_p,
-                "maxTokens": max_tokens
-            },
-            "messages": yandex_messages
-        }
-        
-        # Используем folder_id (основной идентификатор)
-        data["modelUri"] = f"gpt://{self.yandex_folder_id}/{model_name}"
-        logger.info(f"Используем folder_id: {self.yandex_folder_id}")
-        
-        try:
-            logger.info(f"URL: {url}")
-            logger.info(f"Данные запроса: {json.dumps(data, ensure_ascii=False, indent=2)}")
-            response = requests.post(url, headers=headers, json=data, timeout=30)
-            logger.info(f"Статус ответа: {response.status_code}")
-            logger.info(f"Текст ответа: {response.text}")
-            response.raise_for_status()
-            result = response.json()
-            logger.info("Успешно получен ответ от Yandex GPT API")
-            response_content = result['result']['alternatives'][0]['message']['text']
-            logger.info(f"Ответ Yandex: {response_content[:200]}...")
-            return response_content
         except Exception as e:
-            logger.error(f"Ошибка при обращении к Yandex GPT API: {str(e)}")
-            return f"Ошибка при обращении к Yandex GPT API: {str(e)}"
+            logger.error(f"Ошибка при поиске в интернете: {str(e)}")
+            return [{
+                'title': 'Ошибка поиска',
+                'url': '',
+                'snippet': f'Не удалось выполнить поиск: {str(e)}'
+            }]
     
-    def search_web(self, query: str, max_results: int = 5) -> List[Dict[str, str]]:
-        """Выполняет поиск в интернете по запросу."""
+    async def asearch_web(self, query: str, max_results: int = 5) -> List[Dict[str, str]]:
+        """Асинхронный поиск в интернете по запросу."""
         logger.info(f"Выполняем поиск в интернете: '{query}'")
         
         try:
-            # Используем DuckDuckGo API для поиска (бесплатный и не требует API ключа)
-            search_url = "https://api.duckduckgo.com/"
-            params = {
-                'q': query,
-                'format': 'json',
-                'no_html': '1',
-                'skip_disambig': '1'
-            }
-            
-            response = requests.get(search_url, params=params, timeout=10)
+            response = await async_http_client.get(SEARCH_API_URL, params=self._search_params(query), timeout=10)
             response.raise_for_status()
-            data = response.json()
-            
-            results = []
-            
-            # Обрабатываем основные результаты
-            if 'Abstract' in data and data['Abstract']:
-                results.append({
-                    'title': data.get('Heading', 'Основная информация'),
-                    'url': data.get('AbstractURL', ''),
-                    'snippet': data['Abstract']
-                })
-            
-            # Обрабатываем связанные темы
-            if 'RelatedTopics' in data:
-                for topic in data['RelatedTopics'][:max_results-1]:
-                    if isinstance(topic, dict) and 'Text' in topic:
-                        results.append({
-                            'title': topic.get('FirstURL', '').split('/')[-1] if topic.get('FirstURL') else 'Связанная тема',
-                            'url': topic.get('FirstURL', ''),
-                            'snippet': topic['Text']
-                        })
-            
+            results = self._parse_search_results(response.json(), max_results)
             logger.info(f"Найдено результатов поиска: {len(results)}")
             return results
-            
         except Exception as e:
             logger.error(f"Ошибка при поиске в интернете: {str(e)}")
             return [{
@@ -363,6 +1262,38 @@ class LLMService:
                 'snippet': f'Не удалось выполнить поиск: {str(e)}'
             }]
     
+    def _search_params(self, query: str) -> Dict[str, str]:
+        return {
+            'q': query,
+            'format': 'json',
+            'no_html': '1',
+            'skip_disambig': '1'
+        }
+    
+    def _parse_search_results(self, data: Dict[str, Any], max_results: int) -> List[Dict[str, str]]:
+        """Преобразует ответ DuckDuckGo в список результатов поиска."""
+        results = []
+        
+        # Обрабатываем основные результаты
+        if 'Abstract' in data and data['Abstract']:
+            results.append({
+                'title': data.get('Heading', 'Основная информация'),
+                'url': data.get('AbstractURL', ''),
+                'snippet': data['Abstract']
+            })
+        
+        # Обрабатываем связанные темы
+        if 'RelatedTopics' in data:
+            for topic in data['RelatedTopics'][:max_results-1]:
+                if isinstance(topic, dict) and 'Text' in topic:
+                    results.append({
+                        'title': topic.get('FirstURL', '').split('/')[-1] if topic.get('FirstURL') else 'Связанная тема',
+                        'url': topic.get('FirstURL', ''),
+                        'snippet': topic['Text']
+                    })
+        
+        return results
+    
     def format_search_results(self, results: List[Dict[str, str]]) -> str:
         """Форматирует результаты поиска для включения в контекст."""
         if not results:
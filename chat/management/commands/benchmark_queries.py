@@ -0,0 +1,173 @@
+import time
+import uuid
+import random
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import setup_databases, teardown_databases
+from django.utils import timezone
+
+from chat.models import Agent, ChatSession, Message, UploadedFile
+
+BENCHMARK_PREFIX = 'bench-'
+
+# Индексы горячих запросов: (модель, имя индекса)
+HOT_PATH_INDEXES = [
+    (Message, 'chat_message_session_ts_idx'),
+    (ChatSession, 'chat_session_updated_idx'),
+    (UploadedFile, 'chat_upload_session_idx'),
+    (Agent, 'chat_agent_name_active_idx'),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        'Заполняет временную тестовую базу синтетическими данными и сравнивает планы '
+        'и время горячих запросов с составными индексами и без них'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=2000, help='Количество сессий')
+        parser.add_argument('--messages', type=int, default=50, help='Сообщений на сессию')
+        parser.add_argument('--files', type=int, default=3, help='Файлов на сессию')
+        parser.add_argument('--agents', type=int, default=500, help='Количество агентов')
+        parser.add_argument('--repeat', type=int, default=20, help='Повторов каждого запроса')
+        parser.add_argument(
+            '--keepdb', action='store_true',
+            help='Не удалять тестовую базу после замера и использовать ее повторно (без нового заполнения)'
+        )
+
+    def handle(self, *args, **options):
+        self.repeat = max(1, options['repeat'])
+
+        # Замер выполняется во временной тестовой базе (как при manage.py test): рабочая
+        # база не заполняется синтетическими данными, и ее индексы не удаляются
+        old_config = setup_databases(
+            verbosity=options['verbosity'], interactive=False, keepdb=options['keepdb'],
+            aliases={'default'}, serialized_aliases=set(),
+        )
+        try:
+            self.stdout.write(f"Тестовая база: {connection.settings_dict['NAME']}")
+            if not ChatSession.objects.filter(session_id__startswith=BENCHMARK_PREFIX).exists():
+                self.seed(options['sessions'], options['messages'], options['files'], options['agents'])
+
+            with_indexes = self.run_queries()
+            without_indexes = self.run_without_indexes()
+
+            self.stdout.write('')
+            self.stdout.write(f"{'Запрос':<28}{'с индексами, мс':>18}{'без индексов, мс':>20}")
+            for name, elapsed in with_indexes.items():
+                self.stdout.write(f"{name:<28}{elapsed:>18.3f}{without_indexes[name]:>20.3f}")
+        finally:
+            teardown_databases(old_config, verbosity=options['verbosity'], keepdb=options['keepdb'])
+
+    def seed(self, sessions_count, messages_per_session, files_per_session, agents_count):
+        """Создает синтетические сессии, сообщения, файлы и агентов пакетными вставками."""
+        self.stdout.write(
+            f'Заполнение: {sessions_count} сессий, {sessions_count * messages_per_session} сообщений, '
+            f'{sessions_count * files_per_session} файлов, {agents_count} агентов...'
+        )
+        now = timezone.now()
+        started = time.perf_counter()
+
+        with transaction.atomic():
+            sessions = ChatSession.objects.bulk_create([
+                ChatSession(
+                    session_id=f'{BENCHMARK_PREFIX}{uuid.uuid4()}',
+                    title=f'Benchmark {index}',
+                    model='benchmark-model',
+                    updated_at=now - timedelta(minutes=random.randint(0, 60 * 24 * 90)),
+                    message_count=messages_per_session,
+                )
+                for index in range(sessions_count)
+            ], batch_size=1000)
+
+            for batch_start in range(0, len(sessions), 100):
+                batch = sessions[batch_start:batch_start + 100]
+                Message.objects.bulk_create([
+                    Message(
+                        session=session,
+                        role='user' if position % 2 == 0 else 'assistant',
+                        content=f'Синтетическое сообщение {position}',
+                        timestamp=now - timedelta(minutes=random.randint(0, 60 * 24 * 90)),
+                        total_tokens=random.randint(10, 500),
+                        model='benchmark-model',
+                    )
+                    for session in batch
+                    for position in range(messages_per_session)
+                ], batch_size=1000)
+                UploadedFile.objects.bulk_create([
+                    UploadedFile(
+                        session=session,
+                        file=f'uploads/benchmark/{position}.txt',
+                        filename=f'{position}.txt',
+                        file_type='text',
+                        file_size=0,
+                        uploaded_at=now - timedelta(minutes=random.randint(0, 60 * 24 * 90)),
+                    )
+                    for session in batch
+                    for position in range(files_per_session)
+                ], batch_size=1000)
+
+            Agent.objects.bulk_create([
+                Agent(
+                    name=f'{BENCHMARK_PREFIX}agent-{index}',
+                    model='benchmark-model',
+                    is_active=index % 5 != 0,
+                )
+                for index in range(agents_count)
+            ], batch_size=1000)
+
+        self.analyze()
+
+        self.stdout.write(f'Заполнено за {time.perf_counter() - started:.1f} c')
+
+    def hot_queries(self):
+        """Горячие запросы приложения; каждый возвращает QuerySet для EXPLAIN и замера."""
+        session = ChatSession.objects.filter(session_id__startswith=BENCHMARK_PREFIX).order_by('?').first()
+        agent_name = f'{BENCHMARK_PREFIX}agent-{random.randint(1, 4)}'
+        return {
+            'messages_by_session': lambda: session.messages.order_by('timestamp'),
+            'sessions_by_updated_at': lambda: ChatSession.objects.order_by('-updated_at', '-id')[:20],
+            'files_by_session': lambda: session.files.order_by('-uploaded_at'),
+            'agent_by_name': lambda: Agent.objects.filter(name=agent_name, is_active=True),
+        }
+
+    def run_queries(self):
+        """Выводит план каждого запроса и возвращает среднее время выполнения, мс."""
+        results = {}
+        for name, build in self.hot_queries().items():
+            queryset = build()
+            self.stdout.write(self.style.MIGRATE_HEADING(f'\n{name}'))
+            self.stdout.write(queryset.explain())
+
+            started = time.perf_counter()
+            for _ in range(self.repeat):
+                list(build())
+            results[name] = (time.perf_counter() - started) * 1000 / self.repeat
+        return results
+
+    def run_without_indexes(self):
+        """Повторяет замер, временно удалив составные индексы; после замера индексы создаются заново."""
+        self.stdout.write(self.style.WARNING('\nБез составных индексов:'))
+        indexes = [
+            (model, next(index for index in model._meta.indexes if index.name == index_name))
+            for model, index_name in HOT_PATH_INDEXES
+        ]
+        with connection.schema_editor() as schema_editor:
+            for model, index in indexes:
+                schema_editor.remove_index(model, index)
+        try:
+            self.analyze()
+            return self.run_queries()
+        finally:
+            with connection.schema_editor() as schema_editor:
+                for model, index in indexes:
+                    schema_editor.add_index(model, index)
+            self.analyze()
+
+    def analyze(self):
+        """Обновляет статистику планировщика."""
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
@@ -0,0 +1,72 @@
+import time
+import random
+
+from django.core.management.base import BaseCommand
+
+from chat.token_estimator import (
+    FEATURES, MODEL_FAMILIES, TokenEstimator, error_stats, get_estimator, legacy_estimate, load_samples
+)
+
+# Фрагменты для синтетического корпуса: русский текст, английский текст и код
+SYNTHETIC_PARTS = [
+    'Загруженный файл разбивается на фрагменты, и в запрос попадают только релевантные.',
+    'Стоимость запроса считается по количеству входных и выходных токенов модели.',
+    'The response cache serves identical deterministic requests without calling the provider.',
+    'def count_tokens(text: str) -> int:\n    return len(text.split())\n',
+    '{"model": "GigaChat:latest", "temperature": 0.7, "max_tokens": 4000}',
+    'Итого: 1 234 567 руб. за 2024-2025 гг. (+12,5%) — см. таблицу №3.',
+]
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает точность и скорость локальной оценки токенов с прежней оценкой len // 4.5'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--samples', help='JSONL-файл с точными подсчетами для проверки точности')
+        parser.add_argument('--family', choices=MODEL_FAMILIES, default='gigachat')
+        parser.add_argument('--texts', type=int, default=2000, help='Текстов в синтетическом корпусе для замера скорости')
+        parser.add_argument('--repeat', type=int, default=5, help='Повторов замера скорости')
+
+    def handle(self, *args, **options):
+        estimator = get_estimator(options['family'])
+
+        if options['samples']:
+            texts, tokens = load_samples(options['samples'], options['family'])
+            self.stdout.write(f'Точность на {len(texts)} примерах:')
+            for name, predicted in (
+                ('len // 4.5', [legacy_estimate(text) for text in texts]),
+                ('оценщик', estimator.estimate_batch(texts)),
+            ):
+                stats = error_stats(predicted, tokens)
+                self.stdout.write(
+                    f"  {name:<12} MAE {stats['mae']:8.2f}  MAPE {stats['mape']:6.1%}  "
+                    f"p90 {stats['p90']:6.1%}  суммарно {stats['total_error']:+6.1%}"
+                )
+        else:
+            texts = None
+
+        rng = random.Random(0)
+        corpus = texts or [
+            ' '.join(rng.choice(SYNTHETIC_PARTS) for _ in range(rng.randint(1, 40)))
+            for _ in range(options['texts'])
+        ]
+        megabytes = sum(len(text.encode('utf-8')) for text in corpus) / 1024 / 1024
+
+        if not estimator.fitted:
+            # Без калибровки оценщик совпадает с len // 4.5; скорость линейной модели замеряется с нулевыми коэффициентами
+            self.stdout.write(f"Коэффициенты для {options['family']} не подобраны, используется len // 4.5")
+            estimator = TokenEstimator({name: 0.0 for name in FEATURES})
+
+        self.stdout.write(f'Скорость на {len(corpus)} текстах ({megabytes:.2f} МБ):')
+        for name, run in (
+            ('len // 4.5', lambda: [legacy_estimate(text) for text in corpus]),
+            ('estimate', lambda: [estimator.estimate(text) for text in corpus]),
+            ('estimate_batch', lambda: estimator.estimate_batch(corpus)),
+        ):
+            started = time.perf_counter()
+            for _ in range(options['repeat']):
+                run()
+            elapsed = (time.perf_counter() - started) / options['repeat']
+            self.stdout.write(
+                f'  {name:<16} {elapsed * 1000:8.2f} мс  {len(corpus) / elapsed:12.0f} текстов/с  {megabytes / elapsed:8.1f} МБ/с'
+            )
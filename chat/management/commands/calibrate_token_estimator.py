@@ -0,0 +1,64 @@
+import os
+import json
+import random
+
+from django.core.management.base import BaseCommand, CommandError
+
+from chat.token_estimator import (
+    MODEL_FAMILIES, TokenEstimator, error_stats, get_estimator, legacy_estimate, load_samples
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Подбирает коэффициенты локальной оценки токенов по выборке точных подсчетов '
+        'токенизатора провайдера (JSONL: {"text": ..., "tokens": ..., "model": ...})'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('samples', help='JSONL-файл с текстами и точным количеством токенов')
+        parser.add_argument('--family', choices=MODEL_FAMILIES, required=True,
+                            help='Семейство моделей, для которого подбираются коэффициенты')
+        parser.add_argument('--output', help='JSON-файл коэффициентов (TOKEN_ESTIMATOR_COEFFICIENTS); '
+                                             'значения других семейств в нем сохраняются')
+        parser.add_argument('--holdout', type=float, default=0.2, help='Доля примеров для проверки')
+        parser.add_argument('--seed', type=int, default=0, help='Seed разбиения на обучение и проверку')
+
+    def handle(self, *args, **options):
+        texts, tokens = load_samples(options['samples'], options['family'])
+        if len(texts) < 20:
+            raise CommandError(f'Слишком мало примеров для калибровки: {len(texts)}')
+
+        indices = list(range(len(texts)))
+        random.Random(options['seed']).shuffle(indices)
+        split = int(len(indices) * (1 - options['holdout']))
+        train, test = indices[:split], indices[split:]
+
+        estimator = TokenEstimator.fit([texts[i] for i in train], [tokens[i] for i in train])
+        current = get_estimator(options['family'])
+
+        test_texts = [texts[i] for i in test]
+        test_tokens = [tokens[i] for i in test]
+        self.stdout.write(f'Примеров: обучение {len(train)}, проверка {len(test)}')
+        for name, predicted in (
+            ('len // 4.5', [legacy_estimate(text) for text in test_texts]),
+            *((('текущие', current.estimate_batch(test_texts)),) if current.fitted else ()),
+            ('подобранные', estimator.estimate_batch(test_texts)),
+        ):
+            stats = error_stats(predicted, test_tokens)
+            self.stdout.write(
+                f"{name:<14} MAE {stats['mae']:8.2f}  MAPE {stats['mape']:6.1%}  "
+                f"p90 {stats['p90']:6.1%}  суммарно {stats['total_error']:+6.1%}"
+            )
+
+        self.stdout.write(json.dumps(estimator.coefficients, indent=2))
+
+        if options['output']:
+            coefficients = {}
+            if os.path.exists(options['output']):
+                with open(options['output'], encoding='utf-8') as f:
+                    coefficients = json.load(f)
+            coefficients[options['family']] = estimator.coefficients
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                json.dump(coefficients, f, indent=2, ensure_ascii=False)
+            self.stdout.write(self.style.SUCCESS(f"Коэффициенты сохранены в {options['output']}"))
@@ -0,0 +1,47 @@
+import signal
+import threading
+
+from django.core.management.base import BaseCommand
+
+from chat.ingestion import IngestionWorker
+
+
+class Command(BaseCommand):
+    help = 'Обрабатывает очередь задач извлечения содержимого загруженных файлов'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='Количество потоков-воркеров')
+        parser.add_argument('--poll-interval', type=float, default=None, help='Интервал опроса очереди, с')
+        parser.add_argument('--once', action='store_true', help='Обработать текущую очередь и завершиться')
+
+    def handle(self, *args, **options):
+        if options['once']:
+            processed = IngestionWorker(poll_interval=options['poll_interval']).run_once()
+            self.stdout.write(self.style.SUCCESS(f'Обработано задач: {processed}'))
+            return
+
+        workers = [
+            IngestionWorker(poll_interval=options['poll_interval'])
+            for _ in range(max(1, options['workers']))
+        ]
+
+        def stop(signum, frame):
+            self.stdout.write('Остановка воркеров...')
+            for worker in workers:
+                worker.stop()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        threads = []
+        for index, worker in enumerate(workers):
+            worker.name = f'{worker.name}:{index}'
+            thread = threading.Thread(target=worker.run, name=f'ingestion-worker-{index}')
+            thread.start()
+            threads.append(thread)
+
+        self.stdout.write(self.style.SUCCESS(f'Запущено воркеров: {len(workers)}'))
+        # join с таймаутом, чтобы главный поток продолжал получать сигналы
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(timeout=1)
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from chat.models import ChatSession
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает статистику токенов сессий по сохраненным сообщениям'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--session', help='session_id одной сессии (по умолчанию все)')
+
+    def handle(self, *args, **options):
+        sessions = ChatSession.objects.all()
+        if options['session']:
+            sessions = sessions.filter(session_id=options['session'])
+
+        count = 0
+        for session in sessions.iterator():
+            session.update_token_stats()
+            count += 1
+
+        self.stdout.write(self.style.SUCCESS(f'Пересчитано сессий: {count}'))
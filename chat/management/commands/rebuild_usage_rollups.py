@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from chat.models import ChatSession, UsageRollup
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает почасовую сводку использования по сохраненным сообщениям'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--session', help='session_id одной сессии (по умолчанию все)')
+
+    def handle(self, *args, **options):
+        sessions = None
+        if options['session']:
+            sessions = ChatSession.objects.filter(session_id=options['session'])
+
+        created = UsageRollup.rebuild(sessions)
+
+        self.stdout.write(self.style.SUCCESS(f'Создано строк сводки: {created}'))
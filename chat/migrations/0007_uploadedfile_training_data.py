@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0006_agent_web_search_chatsession_web_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='training_data',
+            field=models.JSONField(blank=True, help_text='Содержимое файла, извлеченное для обучения при загрузке', null=True),
+        ),
+    ]
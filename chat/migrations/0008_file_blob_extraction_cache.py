@@ -0,0 +1,47 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:52
+
+import chat.models
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0007_uploadedfile_training_data'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileBlob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('sha256', models.CharField(max_length=64, unique=True)),
+                ('file', models.FileField(upload_to=chat.models._blob_upload_to)),
+                ('size', models.PositiveBigIntegerField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='blob',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='uploads', to='chat.fileblob'),
+        ),
+        migrations.CreateModel(
+            name='FileExtraction',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('processor_version', models.CharField(max_length=20)),
+                ('file_type', models.CharField(max_length=20)),
+                ('content_preview', models.TextField(blank=True)),
+                ('training_data', models.JSONField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('blob', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='extractions', to='chat.fileblob')),
+            ],
+            options={
+                'unique_together': {('blob', 'processor_version', 'file_type')},
+            },
+        ),
+    ]
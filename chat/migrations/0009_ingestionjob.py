@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:55
+
+import django.db.models.deletion
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0008_file_blob_extraction_cache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IngestionJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('extracting', 'Извлечение содержимого'), ('ready', 'Готов'), ('error', 'Ошибка')], default='pending', max_length=20)),
+                ('progress', models.PositiveSmallIntegerField(default=0, help_text='Прогресс обработки, %')),
+                ('error', models.TextField(blank=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('worker', models.CharField(blank=True, help_text='Воркер, взявший задачу', max_length=100)),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+                ('uploaded_file', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='ingestion_job', to='chat.uploadedfile')),
+            ],
+            options={
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='chat_ingest_status_a1985f_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:56
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0009_ingestionjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fileextraction',
+            name='chunk_count',
+            field=models.PositiveIntegerField(default=0, help_text='Количество фрагментов в поисковом индексе'),
+        ),
+        migrations.AddField(
+            model_name='uploadedfile',
+            name='extraction',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='uploads', to='chat.fileextraction'),
+        ),
+        migrations.CreateModel(
+            name='FileChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('position', models.PositiveIntegerField()),
+                ('text', models.TextField()),
+                ('length', models.PositiveIntegerField(help_text='Количество термов во фрагменте')),
+                ('extraction', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='chat.fileextraction')),
+            ],
+            options={
+                'ordering': ['extraction', 'position'],
+                'unique_together': {('extraction', 'position')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ChunkPosting',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=64)),
+                ('tf', models.PositiveIntegerField()),
+                ('chunk', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='postings', to='chat.filechunk')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['term', 'chunk'], name='chat_chunkp_term_4ae1b8_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.18 on 2026-10-17 00:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0010_file_chunk_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='agent',
+            name='response_cache',
+            field=models.BooleanField(default=False, help_text='Отвечать из кеша на повторяющиеся запросы (для детерминированных настроек)'),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='response_cache',
+            field=models.BooleanField(default=False, help_text='Отвечать из кеша на повторяющиеся запросы (для детерминированных настроек)'),
+        ),
+    ]
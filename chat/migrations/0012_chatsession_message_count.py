@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:20
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_message_count(apps, schema_editor):
+    ChatSession = apps.get_model('chat', 'ChatSession')
+    Message = apps.get_model('chat', 'Message')
+    counts = Message.objects.filter(session=OuterRef('pk')).order_by().values('session').annotate(c=Count('id')).values('c')
+    ChatSession.objects.update(message_count=Coalesce(Subquery(counts), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0011_response_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='message_count',
+            field=models.PositiveIntegerField(default=0, help_text='Количество сообщений в сессии'),
+        ),
+        migrations.RunPython(backfill_message_count, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,68 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:02
+
+from datetime import timezone as dt_timezone
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import Coalesce, TruncHour
+
+
+def backfill_usage_rollups(apps, schema_editor):
+    Message = apps.get_model('chat', 'Message')
+    UsageRollup = apps.get_model('chat', 'UsageRollup')
+    rows = (
+        Message.objects
+        .annotate(bucket=TruncHour('timestamp', tzinfo=dt_timezone.utc))
+        .values('bucket', 'session_id', 'session__model')
+        .annotate(
+            count=Count('id'),
+            input_sum=Coalesce(Sum('input_tokens'), 0),
+            output_sum=Coalesce(Sum('output_tokens'), 0),
+            total_sum=Coalesce(Sum('total_tokens'), 0),
+            cost_sum=Coalesce(Sum('estimated_cost'), 0, output_field=models.DecimalField()),
+        )
+        .order_by()
+    )
+    UsageRollup.objects.bulk_create((
+        UsageRollup(
+            bucket=row['bucket'],
+            session_id=row['session_id'],
+            model=row['session__model'],
+            messages=row['count'],
+            input_tokens=row['input_sum'],
+            output_tokens=row['output_sum'],
+            total_tokens=row['total_sum'],
+            estimated_cost=row['cost_sum'],
+        )
+        for row in rows.iterator()
+    ), batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0012_chatsession_message_count'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UsageRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField(help_text='Начало часа (UTC)')),
+                ('model', models.CharField(max_length=100)),
+                ('messages', models.PositiveIntegerField(default=0)),
+                ('input_tokens', models.PositiveBigIntegerField(default=0)),
+                ('output_tokens', models.PositiveBigIntegerField(default=0)),
+                ('total_tokens', models.PositiveBigIntegerField(default=0)),
+                ('estimated_cost', models.DecimalField(decimal_places=6, default=0, max_digits=14)),
+                ('session', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='usage_rollups', to='chat.chatsession')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket', 'model'], name='chat_usager_bucket_9629fe_idx')],
+                'unique_together': {('bucket', 'session', 'model')},
+            },
+        ),
+        migrations.RunPython(backfill_usage_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_session_agent(apps, schema_editor):
+    """
+    Привязывает существующие сессии к агентам: текущая сессия агента — напрямую,
+    остальные — по прежнему признаку (совпадение модели и системного промпта).
+    """
+    Agent = apps.get_model('chat', 'Agent')
+    ChatSession = apps.get_model('chat', 'ChatSession')
+    agents = Agent.objects.order_by('created_at')
+    for agent in agents.exclude(current_session=None):
+        ChatSession.objects.filter(id=agent.current_session_id, agent=None).update(agent=agent)
+    for agent in agents:
+        ChatSession.objects.filter(
+            agent=None, model=agent.model, system_prompt=agent.system_prompt
+        ).update(agent=agent)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0013_usage_rollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='agent',
+            field=models.ForeignKey(blank=True, help_text='Агент, которому принадлежит сессия', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='sessions', to='chat.agent'),
+        ),
+        migrations.RunPython(backfill_session_agent, migrations.RunPython.noop),
+    ]
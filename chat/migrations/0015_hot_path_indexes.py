@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0014_chatsession_agent'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='agent',
+            index=models.Index(fields=['name', 'is_active'], name='chat_agent_name_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chatsession',
+            index=models.Index(fields=['-updated_at', '-id'], name='chat_session_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='message',
+            index=models.Index(fields=['session', 'timestamp'], name='chat_message_session_ts_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='uploadedfile',
+            index=models.Index(fields=['session', '-uploaded_at'], name='chat_upload_session_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0015_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='content_tokens',
+            field=models.PositiveIntegerField(blank=True, help_text='Количество токенов содержимого (для истории диалога)', null=True),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:06
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0016_message_content_tokens'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='summary',
+            field=models.TextField(blank=True, help_text='Краткое содержание ранней части диалога'),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='summary_tokens',
+            field=models.PositiveIntegerField(default=0, help_text='Количество токенов краткого содержания'),
+        ),
+        migrations.AddField(
+            model_name='chatsession',
+            name='summary_until',
+            field=models.DateTimeField(blank=True, help_text='Время последнего сообщения, вошедшего в краткое содержание', null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+from django.db import migrations
+
+
+def clear_duplicated_training_data(apps, schema_editor):
+    """
+    Очищает копии извлеченного содержимого у файлов с результатом разбора:
+    текст хранится один раз в FileExtraction и читается через связь extraction.
+    """
+    UploadedFile = apps.get_model('chat', 'UploadedFile')
+    UploadedFile.objects.filter(
+        training_data__isnull=False, extraction__training_data__isnull=False
+    ).update(training_data=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0017_chatsession_summary'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_duplicated_training_data, migrations.RunPython.noop),
+    ]
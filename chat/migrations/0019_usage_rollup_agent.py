@@ -0,0 +1,33 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def backfill_rollup_agent(apps, schema_editor):
+    """Заполняет агента в существующих строках сводки по агенту их сессий."""
+    ChatSession = apps.get_model('chat', 'ChatSession')
+    UsageRollup = apps.get_model('chat', 'UsageRollup')
+    agent_ids = ChatSession.objects.exclude(agent=None).values_list('agent_id', flat=True).distinct()
+    for agent_id in agent_ids:
+        UsageRollup.objects.filter(session__agent_id=agent_id).update(agent_id=agent_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0018_clear_duplicated_training_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='usagerollup',
+            name='agent',
+            field=models.ForeignKey(blank=True, help_text='Агент сессии', null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='usage_rollups', to='chat.agent'),
+        ),
+        migrations.AddIndex(
+            model_name='usagerollup',
+            index=models.Index(fields=['agent', 'bucket'], name='chat_usager_agent_i_7f2dc7_idx'),
+        ),
+        migrations.RunPython(backfill_rollup_agent, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:49
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0019_usage_rollup_agent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatsession',
+            name='summary_offset',
+            field=models.PositiveIntegerField(default=0, help_text='Сколько начальных символов следующего сообщения уже вошло в краткое содержание'),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 01:51
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery
+from django.db.models.fields.json import KeyTextTransform
+from django.db.models.functions import Coalesce
+
+
+def backfill_message_model(apps, schema_editor):
+    """
+    Заполняет модель сообщений: ответы ассистента — по metadata['model'],
+    сообщения пользователя — по модели ближайшего следующего ответа,
+    остальные — по текущей модели сессии.
+    """
+    ChatSession = apps.get_model('chat', 'ChatSession')
+    Message = apps.get_model('chat', 'Message')
+    Message.objects.filter(role='assistant', metadata__has_key='model').update(
+        model=KeyTextTransform('model', 'metadata')
+    )
+    session_model = ChatSession.objects.filter(pk=OuterRef('session_id')).values('model')[:1]
+    next_answer = Message.objects.filter(
+        session_id=OuterRef('session_id'), role='assistant', timestamp__gte=OuterRef('timestamp')
+    ).exclude(model='').order_by('timestamp').values('model')[:1]
+    Message.objects.filter(model='', role='user').update(
+        model=Coalesce(Subquery(next_answer), Subquery(session_model))
+    )
+    Message.objects.filter(model='').update(model=Subquery(session_model))
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('chat', '0020_chatsession_summary_offset'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='message',
+            name='model',
+            field=models.CharField(blank=True, help_text='Модель сессии на момент сохранения сообщения', max_length=100),
+        ),
+        migrations.RunPython(backfill_message_model, migrations.RunPython.noop),
+    ]
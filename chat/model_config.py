@@ -1,34 +1,121 @@
 """
 Конфигурация доступных моделей ИИ.
+
+Реестр MODEL_REGISTRY строится один раз при импорте из AVAILABLE_MODELS и
+сопоставляет идентификатору модели провайдера, токенизатор, окно контекста
+и цены. LLMService выбирает адаптер провайдера, а TokenCounter — способ
+подсчета токенов и цены по этому реестру.
 """
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+# Окно контекста по умолчанию для моделей без явного значения, токенов
+DEFAULT_CONTEXT_WINDOW = 8192
+
+# Токенизатор и цены за 1000 токенов (в долларах) для моделей вне реестра
+DEFAULT_TOKENIZER = 'tiktoken:gpt-4'
+DEFAULT_PRICE_PER_1K = {'input': 0.03, 'output': 0.06}
 
+# Ключ верхнего уровня — имя провайдера, под которым зарегистрирован его адаптер в llm_service.
+# tokenizer: 'estimator:<семейство>' — оценка chat.token_estimator, 'tiktoken:<модель>' — кодировка tiktoken.
 AVAILABLE_MODELS = {
     'gigachat': [
         {
             'value': 'GigaChat:latest',
             'label': 'GigaChat Latest',
-            'description': 'Последняя версия GigaChat'
+            'description': 'Последняя версия GigaChat',
+            'context_window': 32768,
+            'tokenizer': 'estimator:gigachat',
+            'input_price': 0.0001,
+            'output_price': 0.0001
         },
         {
             'value': 'GigaChat-Pro:latest',
             'label': 'GigaChat Pro',
-            'description': 'Профессиональная версия GigaChat'
+            'description': 'Профессиональная версия GigaChat',
+            'context_window': 32768,
+            'tokenizer': 'estimator:gigachat',
+            'input_price': 0.0002,
+            'output_price': 0.0002
         },
     ],
     'yandex': [
         {
             'value': 'yandexgpt',
             'label': 'Yandex GPT',
-            'description': 'Основная модель Yandex GPT'
+            'description': 'Основная модель Yandex GPT',
+            'context_window': 8000,
+            'tokenizer': 'estimator:yandex',
+            'input_price': 0.0001,
+            'output_price': 0.0001
         },
         {
             'value': 'yandexgpt-lite',
             'label': 'Yandex GPT Lite',
-            'description': 'Облегченная версия Yandex GPT'
+            'description': 'Облегченная версия Yandex GPT',
+            'context_window': 8000,
+            'tokenizer': 'estimator:yandex',
+            'input_price': 0.00005,
+            'output_price': 0.00005
         },
     ],
 }
 
+
+class UnknownModelError(ValueError):
+    """Модель отсутствует в реестре моделей."""
+
+
+@dataclass(frozen=True)
+class ModelSpec:
+    """Описание модели в реестре."""
+    value: str
+    label: str
+    description: str
+    provider: str
+    context_window: int
+    tokenizer_kind: str
+    tokenizer_name: str
+    input_price: float
+    output_price: float
+
+
+def _build_registry() -> Dict[str, ModelSpec]:
+    registry = {}
+    for provider, models in AVAILABLE_MODELS.items():
+        for model in models:
+            if model['value'] in registry:
+                raise ValueError(f"Модель '{model['value']}' объявлена в конфигурации дважды")
+            tokenizer_kind, _, tokenizer_name = model.get('tokenizer', DEFAULT_TOKENIZER).partition(':')
+            registry[model['value']] = ModelSpec(
+                value=model['value'],
+                label=model['label'],
+                description=model['description'],
+                provider=provider,
+                context_window=model.get('context_window', DEFAULT_CONTEXT_WINDOW),
+                tokenizer_kind=tokenizer_kind,
+                tokenizer_name=tokenizer_name,
+                input_price=model.get('input_price', DEFAULT_PRICE_PER_1K['input']),
+                output_price=model.get('output_price', DEFAULT_PRICE_PER_1K['output']),
+            )
+    return registry
+
+
+MODEL_REGISTRY = _build_registry()
+
+
+def get_model_spec(model_value) -> Optional[ModelSpec]:
+    """Возвращает описание модели из реестра или None, если модель неизвестна."""
+    return MODEL_REGISTRY.get(model_value)
+
+
+def require_model_spec(model_value) -> ModelSpec:
+    """Возвращает описание модели из реестра; для неизвестной модели вызывает UnknownModelError."""
+    spec = MODEL_REGISTRY.get(model_value)
+    if spec is None:
+        raise UnknownModelError(f"Неизвестная модель '{model_value}'")
+    return spec
+
 def get_models_for_template():
     """Возвращает модели в формате для шаблонов."""
     result = {}
@@ -44,26 +131,29 @@ def get_models_for_template():
 
 def get_all_models():
     """Возвращает все модели в плоском списке."""
-    all_models = []
-    for provider, models in AVAILABLE_MODELS.items():
-        for model in models:
-            all_models.append({
-                'value': model['value'],
-                'label': model['label'],
-                'provider': provider,
-                'description': model['description']
-            })
-    return all_models
+    return [
+        {
+            'value': spec.value,
+            'label': spec.label,
+            'provider': spec.provider,
+            'description': spec.description
+        }
+        for spec in MODEL_REGISTRY.values()
+    ]
 
 def get_model_info(model_value):
     """Возвращает информацию о конкретной модели."""
-    for provider, models in AVAILABLE_MODELS.items():
-        for model in models:
-            if model['value'] == model_value:
-                return {
-                    'value': model['value'],
-                    'label': model['label'],
-                    'provider': provider,
-                    'description': model['description']
-                }
-    return None
+    spec = MODEL_REGISTRY.get(model_value)
+    if spec is None:
+        return None
+    return {
+        'value': spec.value,
+        'label': spec.label,
+        'provider': spec.provider,
+        'description': spec.description
+    }
+
+def get_context_window(model_value):
+    """Возвращает размер окна контекста модели в токенах."""
+    spec = MODEL_REGISTRY.get(model_value)
+    return spec.context_window if spec else DEFAULT_CONTEXT_WINDOW
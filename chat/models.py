@@ -1,7 +1,25 @@
-from django.db import models
+from django.db import models, transaction, IntegrityError
+from django.db.models import Count, F, Sum
+from django.db.models.functions import Coalesce, TruncHour
 from django.utils import timezone
 import uuid
 import json
+import os
+from datetime import timezone as dt_timezone
+from decimal import Decimal
+
+from .token_counter import TokenCounter
+
+# Точность хранения стоимости (decimal_places полей estimated_cost)
+COST_QUANTUM = Decimal('0.000001')
+
+
+def _cost(value):
+    """
+    Округляет стоимость до точности полей стоимости, чтобы счетчики, сводка
+    и сумма по сообщениям совпадали (SQLite хранит значения без округления).
+    """
+    return Decimal(str(value)).quantize(COST_QUANTUM)
 
 
 class ChatSession(models.Model):
@@ -15,6 +33,7 @@ class ChatSession(models.Model):
     max_tokens = models.PositiveIntegerField(default=4000)
     system_prompt = models.TextField(blank=True)
     web_search = models.BooleanField(default=False, help_text="Включен ли поиск в интернете")
+    response_cache = models.BooleanField(default=False, help_text="Отвечать из кеша на повторяющиеся запросы (для детерминированных настроек)")
     python_functions = models.TextField(blank=True)
     created_at = models.DateTimeField(default=timezone.now)
     updated_at = models.DateTimeField(auto_now=True)
@@ -24,6 +43,23 @@ class ChatSession(models.Model):
     total_output_tokens = models.PositiveIntegerField(default=0, help_text="Общее количество выходных токенов")
     total_tokens = models.PositiveIntegerField(default=0, help_text="Общее количество токенов")
     total_estimated_cost = models.DecimalField(max_digits=10, decimal_places=6, default=0, help_text="Общая примерная стоимость")
+    message_count = models.PositiveIntegerField(default=0, help_text="Количество сообщений в сессии")
+    
+    # Сжатая история: краткое содержание сообщений до summary_until включительно
+    summary = models.TextField(blank=True, help_text="Краткое содержание ранней части диалога")
+    summary_tokens = models.PositiveIntegerField(default=0, help_text="Количество токенов краткого содержания")
+    summary_until = models.DateTimeField(null=True, blank=True, help_text="Время последнего сообщения, вошедшего в краткое содержание")
+    summary_offset = models.PositiveIntegerField(default=0, help_text="Сколько начальных символов следующего сообщения уже вошло в краткое содержание")
+    
+    # Агент, для которого создана сессия
+    agent = models.ForeignKey(
+        'Agent',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='sessions',
+        help_text="Агент, которому принадлежит сессия"
+    )
     
     # Поле для связи с функциями
     functions = models.ManyToManyField(
@@ -35,21 +71,49 @@ class ChatSession(models.Model):
     
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # Списки сессий и постраничная выдача по курсору (updated_at, id)
+            models.Index(fields=['-updated_at', '-id'], name='chat_session_updated_idx'),
+        ]
     
     def __str__(self):
         return f"{self.title or 'Безымянная сессия'} ({self.model})"
     
+    TOKEN_STAT_FIELDS = ['total_input_tokens', 'total_output_tokens', 'total_tokens', 'total_estimated_cost', 'message_count']
+    
     def update_token_stats(self):
-        """Обновляет статистику токенов на основе всех сообщений в сессии."""
-        messages = self.messages.all()
-        
-        self.total_input_tokens = sum(msg.input_tokens for msg in messages)
-        self.total_output_tokens = sum(msg.output_tokens for msg in messages)
-        self.total_tokens = sum(msg.total_tokens for msg in messages)
-        self.total_estimated_cost = sum(msg.estimated_cost for msg in messages)
+        """
+        Пересчитывает статистику токенов и число сообщений одним агрегирующим запросом.
+
+        При сохранении сообщений счетчики увеличиваются инкрементально
+        (см. Message.save), поэтому метод нужен только для исправления
+        расхождений, например после удаления сообщений.
+        """
+        totals = self.messages.aggregate(
+            total_input_tokens=Coalesce(Sum('input_tokens'), 0),
+            total_output_tokens=Coalesce(Sum('output_tokens'), 0),
+            total_tokens=Coalesce(Sum('total_tokens'), 0),
+            total_estimated_cost=Coalesce(Sum('estimated_cost'), 0, output_field=models.DecimalField()),
+            message_count=Count('id'),
+        )
+        for field, value in totals.items():
+            setattr(self, field, value)
         
-        self.save(update_fields=['total_input_tokens', 'total_output_tokens', 
-                               'total_tokens', 'total_estimated_cost'])
+        self.save(update_fields=self.TOKEN_STAT_FIELDS)
+    
+    def add_usage(self, input_tokens, output_tokens, total_tokens, estimated_cost, messages=0):
+        """
+        Атомарно прибавляет токены и стоимость (и, при необходимости, число
+        сообщений) к счетчикам сессии, не перечитывая историю.
+        """
+        ChatSession.objects.filter(pk=self.pk).update(
+            total_input_tokens=F('total_input_tokens') + input_tokens,
+            total_output_tokens=F('total_output_tokens') + output_tokens,
+            total_tokens=F('total_tokens') + total_tokens,
+            total_estimated_cost=F('total_estimated_cost') + _cost(estimated_cost),
+            message_count=F('message_count') + messages,
+            updated_at=timezone.now(),
+        )
     
     def get_token_stats(self):
         """Возвращает статистику токенов для сессии."""
@@ -58,7 +122,7 @@ class ChatSession(models.Model):
             'total_output_tokens': self.total_output_tokens,
             'total_tokens': self.total_tokens,
             'total_estimated_cost': float(self.total_estimated_cost),
-            'message_count': self.messages.count(),
+            'message_count': self.message_count,
         }
 
 
@@ -82,12 +146,239 @@ class Message(models.Model):
     output_tokens = models.PositiveIntegerField(default=0, help_text="Количество токенов в ответе")
     total_tokens = models.PositiveIntegerField(default=0, help_text="Общее количество токенов")
     estimated_cost = models.DecimalField(max_digits=10, decimal_places=6, default=0, help_text="Примерная стоимость в долларах")
+    content_tokens = models.PositiveIntegerField(null=True, blank=True, help_text="Количество токенов содержимого (для истории диалога)")
+    model = models.CharField(max_length=100, blank=True, help_text="Модель сессии на момент сохранения сообщения")
     
     class Meta:
         ordering = ['timestamp']
+        indexes = [
+            # История сессии в хронологическом порядке
+            models.Index(fields=['session', 'timestamp'], name='chat_message_session_ts_idx'),
+        ]
     
     def __str__(self):
         return f"{self.role}: {self.content[:50]}..."
+    
+    def save(self, *args, **kwargs):
+        """
+        Сохраняет сообщение; при создании атомарно прибавляет его токены, стоимость
+        и единицу к счетчикам сессии, не перечитывая историю.
+
+        Количество токенов содержимого считается один раз при сохранении
+        и затем берется из content_tokens при сборке контекста.
+        """
+        if self.content_tokens is None:
+            self.content_tokens = TokenCounter().count_tokens(self.content, self.session.model)
+        self.estimated_cost = _cost(self.estimated_cost)
+        if not self.model:
+            self.model = self.session.model
+        adding = self._state.adding
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if adding:
+                self.session.add_usage(
+                    self.input_tokens, self.output_tokens, self.total_tokens, self.estimated_cost, messages=1
+                )
+                UsageRollup.add_message(self)
+
+
+def _hour_bucket(value):
+    """Начало часа (UTC), к которому относится момент времени."""
+    return value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+class UsageRollup(models.Model):
+    """
+    Модель почасовой сводки использования: сообщения, токены и стоимость
+    по (час, сессия, модель) с агентом сессии.
+
+    Строки обновляются инкрементально при сохранении сообщений, поэтому
+    статистика читается за O(интервалов), а не O(сообщений). Пересчет по
+    сохраненным сообщениям: python manage.py rebuild_usage_rollups. Модель
+    берется из сообщения (Message.model), поэтому после смены модели сессии
+    пересчет не переносит прежнюю историю на новую модель.
+
+    Агент однозначно определяется сессией, поэтому в уникальный ключ не
+    входит, но хранится в строке, чтобы статистика и динамика по агенту
+    читались из сводки без обращения к сессиям.
+    """
+    bucket = models.DateTimeField(help_text="Начало часа (UTC)")
+    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='usage_rollups')
+    agent = models.ForeignKey(
+        'Agent', on_delete=models.SET_NULL, null=True, blank=True, related_name='usage_rollups',
+        help_text="Агент сессии"
+    )
+    model = models.CharField(max_length=100)
+    messages = models.PositiveIntegerField(default=0)
+    input_tokens = models.PositiveBigIntegerField(default=0)
+    output_tokens = models.PositiveBigIntegerField(default=0)
+    total_tokens = models.PositiveBigIntegerField(default=0)
+    estimated_cost = models.DecimalField(max_digits=14, decimal_places=6, default=0)
+    
+    class Meta:
+        unique_together = ['bucket', 'session', 'model']
+        indexes = [
+            models.Index(fields=['bucket', 'model']),
+            models.Index(fields=['agent', 'bucket']),
+        ]
+    
+    def __str__(self):
+        return f"{self.bucket:%Y-%m-%d %H:00} {self.model}: {self.total_tokens} токенов"
+    
+    @classmethod
+    def add_message(cls, message):
+        """Прибавляет сообщение к сводке его часа; строка создается при первом сообщении часа."""
+        cls.add_usage(
+            message.session, message.timestamp, message.input_tokens, message.output_tokens,
+            message.total_tokens, message.estimated_cost, messages=1, model=message.model
+        )
+    
+    @classmethod
+    def add_usage(cls, session, timestamp, input_tokens, output_tokens, total_tokens, estimated_cost,
+                  messages=0, model=None):
+        """
+        Прибавляет токены и стоимость к сводке часа timestamp по сессии, модели
+        (по умолчанию — текущей модели сессии) и агенту сессии.
+        """
+        key = {
+            'bucket': _hour_bucket(timestamp),
+            'session_id': session.pk,
+            'model': model or session.model,
+        }
+        increments = {
+            'messages': F('messages') + messages,
+            'input_tokens': F('input_tokens') + input_tokens,
+            'output_tokens': F('output_tokens') + output_tokens,
+            'total_tokens': F('total_tokens') + total_tokens,
+            'estimated_cost': F('estimated_cost') + _cost(estimated_cost),
+        }
+        if cls.objects.filter(**key).update(**increments):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(
+                    **key,
+                    agent_id=session.agent_id,
+                    messages=messages,
+                    input_tokens=input_tokens,
+                    output_tokens=output_tokens,
+                    total_tokens=total_tokens,
+                    estimated_cost=_cost(estimated_cost),
+                )
+        except IntegrityError:
+            # Строку этого часа успели создать параллельно
+            cls.objects.filter(**key).update(**increments)
+    
+    @classmethod
+    def rebuild(cls, sessions=None) -> int:
+        """
+        Пересчитывает сводку по сохраненным сообщениям (всех сессий или указанных).
+
+        Возвращает количество созданных строк.
+        """
+        rollups = cls.objects.all()
+        messages = Message.objects.all()
+        if sessions is not None:
+            rollups = rollups.filter(session__in=sessions)
+            messages = messages.filter(session__in=sessions)
+        
+        rows = (
+            messages
+            .annotate(bucket=TruncHour('timestamp', tzinfo=dt_timezone.utc))
+            .values('bucket', 'session_id', 'model', 'session__agent_id')
+            .annotate(
+                count=Count('id'),
+                input_sum=Coalesce(Sum('input_tokens'), 0),
+                output_sum=Coalesce(Sum('output_tokens'), 0),
+                total_sum=Coalesce(Sum('total_tokens'), 0),
+                cost_sum=Coalesce(Sum('estimated_cost'), 0, output_field=models.DecimalField()),
+            )
+            .order_by()
+        )
+        
+        with transaction.atomic():
+            rollups.delete()
+            created = cls.objects.bulk_create((
+                cls(
+                    bucket=row['bucket'],
+                    session_id=row['session_id'],
+                    model=row['model'],
+                    agent_id=row['session__agent_id'],
+                    messages=row['count'],
+                    input_tokens=row['input_sum'],
+                    output_tokens=row['output_sum'],
+                    total_tokens=row['total_sum'],
+                    estimated_cost=row['cost_sum'],
+                )
+                for row in rows.iterator()
+            ), batch_size=1000)
+        return len(created)
+
+
+def _blob_upload_to(instance, filename):
+    """Путь хранения содержимого файла по его хешу: blobs/ab/abcdef....ext."""
+    extension = os.path.splitext(filename)[1].lower()
+    return f'blobs/{instance.sha256[:2]}/{instance.sha256}{extension}'
+
+
+class FileBlob(models.Model):
+    """Модель для хранения уникального содержимого файла (по sha256)."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    sha256 = models.CharField(max_length=64, unique=True)
+    file = models.FileField(upload_to=_blob_upload_to)
+    size = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    def __str__(self):
+        return f"{self.sha256[:12]} ({self.size} байт)"
+
+
+class FileExtraction(models.Model):
+    """Модель для хранения результатов разбора содержимого файла конкретной версией обработчика."""
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    blob = models.ForeignKey(FileBlob, on_delete=models.CASCADE, related_name='extractions')
+    processor_version = models.CharField(max_length=20)
+    file_type = models.CharField(max_length=20)
+    content_preview = models.TextField(blank=True)
+    training_data = models.JSONField(null=True, blank=True)
+    chunk_count = models.PositiveIntegerField(default=0, help_text="Количество фрагментов в поисковом индексе")
+    created_at = models.DateTimeField(default=timezone.now)
+    
+    class Meta:
+        unique_together = ['blob', 'processor_version', 'file_type']
+    
+    def __str__(self):
+        return f"{self.blob.sha256[:12]} v{self.processor_version} ({self.file_type})"
+
+
+class FileChunk(models.Model):
+    """Модель фрагмента извлеченного содержимого файла для поиска по сессии."""
+    extraction = models.ForeignKey(FileExtraction, on_delete=models.CASCADE, related_name='chunks')
+    position = models.PositiveIntegerField()
+    text = models.TextField()
+    length = models.PositiveIntegerField(help_text="Количество термов во фрагменте")
+    
+    class Meta:
+        ordering = ['extraction', 'position']
+        unique_together = ['extraction', 'position']
+    
+    def __str__(self):
+        return f"{self.extraction_id} #{self.position}"
+
+
+class ChunkPosting(models.Model):
+    """Модель записи инвертированного индекса: терм и число его вхождений во фрагмент."""
+    term = models.CharField(max_length=64)
+    chunk = models.ForeignKey(FileChunk, on_delete=models.CASCADE, related_name='postings')
+    tf = models.PositiveIntegerField()
+    
+    class Meta:
+        indexes = [
+            models.Index(fields=['term', 'chunk']),
+        ]
+    
+    def __str__(self):
+        return f"{self.term} -> {self.chunk_id} ({self.tf})"
 
 
 class UploadedFile(models.Model):
@@ -102,17 +393,113 @@ class UploadedFile(models.Model):
     id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
     session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='files')
     file = models.FileField(upload_to='uploads/%Y/%m/%d/')
+    blob = models.ForeignKey(FileBlob, on_delete=models.SET_NULL, null=True, blank=True, related_name='uploads')
+    extraction = models.ForeignKey(FileExtraction, on_delete=models.SET_NULL, null=True, blank=True, related_name='uploads')
     filename = models.CharField(max_length=255)
     file_type = models.CharField(max_length=20, choices=FILE_TYPE_CHOICES)
     file_size = models.PositiveIntegerField()
     content_preview = models.TextField(blank=True)
+    training_data = models.JSONField(null=True, blank=True, help_text="Содержимое файла, извлеченное для обучения при загрузке")
     uploaded_at = models.DateTimeField(default=timezone.now)
     
     class Meta:
         ordering = ['-uploaded_at']
+        indexes = [
+            models.Index(fields=['session', '-uploaded_at'], name='chat_upload_session_idx'),
+        ]
     
     def __str__(self):
         return f"{self.filename} ({self.file_type})"
+    
+    @property
+    def ingestion_status(self):
+        """Статус фоновой обработки файла; для файлов без задачи — 'ready'."""
+        try:
+            return self.ingestion_job.status
+        except IngestionJob.DoesNotExist:
+            return IngestionJob.STATUS_READY
+    
+    @property
+    def stored_training_data(self):
+        """
+        Сохраненное извлеченное содержимое файла без повторного разбора.
+
+        Содержимое хранится один раз в общем результате разбора (FileExtraction);
+        собственное поле training_data заполнено только у файлов, загруженных
+        до появления кеша разбора.
+        """
+        if self.extraction_id is not None and self.extraction.training_data is not None:
+            return self.extraction.training_data
+        return self.training_data
+    
+    def get_training_data(self):
+        """
+        Возвращает извлеченное содержимое файла для обучения.
+
+        Содержимое сохраняется фоновой задачей обработки; для файлов, загруженных
+        до ее появления, оно извлекается один раз при первом обращении и сохраняется.
+        Пока задача не завершена, возвращается ошибка с текущим статусом.
+        """
+        status = self.ingestion_status
+        if status != IngestionJob.STATUS_READY:
+            if status == IngestionJob.STATUS_ERROR:
+                return {'error': f'Ошибка обработки файла: {self.ingestion_job.error}'}
+            return {'error': 'Файл еще обрабатывается'}
+        
+        training_data = self.stored_training_data
+        if training_data is None:
+            from .file_processor import FileProcessor
+            self.training_data = training_data = FileProcessor().process_file_for_training(self.file)
+            self.save(update_fields=['training_data'])
+        return training_data
+
+
+class IngestionJob(models.Model):
+    """Модель задачи фоновой обработки загруженного файла (очередь в базе данных)."""
+    STATUS_PENDING = 'pending'
+    STATUS_EXTRACTING = 'extracting'
+    STATUS_READY = 'ready'
+    STATUS_ERROR = 'error'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'В очереди'),
+        (STATUS_EXTRACTING, 'Извлечение содержимого'),
+        (STATUS_READY, 'Готов'),
+        (STATUS_ERROR, 'Ошибка'),
+    ]
+    
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    uploaded_file = models.OneToOneField(UploadedFile, on_delete=models.CASCADE, related_name='ingestion_job')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_PENDING)
+    progress = models.PositiveSmallIntegerField(default=0, help_text="Прогресс обработки, %")
+    error = models.TextField(blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True, help_text="Воркер, взявший задачу")
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.uploaded_file.filename}: {self.status} ({self.progress}%)"
+    
+    def to_dict(self):
+        """Возвращает состояние задачи для API."""
+        return {
+            'job_id': str(self.id),
+            'file_id': str(self.uploaded_file_id),
+            'status': self.status,
+            'progress': self.progress,
+            'error': self.error,
+            'attempts': self.attempts,
+            'created_at': self.created_at.isoformat(),
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None,
+        }
 
 
 class PythonFunction(models.Model):
@@ -189,6 +576,7 @@ class Agent(models.Model):
     max_tokens = models.PositiveIntegerField(default=4000, help_text="Максимальное количество токенов")
     system_prompt = models.TextField(blank=True, help_text="Системный промпт")
     web_search = models.BooleanField(default=False, help_text="Включен ли поиск в интернете")
+    response_cache = models.BooleanField(default=False, help_text="Отвечать из кеша на повторяющиеся запросы (для детерминированных настроек)")
     
     # Связь с функциями
     functions = models.ManyToManyField(
@@ -215,6 +603,10 @@ class Agent(models.Model):
     
     class Meta:
         ordering = ['-updated_at']
+        indexes = [
+            # Поиск активного агента по имени при создании и переименовании
+            models.Index(fields=['name', 'is_active'], name='chat_agent_name_active_idx'),
+        ]
     
     def __str__(self):
         return f"{self.name} ({self.model})"
@@ -229,6 +621,8 @@ class Agent(models.Model):
             top_p=self.top_p,
             max_tokens=self.max_tokens,
             system_prompt=self.system_prompt,
+            response_cache=self.response_cache,
+            agent=self,
         )
         self.current_session = session
         self.save()
@@ -249,6 +643,7 @@ class Agent(models.Model):
             'max_tokens': self.max_tokens,
             'system_prompt': self.system_prompt,
             'web_search': self.web_search,
+            'response_cache': self.response_cache,
             'functions': [func.get_function_info() for func in self.functions.filter(is_active=True)],
         }
     
@@ -261,17 +656,21 @@ class Agent(models.Model):
     
     def get_sessions(self):
         """Возвращает все сессии агента."""
-        return ChatSession.objects.filter(
-            model=self.model,
-            system_prompt=self.system_prompt
-        ).order_by('-created_at')
+        return self.sessions.order_by('-created_at')
     
     def get_total_stats(self):
-        """Возвращает общую статистику по всем сессиям агента."""
-        sessions = self.get_sessions()
+        """
+        Возвращает общую статистику по всем сессиям агента: сообщения, токены
+        и стоимость — из почасовой сводки использования.
+        """
+        stats = UsageRollup.objects.filter(agent=self).aggregate(
+            total_messages=Sum('messages'),
+            total_tokens=Sum('total_tokens'),
+            total_cost=Sum('estimated_cost'),
+        )
         return {
-            'total_sessions': sessions.count(),
-            'total_messages': sum(s.messages.count() for s in sessions),
-            'total_tokens': sum(s.total_tokens for s in sessions),
-            'total_cost': sum(float(s.total_estimated_cost) for s in sessions),
+            'total_sessions': self.sessions.count(),
+            'total_messages': stats['total_messages'] or 0,
+            'total_tokens': stats['total_tokens'] or 0,
+            'total_cost': float(stats['total_cost'] or 0),
         }
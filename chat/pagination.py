@@ -0,0 +1,51 @@
+import uuid
+import base64
+from typing import Optional, Tuple, List
+
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+
+
+class InvalidCursor(ValueError):
+    """Некорректный курсор постраничной выдачи."""
+
+
+def encode_cursor(updated_at, pk) -> str:
+    """Кодирует позицию (updated_at, id) последней записи страницы в непрозрачный курсор."""
+    raw = f"{updated_at.isoformat()}|{pk}"
+    return base64.urlsafe_b64encode(raw.encode('utf-8')).decode('ascii')
+
+
+def decode_cursor(cursor: str):
+    """Декодирует курсор в (updated_at, id); при ошибке выбрасывает InvalidCursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor.encode('ascii')).decode('utf-8')
+        updated_at, pk = raw.rsplit('|', 1)
+        parsed = parse_datetime(updated_at)
+        pk = uuid.UUID(pk)
+    except (ValueError, UnicodeError) as e:
+        raise InvalidCursor(str(e))
+    if parsed is None:
+        raise InvalidCursor('Некорректная дата в курсоре')
+    return parsed, pk
+
+
+def keyset_paginate(queryset, cursor: Optional[str], limit: int) -> Tuple[List, Optional[str]]:
+    """
+    Возвращает страницу записей, упорядоченных по (-updated_at, -id), и курсор следующей страницы.
+
+    В отличие от OFFSET стоимость запроса не зависит от номера страницы:
+    выборка продолжается строго после последней записи предыдущей страницы.
+    """
+    queryset = queryset.order_by('-updated_at', '-id')
+    if cursor:
+        updated_at, pk = decode_cursor(cursor)
+        queryset = queryset.filter(Q(updated_at__lt=updated_at) | Q(updated_at=updated_at, id__lt=pk))
+
+    items = list(queryset[:limit + 1])
+    next_cursor = None
+    if len(items) > limit:
+        items = items[:limit]
+        last = items[-1]
+        next_cursor = encode_cursor(last.updated_at, last.pk)
+    return items, next_cursor
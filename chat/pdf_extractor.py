@@ -0,0 +1,215 @@
+import io
+import os
+import time
+import atexit
+import logging
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, Any, List, Optional
+
+import PyPDF2
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _extract_pages(reader: PyPDF2.PdfReader, start: int, end: int, max_chars: int,
+                   deadline: Optional[float] = None) -> List[str]:
+    """
+    Извлекает текст страниц [start, end). Извлечение прекращается, как только
+    диапазон превысил бюджет символов или наступил дедлайн (time.time());
+    дедлайн проверяется между страницами.
+    """
+    pages = []
+    total = 0
+    for page_num in range(start, end):
+        if deadline is not None and time.time() >= deadline:
+            break
+        text = reader.pages[page_num].extract_text() or ''
+        pages.append(text)
+        total += len(text)
+        if total >= max_chars:
+            break
+    return pages
+
+
+def _extract_page_range(path: str, start: int, end: int, max_chars: int, deadline: float) -> List[str]:
+    """
+    Извлекает текст страниц [start, end) из PDF-файла.
+
+    Выполняется в дочернем процессе, поэтому функция находится на уровне
+    модуля и получает путь к временному файлу, а не содержимое: байты
+    документа не сериализуются в каждую задачу.
+    """
+    return _extract_pages(PyPDF2.PdfReader(path), start, end, max_chars, deadline)
+
+
+class PDFExtractor:
+    """
+    Извлечение текста из PDF с распараллеливанием по страницам.
+
+    Диапазоны страниц распределяются по ограниченному пулу процессов,
+    результаты склеиваются в исходном порядке. Количество страниц и символов
+    ограничено бюджетами, а по истечении таймаута пул останавливается вместе
+    с воркерами (следующий вызов создаст новый) и возвращается уже
+    извлеченная часть документа. Небольшие документы разбираются на месте
+    с тем же дедлайном, который проверяется между страницами.
+    """
+
+    _executor = None
+    _executor_lock = threading.Lock()
+
+    def __init__(self, workers: Optional[int] = None, pages_per_task: Optional[int] = None,
+                 max_pages: Optional[int] = None, max_chars: Optional[int] = None,
+                 timeout: Optional[float] = None):
+        self.workers = workers or settings.PDF_EXTRACT_WORKERS
+        self.pages_per_task = pages_per_task or settings.PDF_EXTRACT_PAGES_PER_TASK
+        self.max_pages = max_pages or settings.PDF_EXTRACT_MAX_PAGES
+        self.max_chars = max_chars or settings.PDF_EXTRACT_MAX_CHARS
+        self.timeout = timeout or settings.PDF_EXTRACT_TIMEOUT
+
+    @classmethod
+    def _get_executor(cls, workers: int) -> ProcessPoolExecutor:
+        """Возвращает общий для процесса пул, создавая его при первом обращении."""
+        if cls._executor is None:
+            with cls._executor_lock:
+                if cls._executor is None:
+                    # spawn: дочерние процессы не наследуют потоки и соединения Django
+                    cls._executor = ProcessPoolExecutor(
+                        max_workers=workers,
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+                    logger.info(f"Создан пул процессов для разбора PDF: {workers} воркеров")
+        return cls._executor
+
+    @classmethod
+    def shutdown(cls, terminate: bool = False):
+        """
+        Останавливает пул процессов, отменяя ожидающие задачи. При terminate=True
+        воркеры, которые еще выполняют задачи, завершаются: future.cancel()
+        не прерывает уже запущенную задачу.
+        """
+        with cls._executor_lock:
+            executor, cls._executor = cls._executor, None
+        if executor is None:
+            return
+        processes = list((getattr(executor, '_processes', None) or {}).values()) if terminate else []
+        executor.shutdown(wait=False, cancel_futures=True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    def extract(self, data: bytes, max_pages: Optional[int] = None,
+                max_chars: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Извлекает текст из PDF.
+
+        Возвращает словарь с ключами text, pages (всего страниц в документе),
+        pages_processed, truncated (сработал бюджет) и timed_out.
+        """
+        max_pages = max_pages or self.max_pages
+        max_chars = max_chars or self.max_chars
+        deadline = time.time() + self.timeout
+
+        reader = PyPDF2.PdfReader(io.BytesIO(data))
+        total_pages = len(reader.pages)
+        page_limit = min(total_pages, max_pages)
+        ranges = [
+            (start, min(start + self.pages_per_task, page_limit))
+            for start in range(0, page_limit, self.pages_per_task)
+        ]
+
+        if len(ranges) <= 1 or self.workers <= 1:
+            # Небольшие документы разбираются на месте: запуск задач в пуле дороже
+            chunk = _extract_pages(reader, 0, page_limit, max_chars, deadline)
+            chunks = [chunk]
+            # Разбор остановился раньше последней страницы не из-за бюджета символов
+            timed_out = len(chunk) < page_limit and sum(len(text) for text in chunk) < max_chars
+        else:
+            chunks, timed_out = self._extract_parallel(data, ranges, max_chars, deadline)
+
+        pages = []
+        total_chars = 0
+        for chunk in chunks:
+            for text in chunk:
+                if total_chars >= max_chars:
+                    break
+                pages.append(text)
+                total_chars += len(text) + 1
+
+        text = "\n".join(pages)
+        truncated = len(text) > max_chars or len(pages) < total_pages
+        if len(text) > max_chars:
+            text = text[:max_chars]
+
+        if timed_out:
+            logger.warning(f"Разбор PDF прерван по таймауту {self.timeout} c: обработано {len(pages)} из {total_pages} страниц")
+
+        return {
+            'text': text,
+            'pages': total_pages,
+            'pages_processed': len(pages),
+            'truncated': truncated,
+            'timed_out': timed_out,
+        }
+
+    def _extract_parallel(self, data: bytes, ranges, max_chars: int, deadline: float):
+        """
+        Распределяет диапазоны страниц по пулу процессов и собирает результат по порядку.
+
+        Документ передается воркерам через временный файл. Если пул был
+        остановлен во время разбора (таймаут другого документа или падение
+        воркера), разбор один раз повторяется в новом пуле в пределах дедлайна.
+        """
+        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as tmp:
+            tmp.write(data)
+        try:
+            try:
+                return self._run_ranges(tmp.name, ranges, max_chars, deadline)
+            except BrokenProcessPool:
+                self.shutdown()
+                logger.warning("Пул процессов для разбора PDF был остановлен, повторяем разбор в новом пуле")
+                return self._run_ranges(tmp.name, ranges, max_chars, deadline)
+        finally:
+            try:
+                os.unlink(tmp.name)
+            except OSError:
+                pass
+
+    def _run_ranges(self, path: str, ranges, max_chars: int, deadline: float):
+        executor = self._get_executor(self.workers)
+        futures = [
+            executor.submit(_extract_page_range, path, start, end, max_chars, deadline)
+            for start, end in ranges
+        ]
+
+        done, not_done = wait(futures, timeout=max(deadline - time.time(), 0.0))
+        if not_done:
+            # Запущенные задачи не отменяются, поэтому воркеры завершаются вместе с пулом
+            logger.warning(f"Разбор PDF не уложился в {self.timeout} c, пул процессов перезапускается")
+            self.shutdown(terminate=True)
+
+        # Берем только непрерывный префикс завершенных диапазонов, чтобы не было пропусков в тексте
+        chunks = []
+        total_chars = 0
+        timed_out = bool(not_done)
+        for future, (start, end) in zip(futures, ranges):
+            if future not in done:
+                break
+            chunk = future.result()
+            chunks.append(chunk)
+            total_chars += sum(len(text) for text in chunk)
+            if total_chars >= max_chars:
+                break
+            if len(chunk) < end - start:
+                # Воркер остановился по дедлайну, не дойдя до конца диапазона
+                timed_out = True
+                break
+
+        return chunks, timed_out
+
+
+atexit.register(PDFExtractor.shutdown)
@@ -0,0 +1,359 @@
+"""
+Ограничение нагрузки на API провайдеров LLM.
+
+Для каждого провайдера действуют лимит одновременных запросов и лимиты
+запросов и токенов в минуту (token bucket). Лимиты общие для всех потоков
+процесса; при LLM_RATE_LIMIT_BACKEND = 'cache' поминутные лимиты считаются
+в кеше Django и становятся общими для всех процессов, использующих этот кеш.
+
+Запрос, который не получил разрешение за LLM_QUEUE_TIMEOUT секунд,
+завершается ошибкой ProviderOverloadedError.
+"""
+import time
+import asyncio
+import logging
+import threading
+from contextlib import contextmanager, asynccontextmanager
+from typing import Any, Dict, Optional, Tuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+
+from .resilience import ProviderError
+
+logger = logging.getLogger(__name__)
+
+# Шаг ожидания освобождения слота в асинхронном режиме, секунд
+ASYNC_POLL_INTERVAL = 0.05
+
+
+class ProviderOverloadedError(ProviderError):
+    """Провайдер перегружен: разрешение на запрос не получено за допустимое время ожидания."""
+    status = 503
+    reached_provider = False
+
+    def __init__(self, provider: str, reason: str, retry_after: Optional[float] = None):
+        self.reason = reason
+        super().__init__(
+            f"Провайдер {provider} перегружен ({reason}), повторите запрос позже",
+            provider, retry_after=retry_after,
+        )
+
+
+class TokenBucket:
+    """
+    Token bucket в памяти процесса: capacity единиц в минуту, пополняется
+    непрерывно со скоростью capacity / 60 в секунду.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.rate = capacity / 60.0
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount: int) -> float:
+        """Сколько секунд нужно подождать, пока в ведре наберется amount единиц."""
+        self._refill(time.monotonic())
+        # Запрос больше емкости ведра пропускается, когда ведро полное
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0.0
+        return (amount - self.tokens) / self.rate
+
+    def consume(self, amount: int):
+        self.tokens -= min(amount, self.capacity)
+
+    def reserve(self, amount: int) -> Tuple[float, None]:
+        """Списывает amount, если его хватает; иначе возвращает время ожидания в секундах."""
+        wait = self.wait_time(amount)
+        if not wait:
+            self.consume(amount)
+        return wait, None
+
+    def refund(self, amount: int, window: None = None):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class CacheWindowCounter:
+    """
+    Поминутный счетчик в кеше Django (фиксированное окно): общий лимит для
+    всех процессов, использующих один кеш (например, Redis или Memcached).
+    """
+
+    def __init__(self, key: str, capacity: int, cache_alias: str):
+        self.key = key
+        self.capacity = capacity
+        self.cache_alias = cache_alias
+
+    def _window(self) -> int:
+        return int(time.time() // 60)
+
+    def _window_key(self, window: int) -> str:
+        return f'{self.key}:{window}'
+
+    def reserve(self, amount: int) -> Tuple[float, Optional[str]]:
+        """
+        Списывает amount из текущего окна и возвращает (0, ключ окна). Списание
+        атомарно: сначала incr, и если лимит превышен, списанное возвращается
+        через decr, а результатом будет (время до следующего окна, None).
+        """
+        cache = caches[self.cache_alias]
+        amount = min(amount, self.capacity)
+        key = self._window_key(self._window())
+        cache.add(key, 0, timeout=120)
+        try:
+            used = cache.incr(key, amount)
+        except ValueError:
+            # Окно истекло между add и incr
+            used = amount if cache.add(key, amount, timeout=120) else cache.incr(key, amount)
+        if used <= self.capacity:
+            return 0.0, key
+        self._decr(key, amount)
+        return 60 - time.time() % 60, None
+
+    def refund(self, amount: int, window: Optional[str] = None):
+        """Возвращает amount в окно, из которого он был списан."""
+        if window is not None:
+            self._decr(window, min(amount, self.capacity))
+
+    def _decr(self, key: str, amount: int):
+        try:
+            caches[self.cache_alias].decr(key, amount)
+        except ValueError:
+            # Окно уже истекло: возвращать некуда
+            pass
+
+
+class ProviderLimiter:
+    """
+    Лимиты одного провайдера: семафор одновременных запросов и счетчики
+    запросов и токенов в минуту. Также собирает метрики очереди.
+    """
+
+    def __init__(self, provider: str, max_concurrent: int = 0, requests_per_minute: int = 0,
+                 tokens_per_minute: int = 0, queue_timeout: float = 10.0, backend: str = 'local',
+                 cache_alias: str = 'default'):
+        self.provider = provider
+        self.max_concurrent = max_concurrent
+        self.queue_timeout = queue_timeout
+        self._semaphore = threading.BoundedSemaphore(max_concurrent) if max_concurrent else None
+        self._rate_lock = threading.Lock()
+        self._requests = self._make_counter('requests', requests_per_minute, backend, cache_alias)
+        self._tokens = self._make_counter('tokens', tokens_per_minute, backend, cache_alias)
+        # Счетчики в кеше обращаются к внешнему хранилищу, в асинхронном режиме — через пул потоков
+        self._uses_cache = backend == 'cache' and bool(self._requests or self._tokens)
+
+        self._stats_lock = threading.Lock()
+        self._waiting = 0
+        self._active = 0
+        self._max_waiting = 0
+        self._acquired = 0
+        self._rejected = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+
+    @property
+    def limits_tokens(self) -> bool:
+        return self._tokens is not None
+
+    def _make_counter(self, kind: str, capacity: int, backend: str, cache_alias: str):
+        if not capacity:
+            return None
+        if backend == 'cache':
+            return CacheWindowCounter(f'llm-rate:{self.provider}:{kind}', capacity, cache_alias)
+        return TokenBucket(capacity)
+
+    def _enter_queue(self):
+        with self._stats_lock:
+            self._waiting += 1
+            self._max_waiting = max(self._max_waiting, self._waiting)
+
+    def _leave_queue(self, waited: float, acquired: bool):
+        with self._stats_lock:
+            self._waiting -= 1
+            self._total_wait += waited
+            self._max_wait = max(self._max_wait, waited)
+            if acquired:
+                self._acquired += 1
+                self._active += 1
+            else:
+                self._rejected += 1
+
+    def _try_reserve(self, tokens: int) -> Tuple[float, Optional[str]]:
+        """
+        Списывает запрос и токены из поминутных лимитов, если их хватает на оба;
+        иначе ничего не списывает. Возвращает время ожидания в секундах и окно,
+        из которого списаны токены (для возврата неиспользованного резерва).
+        """
+        with self._rate_lock:
+            request_window = None
+            if self._requests:
+                wait, request_window = self._requests.reserve(1)
+                if wait:
+                    return wait, None
+            token_window = None
+            if self._tokens:
+                wait, token_window = self._tokens.reserve(tokens)
+                if wait:
+                    if self._requests:
+                        self._requests.refund(1, request_window)
+                    return wait, None
+            return 0.0, token_window
+
+    def _reject(self, reason: str, retry_after: Optional[float] = None):
+        logger.warning(f"Провайдер {self.provider}: запрос отклонен ({reason})")
+        raise ProviderOverloadedError(self.provider, reason, retry_after)
+
+    def _release(self, reserved: int, used: Optional[int], window: Optional[str]):
+        if self._semaphore:
+            self._semaphore.release()
+        with self._stats_lock:
+            self._active -= 1
+        # Неиспользованный резерв токенов возвращается в то окно, из которого был списан
+        if self._tokens and used is not None and used < reserved:
+            with self._rate_lock:
+                self._tokens.refund(reserved - used, window)
+
+    @contextmanager
+    def acquire(self, tokens: int = 0):
+        """
+        Ждет свободный слот и поминутные лимиты (не дольше queue_timeout) и
+        резервирует tokens токенов. В блок передается словарь usage: если
+        записать в usage['tokens'] фактическое количество токенов, остаток
+        резерва вернется в лимит.
+        """
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        self._enter_queue()
+        acquired = False
+        try:
+            if self._semaphore and not self._semaphore.acquire(timeout=self.queue_timeout):
+                self._reject('лимит одновременных запросов')
+            try:
+                while True:
+                    wait, window = self._try_reserve(tokens)
+                    if not wait:
+                        break
+                    if time.monotonic() + wait > deadline:
+                        self._reject('лимит запросов или токенов в минуту', retry_after=wait)
+                    time.sleep(wait)
+            except BaseException:
+                if self._semaphore:
+                    self._semaphore.release()
+                raise
+            acquired = True
+        finally:
+            self._leave_queue(time.monotonic() - started, acquired)
+
+        usage: Dict[str, Any] = {'tokens': None}
+        try:
+            yield usage
+        except BaseException:
+            # Неудачный или прерванный запрос (в том числе закрытый клиентом поток),
+            # для которого не записан фактический расход, не расходует токены лимита
+            if usage['tokens'] is None:
+                usage['tokens'] = 0
+            raise
+        finally:
+            self._release(tokens, usage['tokens'], window)
+
+    @asynccontextmanager
+    async def aacquire(self, tokens: int = 0):
+        """Асинхронная версия acquire: ожидание не блокирует цикл событий."""
+        started = time.monotonic()
+        deadline = started + self.queue_timeout
+        self._enter_queue()
+        acquired = False
+        try:
+            if self._semaphore:
+                while not self._semaphore.acquire(blocking=False):
+                    if time.monotonic() >= deadline:
+                        self._reject('лимит одновременных запросов')
+                    await asyncio.sleep(ASYNC_POLL_INTERVAL)
+            try:
+                while True:
+                    if self._uses_cache:
+                        wait, window = await sync_to_async(self._try_reserve, thread_sensitive=False)(tokens)
+                    else:
+                        wait, window = self._try_reserve(tokens)
+                    if not wait:
+                        break
+                    if time.monotonic() + wait > deadline:
+                        self._reject('лимит запросов или токенов в минуту', retry_after=wait)
+                    await asyncio.sleep(wait)
+            except BaseException:
+                if self._semaphore:
+                    self._semaphore.release()
+                raise
+            acquired = True
+        finally:
+            self._leave_queue(time.monotonic() - started, acquired)
+
+        usage: Dict[str, Any] = {'tokens': None}
+        try:
+            yield usage
+        except BaseException:
+            # Неудачный или отмененный запрос, для которого не записан фактический
+            # расход, не расходует токены лимита
+            if usage['tokens'] is None:
+                usage['tokens'] = 0
+            raise
+        finally:
+            if self._uses_cache:
+                await sync_to_async(self._release, thread_sensitive=False)(tokens, usage['tokens'], window)
+            else:
+                self._release(tokens, usage['tokens'], window)
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            finished = self._acquired + self._rejected
+            return {
+                'max_concurrent': self.max_concurrent,
+                'active': self._active,
+                'queue_depth': self._waiting,
+                'max_queue_depth': self._max_waiting,
+                'acquired': self._acquired,
+                'rejected': self._rejected,
+                'avg_wait_ms': round(self._total_wait * 1000 / finished, 1) if finished else 0.0,
+                'max_wait_ms': round(self._max_wait * 1000, 1),
+            }
+
+
+_limiters: Dict[str, ProviderLimiter] = {}
+_limiters_lock = threading.Lock()
+
+
+def get_limiter(provider: str) -> ProviderLimiter:
+    """
+    Возвращает общий для процесса ограничитель провайдера. Значения по
+    умолчанию (LLM_MAX_CONCURRENT, LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE,
+    LLM_QUEUE_TIMEOUT) переопределяются для провайдера в LLM_PROVIDER_LIMITS.
+    """
+    limiter = _limiters.get(provider)
+    if limiter is None:
+        with _limiters_lock:
+            limiter = _limiters.get(provider)
+            if limiter is None:
+                overrides = settings.LLM_PROVIDER_LIMITS.get(provider, {})
+                limiter = ProviderLimiter(
+                    provider,
+                    max_concurrent=overrides.get('max_concurrent', settings.LLM_MAX_CONCURRENT),
+                    requests_per_minute=overrides.get('requests_per_minute', settings.LLM_REQUESTS_PER_MINUTE),
+                    tokens_per_minute=overrides.get('tokens_per_minute', settings.LLM_TOKENS_PER_MINUTE),
+                    queue_timeout=overrides.get('queue_timeout', settings.LLM_QUEUE_TIMEOUT),
+                    backend=settings.LLM_RATE_LIMIT_BACKEND,
+                    cache_alias=settings.LLM_RATE_LIMIT_CACHE_ALIAS,
+                )
+                _limiters[provider] = limiter
+    return limiter
+
+
+def get_stats() -> Dict[str, Dict[str, Any]]:
+    """Метрики ограничителей по провайдерам."""
+    return {provider: limiter.get_stats() for provider, limiter in list(_limiters.items())}
@@ -0,0 +1,333 @@
+"""
+Устойчивость обращений к провайдерам LLM.
+
+Временные сбои (ошибки соединения, ответы 5xx и 429) повторяются с
+экспоненциальной задержкой со случайным разбросом в пределах общего
+дедлайна LLM_RETRY_DEADLINE; заголовок Retry-After учитывается. Для каждого
+провайдера действует автоматический выключатель (circuit breaker): после
+LLM_CIRCUIT_FAILURE_THRESHOLD сбоев подряд запросы к провайдеру сразу
+завершаются ошибкой CircuitOpenError, пока не пройдет LLM_CIRCUIT_RESET_TIMEOUT
+секунд, после чего выполняется один пробный запрос.
+
+Ошибки провайдеров передаются вызывающему коду исключениями ProviderError,
+а не текстом ответа модели.
+"""
+import time
+import random
+import asyncio
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from email.utils import parsedate_to_datetime
+from typing import Any, Awaitable, Callable, Dict, Optional, TypeVar
+
+import httpx
+import requests
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar('T')
+
+# Статусы ответа, при которых запрос повторяется
+RETRYABLE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+# Момент (time.monotonic), к которому должен завершиться текущий вызов провайдера
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar('llm_call_deadline', default=None)
+
+
+class ProviderError(Exception):
+    """
+    Ошибка обращения к провайдеру LLM.
+
+    retryable — можно ли повторить запрос; retry_after — через сколько
+    секунд провайдер просит повторить запрос (если известно); status —
+    HTTP-статус ответа клиенту; reached_provider — дошел ли запрос до
+    провайдера (учитывается выключателем).
+    """
+    status = 502
+    reached_provider = True
+
+    def __init__(self, message: str, provider: Optional[str] = None, retryable: bool = False,
+                 status_code: Optional[int] = None, retry_after: Optional[float] = None):
+        super().__init__(message)
+        self.provider = provider
+        self.retryable = retryable
+        self.status_code = status_code
+        self.retry_after = retry_after
+
+
+class ProviderConfigError(ProviderError):
+    """Провайдер не настроен (например, не задан API ключ)."""
+    status = 500
+    reached_provider = False
+
+
+class ProviderAuthError(ProviderError):
+    """Провайдер отклонил учетные данные."""
+
+
+class ProviderRequestError(ProviderError):
+    """Провайдер отклонил запрос или вернул ответ в неожиданном формате."""
+
+
+class ProviderUnavailableError(ProviderError):
+    """Провайдер временно недоступен: ошибка соединения, таймаут, ответ 5xx или 429."""
+    status = 503
+
+
+class CircuitOpenError(ProviderUnavailableError):
+    """Выключатель провайдера разомкнут: запросы не отправляются до окончания паузы."""
+    reached_provider = False
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Разбирает заголовок Retry-After (секунды или HTTP-дата) в секунды ожидания."""
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def classify_error(provider: str, error: Exception) -> ProviderError:
+    """Преобразует исключение HTTP-клиента или разбора ответа в ProviderError."""
+    if isinstance(error, ProviderError):
+        if error.provider is None:
+            error.provider = provider
+        return error
+
+    response = getattr(error, 'response', None)
+    if isinstance(error, (requests.HTTPError, httpx.HTTPStatusError)) and response is not None:
+        status_code = response.status_code
+        message = f"Провайдер {provider} вернул ошибку {status_code}"
+        if status_code in RETRYABLE_STATUSES:
+            return ProviderUnavailableError(
+                message, provider, retryable=True, status_code=status_code,
+                retry_after=parse_retry_after(response.headers.get('Retry-After')),
+            )
+        if status_code in (401, 403):
+            return ProviderAuthError(message, provider, status_code=status_code)
+        return ProviderRequestError(message, provider, status_code=status_code)
+
+    # Повторяем только ошибки, при которых запрос заведомо не был обработан
+    if isinstance(error, (requests.ConnectionError, requests.ConnectTimeout,
+                          httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)):
+        return ProviderUnavailableError(f"Нет соединения с провайдером {provider}: {error}", provider, retryable=True)
+    if isinstance(error, (requests.Timeout, httpx.TimeoutException)):
+        return ProviderUnavailableError(f"Провайдер {provider} не ответил вовремя: {error}", provider)
+    if isinstance(error, (requests.RequestException, httpx.HTTPError)):
+        return ProviderUnavailableError(f"Ошибка обращения к провайдеру {provider}: {error}", provider)
+    if isinstance(error, (ValueError, KeyError, IndexError, TypeError)):
+        return ProviderRequestError(f"Некорректный ответ провайдера {provider}: {error}", provider)
+    return ProviderError(f"Ошибка обращения к провайдеру {provider}: {error}", provider)
+
+
+def remaining_time() -> Optional[float]:
+    """Сколько секунд осталось до дедлайна текущего вызова провайдера (None — дедлайна нет)."""
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    return max(deadline - time.monotonic(), 0.0)
+
+
+@contextmanager
+def _call_deadline(deadline: float):
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class CircuitBreaker:
+    """
+    Выключатель провайдера: closed — запросы проходят; open — запросы сразу
+    отклоняются; half_open — после паузы пропускается один пробный запрос,
+    успех замыкает выключатель, сбой снова размыкает.
+    """
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, provider: str, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.provider = provider
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._times_opened = 0
+        self._rejected = 0
+
+    def before_call(self):
+        """Проверяет, можно ли отправить запрос; иначе вызывает CircuitOpenError."""
+        if not self.failure_threshold:
+            return
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            remaining = self._opened_at + self.reset_timeout - time.monotonic()
+            if self._state == self.OPEN and remaining <= 0:
+                self._state = self.HALF_OPEN
+                self._trial_in_flight = False
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                logger.info(f"Провайдер {self.provider}: пробный запрос после паузы")
+                return
+            self._rejected += 1
+        raise CircuitOpenError(
+            f"Провайдер {self.provider} временно недоступен, повторите запрос позже",
+            self.provider, retry_after=max(remaining, 1.0),
+        )
+
+    def record_success(self):
+        with self._lock:
+            if self._state != self.CLOSED:
+                logger.info(f"Провайдер {self.provider} снова доступен")
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        if not self.failure_threshold:
+            return
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                if self._state != self.OPEN:
+                    self._times_opened += 1
+                    logger.warning(
+                        f"Провайдер {self.provider}: {self._failures} сбоев подряд, "
+                        f"запросы приостановлены на {self.reset_timeout} сек."
+                    )
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+    def record(self, error: ProviderError):
+        """Учитывает результат неудачного запроса: сбоем считается только недоступность провайдера."""
+        if not error.reached_provider:
+            # Запрос не был отправлен: пробный запрос остается за следующим вызовом
+            with self._lock:
+                self._trial_in_flight = False
+            return
+        if isinstance(error, ProviderUnavailableError):
+            self.record_failure()
+        else:
+            # Провайдер ответил, хотя и ошибкой: он доступен
+            self.record_success()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'state': self._state,
+                'consecutive_failures': self._failures,
+                'times_opened': self._times_opened,
+                'rejected': self._rejected,
+            }
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(provider: str) -> CircuitBreaker:
+    """Возвращает общий для процесса выключатель провайдера."""
+    breaker = _breakers.get(provider)
+    if breaker is None:
+        with _breakers_lock:
+            breaker = _breakers.get(provider)
+            if breaker is None:
+                breaker = _breakers[provider] = CircuitBreaker(
+                    provider,
+                    failure_threshold=settings.LLM_CIRCUIT_FAILURE_THRESHOLD,
+                    reset_timeout=settings.LLM_CIRCUIT_RESET_TIMEOUT,
+                )
+    return breaker
+
+
+def get_stats() -> Dict[str, Dict[str, Any]]:
+    """Состояние выключателей по провайдерам."""
+    return {provider: breaker.get_stats() for provider, breaker in list(_breakers.items())}
+
+
+def _backoff_delay(attempt: int, error: ProviderError) -> float:
+    """Задержка перед повтором: экспоненциальная со случайным разбросом (full jitter), не меньше Retry-After."""
+    delay = random.uniform(0, min(settings.LLM_RETRY_MAX_DELAY, settings.LLM_RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+    if error.retry_after is not None:
+        delay = max(delay, error.retry_after)
+    return delay
+
+
+def _next_delay(provider: str, attempt: int, error: ProviderError, deadline: float) -> Optional[float]:
+    """Задержка перед следующей попыткой или None, если повторять нельзя."""
+    if not error.retryable or attempt > settings.LLM_RETRY_MAX_RETRIES:
+        return None
+    delay = _backoff_delay(attempt, error)
+    if time.monotonic() + delay >= deadline:
+        logger.warning(f"Провайдер {provider}: повтор не успевает до дедлайна ({error})")
+        return None
+    logger.warning(f"Провайдер {provider}: {error}. Повтор {attempt} через {delay:.2f} сек.")
+    return delay
+
+
+def call_with_retries(provider: str, func: Callable[[], T]) -> T:
+    """
+    Вызывает func с повторами временных сбоев через выключатель провайдера.
+    Ошибки передаются наружу как ProviderError.
+    """
+    breaker = get_breaker(provider)
+    deadline = time.monotonic() + settings.LLM_RETRY_DEADLINE
+    attempt = 0
+    with _call_deadline(deadline):
+        while True:
+            breaker.before_call()
+            try:
+                result = func()
+            except Exception as e:
+                error = classify_error(provider, e)
+                breaker.record(error)
+                attempt += 1
+                delay = _next_delay(provider, attempt, error, deadline)
+                if delay is None:
+                    if error is e:
+                        raise
+                    raise error from e
+                time.sleep(delay)
+                continue
+            breaker.record_success()
+            return result
+
+
+async def acall_with_retries(provider: str, func: Callable[[], Awaitable[T]]) -> T:
+    """Асинхронная версия call_with_retries: func возвращает новую корутину на каждую попытку."""
+    breaker = get_breaker(provider)
+    deadline = time.monotonic() + settings.LLM_RETRY_DEADLINE
+    attempt = 0
+    with _call_deadline(deadline):
+        while True:
+            breaker.before_call()
+            try:
+                result = await func()
+            except Exception as e:
+                error = classify_error(provider, e)
+                breaker.record(error)
+                attempt += 1
+                delay = _next_delay(provider, attempt, error, deadline)
+                if delay is None:
+                    if error is e:
+                        raise
+                    raise error from e
+                await asyncio.sleep(delay)
+                continue
+            breaker.record_success()
+            return result
@@ -0,0 +1,182 @@
+import re
+import json
+import math
+import logging
+from collections import Counter, defaultdict
+from typing import Dict, Any, List, Iterable
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Avg, Count
+
+from .models import FileExtraction, FileChunk, ChunkPosting
+from .token_counter import TokenCounter
+
+logger = logging.getLogger(__name__)
+
+# Параметры BM25
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Типы файлов, содержимое которых индексируется как текст
+INDEXED_FILE_TYPES = {'text', 'python', 'pdf', 'json', 'csv', 'markdown'}
+
+_TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """Разбивает текст на термы для индекса: слова в нижнем регистре, длиной от 2 символов."""
+    return [term[:64] for term in _TERM_RE.findall(text.lower()) if len(term) > 1]
+
+
+def extraction_text(training_data: Dict[str, Any]) -> str:
+    """Возвращает текст извлеченного содержимого, пригодный для индексации."""
+    if not training_data or 'error' in training_data:
+        return ''
+    if training_data.get('type') not in INDEXED_FILE_TYPES:
+        return ''
+    content = training_data.get('content', '')
+    if training_data.get('type') == 'json':
+        return json.dumps(content, ensure_ascii=False, indent=2)
+    return content or ''
+
+
+def split_into_chunks(text: str, chunk_chars: int, overlap: int) -> List[str]:
+    """
+    Делит текст на фрагменты примерно по chunk_chars символов с перекрытием overlap.
+
+    Граница фрагмента по возможности переносится на конец абзаца, строки или
+    предложения, чтобы не разрезать их посередине.
+    """
+    text = text.strip()
+    if not text:
+        return []
+
+    chunks = []
+    start = 0
+    length = len(text)
+    while start < length:
+        end = min(start + chunk_chars, length)
+        if end < length:
+            window = text[start:end]
+            for separator in ('\n\n', '\n', '. '):
+                cut = window.rfind(separator)
+                if cut > chunk_chars // 2:
+                    end = start + cut + len(separator)
+                    break
+        chunk = text[start:end].strip()
+        if chunk:
+            chunks.append(chunk)
+        if end >= length:
+            break
+        start = max(end - overlap, start + 1)
+    return chunks
+
+
+def index_extraction(extraction: FileExtraction) -> int:
+    """
+    Строит индекс для результата разбора файла: фрагменты и инвертированный индекс термов.
+
+    Индекс строится один раз на FileExtraction и общий для всех загрузок
+    одинакового содержимого. Возвращает количество фрагментов.
+    """
+    if extraction.chunk_count or FileChunk.objects.filter(extraction=extraction).exists():
+        return extraction.chunk_count
+
+    texts = split_into_chunks(
+        extraction_text(extraction.training_data),
+        settings.RETRIEVAL_CHUNK_CHARS,
+        settings.RETRIEVAL_CHUNK_OVERLAP
+    )
+    if not texts:
+        return 0
+
+    with transaction.atomic():
+        term_counts = [Counter(tokenize(text)) for text in texts]
+        chunks = FileChunk.objects.bulk_create([
+            FileChunk(extraction=extraction, position=position, text=text, length=sum(counts.values()))
+            for position, (text, counts) in enumerate(zip(texts, term_counts))
+        ])
+        # На некоторых БД bulk_create не возвращает первичные ключи
+        if chunks and chunks[0].pk is None:
+            chunks = list(FileChunk.objects.filter(extraction=extraction).order_by('position'))
+        ChunkPosting.objects.bulk_create([
+            ChunkPosting(term=term, chunk=chunk, tf=tf)
+            for chunk, counts in zip(chunks, term_counts)
+            for term, tf in counts.items()
+        ], batch_size=1000)
+        FileExtraction.objects.filter(id=extraction.id).update(chunk_count=len(chunks))
+        extraction.chunk_count = len(chunks)
+
+    logger.info(f"Построен индекс файла: {len(chunks)} фрагментов (извлечение {extraction.id})")
+    return len(chunks)
+
+
+def search_chunks(extraction_ids: Iterable, query: str, top_k: int) -> List[FileChunk]:
+    """Возвращает top_k фрагментов по BM25 среди фрагментов указанных извлечений."""
+    extraction_ids = list(extraction_ids)
+    terms = set(tokenize(query))
+    if not extraction_ids or not terms:
+        return []
+
+    corpus = FileChunk.objects.filter(extraction_id__in=extraction_ids)
+    stats = corpus.aggregate(total=Count('id'), avg_length=Avg('length'))
+    total_chunks = stats['total'] or 0
+    avg_length = stats['avg_length'] or 1
+    if not total_chunks:
+        return []
+
+    postings = ChunkPosting.objects.filter(term__in=terms, chunk__extraction_id__in=extraction_ids)
+    document_frequency = {
+        row['term']: row['df'] for row in postings.values('term').annotate(df=Count('id'))
+    }
+
+    scores = defaultdict(float)
+    for chunk_id, term, tf, length in postings.values_list('chunk_id', 'term', 'tf', 'chunk__length'):
+        df = document_frequency[term]
+        idf = math.log(1 + (total_chunks - df + 0.5) / (df + 0.5))
+        norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length)
+        scores[chunk_id] += idf * tf * (BM25_K1 + 1) / norm
+
+    best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+    chunks = FileChunk.objects.in_bulk([chunk_id for chunk_id, _ in best])
+    return [chunks[chunk_id] for chunk_id, _ in best]
+
+
+def retrieve_context(files, query: str, model: str) -> str:
+    """
+    Формирует контекст из фрагментов файлов сессии, наиболее релевантных сообщению.
+
+    В контекст попадают top-k фрагментов по BM25 в пределах бюджета токенов
+    RETRIEVAL_TOKEN_BUDGET. Если ни один терм запроса не найден, берутся
+    начальные фрагменты файлов.
+    """
+    filenames = {}
+    for uploaded_file in files:
+        if uploaded_file.extraction_id and uploaded_file.extraction.chunk_count:
+            filenames.setdefault(uploaded_file.extraction_id, uploaded_file.filename)
+    if not filenames:
+        return ''
+
+    chunks = search_chunks(filenames.keys(), query, settings.RETRIEVAL_TOP_K)
+    if not chunks:
+        chunks = list(FileChunk.objects.filter(
+            extraction_id__in=filenames.keys(), position=0
+        )[:settings.RETRIEVAL_TOP_K])
+
+    token_counter = TokenCounter()
+    budget = settings.RETRIEVAL_TOKEN_BUDGET
+    parts = []
+    for chunk in chunks:
+        part = f"[{filenames[chunk.extraction_id]}, фрагмент {chunk.position + 1}]\n{chunk.text}"
+        tokens = token_counter.count_tokens(part, model)
+        if tokens > budget:
+            continue
+        budget -= tokens
+        parts.append(part)
+
+    if not parts:
+        return ''
+
+    logger.info(f"Найдено фрагментов файлов для контекста: {len(parts)} (остаток бюджета {budget} токенов)")
+    return "Фрагменты загруженных файлов, относящиеся к вопросу:\n\n" + "\n\n".join(parts)
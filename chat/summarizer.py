@@ -0,0 +1,207 @@
+import logging
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from .context_builder import MESSAGE_OVERHEAD_TOKENS
+from .llm_service import LLMService
+from .model_config import get_context_window
+from .models import ChatSession, UsageRollup
+from .resilience import ProviderError
+from .token_counter import TokenCounter
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTION = (
+    "Ты ведешь краткое содержание диалога пользователя с ассистентом. "
+    "Обнови краткое содержание с учетом новых сообщений: сохрани факты, решения, "
+    "договоренности и открытые вопросы, опусти приветствия и повторы. "
+    "Ответь только текстом краткого содержания."
+)
+
+_in_progress = set()
+_in_progress_lock = threading.Lock()
+
+
+def pending_messages(session):
+    """Сообщения сессии, еще не вошедшие в краткое содержание, в хронологическом порядке."""
+    messages = session.messages.filter(role__in=('user', 'assistant'))
+    if session.summary_until:
+        messages = messages.filter(timestamp__gt=session.summary_until)
+    return messages.order_by('timestamp')
+
+
+def needs_summary(session) -> bool:
+    """Проверяет, превысили ли сообщения вне краткого содержания порог CONTEXT_SUMMARY_TRIGGER_TOKENS."""
+    pending_tokens = pending_messages(session).aggregate(tokens=Sum('content_tokens'))['tokens'] or 0
+    return pending_tokens > settings.CONTEXT_SUMMARY_TRIGGER_TOKENS
+
+
+def _format_message(message) -> str:
+    return f"{'Пользователь' if message.role == 'user' else 'Ассистент'}: {message.content}"
+
+
+def _fold_budget(session, token_counter) -> int:
+    """
+    Бюджет токенов на новые сообщения в запросе сжатия: окно контекста модели
+    за вычетом ответа (CONTEXT_SUMMARY_MAX_TOKENS), инструкции и прежнего
+    краткого содержания.
+    """
+    used = token_counter.count_messages_tokens([
+        {'role': 'system', 'content': SUMMARY_INSTRUCTION},
+        {'role': 'user', 'content': f"Текущее краткое содержание:\n{session.summary or '(пусто)'}\n\nНовые сообщения:\n"},
+    ], session.model)
+    return get_context_window(session.model) - settings.CONTEXT_SUMMARY_MAX_TOKENS - used
+
+
+def _select_fold(messages, budget: int, token_counter, model: str, offset: int = 0):
+    """
+    Старейшие сообщения, помещающиеся в бюджет токенов; остальные будут
+    добавлены при следующем сжатии. offset — сколько начальных символов
+    первого сообщения уже вошло в краткое содержание.
+
+    Первое сообщение берется всегда, чтобы сжатие продвигалось: если оно не
+    помещается в бюджет, берется только его часть, а остаток войдет в
+    следующие сжатия. Возвращает (сообщения, offset после сжатия): 0, если
+    последнее сообщение вошло целиком.
+    """
+    selected = []
+    for message in messages:
+        if not selected and offset:
+            message.content = message.content[offset:]
+            tokens = token_counter.count_tokens(message.content, model)
+        else:
+            tokens = message.content_tokens
+            if tokens is None:
+                tokens = token_counter.count_tokens(message.content, model)
+        tokens += MESSAGE_OVERHEAD_TOKENS
+        if tokens > budget:
+            if not selected:
+                # Берем начало, пропорциональное доле, которая помещается в бюджет
+                length = max(len(message.content) * max(budget, 0) // tokens, 1)
+                message.content = message.content[:length]
+                return [message], offset + length
+            break
+        budget -= tokens
+        selected.append(message)
+    return selected, 0
+
+def _record_usage(session, result):
+    """Учитывает токены и стоимость запроса сжатия в счетчиках сессии и почасовой сводке."""
+    with transaction.atomic():
+        session.add_usage(
+            result['input_tokens'], result['output_tokens'], result['total_tokens'], result['cost']['total_cost']
+        )
+        UsageRollup.add_usage(
+            session, timezone.now(), result['input_tokens'], result['output_tokens'],
+            result['total_tokens'], result['cost']['total_cost']
+        )
+
+
+def summarize_session(session) -> bool:
+    """
+    Добавляет к краткому содержанию сессии старые сообщения, оставляя последние
+    CONTEXT_SUMMARY_KEEP_MESSAGES как есть. Модели передаются только прежнее
+    краткое содержание и новые сообщения в пределах окна контекста модели,
+    поэтому стоимость сжатия не растет с длиной диалога.
+
+    Сообщение, которое не помещается в запрос сжатия целиком, сжимается по
+    частям за несколько вызовов (см. ChatSession.summary_offset) и до конца
+    остается в истории диалога.
+
+    Токены и стоимость запроса сжатия прибавляются к счетчикам сессии и
+    почасовой сводке (сообщением они не сохраняются, поэтому пересчет по
+    сообщениям их не восстанавливает).
+
+    Возвращает True, если краткое содержание обновлено.
+    """
+    pending = list(pending_messages(session).only('role', 'content', 'content_tokens', 'timestamp'))
+    keep = settings.CONTEXT_SUMMARY_KEEP_MESSAGES
+    to_fold = pending[:-keep] if keep else pending
+    if not to_fold:
+        return False
+
+    token_counter = TokenCounter()
+    to_fold, offset = _select_fold(
+        to_fold, _fold_budget(session, token_counter), token_counter, session.model, session.summary_offset
+    )
+    dialog = "\n\n".join(_format_message(message) for message in to_fold)
+    prompt = (
+        f"Текущее краткое содержание:\n{session.summary or '(пусто)'}\n\n"
+        f"Новые сообщения:\n{dialog}"
+    )
+
+    try:
+        result = LLMService().generate_response(
+            model=session.model,
+            messages=[
+                {'role': 'system', 'content': SUMMARY_INSTRUCTION},
+                {'role': 'user', 'content': prompt},
+            ],
+            temperature=0.3,
+            top_p=1.0,
+            max_tokens=settings.CONTEXT_SUMMARY_MAX_TOKENS,
+        )
+    except ProviderError as e:
+        logger.warning(f"Не удалось обновить краткое содержание сессии {session.session_id}: {e}")
+        return False
+    # Запрос к модели оплачен независимо от того, будет ли результат сохранен
+    _record_usage(session, result)
+    summary = (result.get('content') or '').strip()
+    if not summary:
+        logger.warning(f"Модель вернула пустое краткое содержание сессии {session.session_id}")
+        return False
+
+    # Условное обновление: если сессию успели сжать параллельно, результат отбрасывается.
+    # Сообщение, сжатое не целиком, остается после summary_until до сжатия остатка
+    updated = ChatSession.objects.filter(
+        pk=session.pk, summary_until=session.summary_until, summary_offset=session.summary_offset
+    ).update(
+        summary=summary,
+        summary_tokens=token_counter.count_tokens(summary, session.model),
+        summary_until=session.summary_until if offset else to_fold[-1].timestamp,
+        summary_offset=offset,
+    )
+    if updated:
+        logger.info(
+            f"Краткое содержание сессии {session.session_id} обновлено: добавлено {len(to_fold)} сообщений"
+            f"{f' (первые {offset} символов последнего)' if offset else ''}, "
+            f"потрачено {result['total_tokens']} токенов"
+        )
+    return bool(updated)
+
+
+def _summarize_in_background(session_pk):
+    try:
+        close_old_connections()
+        session = ChatSession.objects.get(pk=session_pk)
+        if needs_summary(session):
+            summarize_session(session)
+    except Exception as e:
+        logger.error(f"Ошибка сжатия истории сессии {session_pk}: {str(e)}")
+    finally:
+        close_old_connections()
+        with _in_progress_lock:
+            _in_progress.discard(session_pk)
+
+
+def schedule_summary(session):
+    """
+    Запускает сжатие истории сессии в фоновом потоке, не задерживая ответ пользователю.
+
+    Ничего не делает, если CONTEXT_SUMMARY_ENABLED выключен или сжатие этой
+    сессии уже выполняется. Порог проверяется в фоновом потоке, поэтому
+    функцию можно вызывать и из асинхронных представлений.
+    """
+    if not settings.CONTEXT_SUMMARY_ENABLED:
+        return
+    with _in_progress_lock:
+        if session.pk in _in_progress:
+            return
+        _in_progress.add(session.pk)
+    threading.Thread(
+        target=_summarize_in_background, args=(session.pk,), name=f'summary-{session.pk}', daemon=True
+    ).start()
@@ -0,0 +1,116 @@
+import io
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from chat import ingestion
+from chat.ingestion import claim_next_job, process_job, requeue_stale_jobs
+from chat.models import ChatSession, FileBlob, FileExtraction, IngestionJob, UploadedFile
+
+
+@override_settings(INGESTION_JOB_TIMEOUT=600, INGESTION_MAX_ATTEMPTS=3)
+class IngestionQueueTests(TestCase):
+    """Захват задач очереди и возврат зависших задач."""
+
+    def setUp(self):
+        self.session = ChatSession.objects.create(session_id='ingestion', model='gpt-4o-mini')
+        self.now = timezone.now()
+
+    def _job(self, name, **kwargs):
+        uploaded_file = UploadedFile.objects.create(
+            session=self.session, file=f'uploads/{name}', filename=name, file_type='text', file_size=1
+        )
+        kwargs.setdefault('created_at', self.now)
+        return IngestionJob.objects.create(uploaded_file=uploaded_file, **kwargs)
+
+    def test_claims_oldest_pending_job(self):
+        newer = self._job('newer.txt')
+        older = self._job('older.txt', created_at=self.now - timedelta(minutes=1))
+        self._job('done.txt', status=IngestionJob.STATUS_READY, created_at=self.now - timedelta(hours=1))
+
+        job = claim_next_job('worker-1')
+        self.assertEqual(job.id, older.id)
+        self.assertEqual(job.status, IngestionJob.STATUS_EXTRACTING)
+        self.assertEqual(job.worker, 'worker-1')
+        self.assertEqual(job.attempts, 1)
+        self.assertIsNotNone(job.started_at)
+
+        self.assertEqual(claim_next_job('worker-2').id, newer.id)
+        self.assertIsNone(claim_next_job('worker-3'))
+
+    def test_claimed_job_is_not_claimed_again(self):
+        job = self._job('file.txt')
+        # Другой воркер успел забрать задачу между выборкой кандидатов и UPDATE
+        IngestionJob.objects.filter(id=job.id).update(status=IngestionJob.STATUS_EXTRACTING, worker='other')
+        self.assertIsNone(claim_next_job('worker-1'))
+        job.refresh_from_db()
+        self.assertEqual(job.worker, 'other')
+
+    def test_requeues_stale_jobs(self):
+        stale_started = self.now - timedelta(seconds=601)
+        stale = self._job('stale.txt', status=IngestionJob.STATUS_EXTRACTING, attempts=1,
+                          worker='dead', started_at=stale_started)
+        exhausted = self._job('exhausted.txt', status=IngestionJob.STATUS_EXTRACTING, attempts=3,
+                              worker='dead', started_at=stale_started)
+        running = self._job('running.txt', status=IngestionJob.STATUS_EXTRACTING, attempts=1,
+                            worker='alive', started_at=self.now)
+
+        self.assertEqual(requeue_stale_jobs(), 1)
+
+        stale.refresh_from_db()
+        self.assertEqual((stale.status, stale.worker, stale.progress), (IngestionJob.STATUS_PENDING, '', 0))
+        exhausted.refresh_from_db()
+        self.assertEqual(exhausted.status, IngestionJob.STATUS_ERROR)
+        self.assertIsNotNone(exhausted.finished_at)
+        running.refresh_from_db()
+        self.assertEqual(running.status, IngestionJob.STATUS_EXTRACTING)
+
+        # Возвращенная задача снова забирается, счетчик попыток растет
+        job = claim_next_job('worker-1')
+        self.assertEqual((job.id, job.attempts), (stale.id, 2))
+
+    def _process(self, job, during=None):
+        """Обрабатывает задачу с подмененным разбором файла; during выполняется во время разбора."""
+        blob = FileBlob.objects.create(sha256='a' * 64, file='blobs/a', size=1)
+        extraction = FileExtraction.objects.create(
+            blob=blob, processor_version='1', file_type='text', content_preview='содержимое'
+        )
+
+        def extract(*args):
+            if during:
+                during()
+            return extraction
+
+        with mock.patch.object(ingestion, 'FileProcessor') as processor, \
+                mock.patch.object(ingestion, 'index_extraction'), \
+                mock.patch('django.db.models.fields.files.FieldFile.open', return_value=io.BytesIO(b'x')):
+            processor.return_value.extract_cached.side_effect = extract
+            process_job(job)
+        return extraction
+
+    def test_process_job_marks_ready(self):
+        self._job('file.txt')
+        job = claim_next_job('worker-1')
+        extraction = self._process(job)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.progress), (IngestionJob.STATUS_READY, 100))
+        self.assertEqual(UploadedFile.objects.get(id=job.uploaded_file_id).extraction_id, extraction.id)
+
+    def test_slow_worker_does_not_overwrite_reclaimed_job(self):
+        self._job('file.txt')
+        slow = claim_next_job('worker-1')
+
+        def reclaim():
+            # Первый воркер превысил INGESTION_JOB_TIMEOUT: задача возвращена в очередь и взята снова
+            IngestionJob.objects.filter(id=slow.id).update(started_at=self.now - timedelta(seconds=601))
+            requeue_stale_jobs()
+            self.assertEqual(claim_next_job('worker-2').id, slow.id)
+
+        self._process(slow, during=reclaim)
+
+        job = IngestionJob.objects.get(id=slow.id)
+        self.assertEqual((job.status, job.worker, job.attempts), (IngestionJob.STATUS_EXTRACTING, 'worker-2', 2))
+        self.assertIsNone(UploadedFile.objects.get(id=job.uploaded_file_id).extraction_id)
@@ -0,0 +1,106 @@
+import json
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+
+from chat import llm_service, resilience
+from chat.llm_service import GigaChatAdapter, LLMService, YandexAdapter
+from chat.models import ChatSession
+from chat.resilience import ProviderUnavailableError
+
+MODEL = 'GigaChat:latest'
+
+
+class _BrokenStreamAdapter:
+    """Адаптер, поток которого обрывается после первого фрагмента."""
+    name = 'test-stream'
+
+    def stream(self, model, messages, temperature, top_p, max_tokens, functions=None, result=None):
+        yield 'Начало'
+        raise requests.ConnectionError('соединение разорвано')
+
+
+@override_settings(LLM_CIRCUIT_FAILURE_THRESHOLD=0)
+class GenerateResponseStreamTests(SimpleTestCase):
+    """События потоковой генерации ответа."""
+
+    def setUp(self):
+        resilience._breakers.clear()
+        self.addCleanup(resilience._breakers.clear)
+
+    def test_broken_stream_yields_classified_error(self):
+        service = LLMService()
+        with mock.patch.object(service, 'get_adapter', return_value=_BrokenStreamAdapter()):
+            events = list(service.generate_response_stream(MODEL, [{'role': 'user', 'content': 'вопрос'}]))
+
+        self.assertEqual([event['type'] for event in events], ['delta', 'error'])
+        error = events[-1]['error']
+        self.assertIsInstance(error, ProviderUnavailableError)
+        self.assertEqual(error.provider, 'test-stream')
+
+
+class SendMessageStreamTests(TestCase):
+    """Событие error потокового ответа имеет одинаковый вид до и после начала ответа."""
+
+    def setUp(self):
+        self.session = ChatSession.objects.create(session_id='stream', model=MODEL)
+
+    def _error_event(self, events):
+        with mock.patch('chat.views.LLMService') as service:
+            service.return_value.generate_response_stream.return_value = events
+            response = self.client.post(
+                reverse('chat:send_message_stream'),
+                json.dumps({'session_id': 'stream', 'message': 'вопрос'}),
+                content_type='application/json', HTTP_HOST='localhost',
+            )
+            body = b''.join(response.streaming_content).decode('utf-8')
+        data = body.split('event: error\ndata: ', 1)[1].split('\n', 1)[0]
+        return json.loads(data)
+
+    def test_error_after_first_delta(self):
+        error = ProviderUnavailableError('соединение разорвано', 'gigachat')
+        payload = self._error_event(iter([{'type': 'delta', 'content': 'Начало'}, {'type': 'error', 'error': error}]))
+        self.assertEqual(payload, {
+            'error': 'соединение разорвано', 'error_type': 'ProviderUnavailableError', 'retry_after': None,
+        })
+        # Ответ не сохранен, сообщение пользователя тоже
+        self.assertFalse(self.session.messages.exists())
+
+    def test_error_before_first_delta(self):
+        def events():
+            raise ProviderUnavailableError('перегружен', 'gigachat', retry_after=5)
+            yield
+
+        payload = self._error_event(events())
+        self.assertEqual(payload, {'error': 'перегружен', 'error_type': 'ProviderUnavailableError', 'retry_after': 5})
+
+
+class StreamErrorResponseTests(SimpleTestCase):
+    """Потоковый ответ с ошибкой HTTP закрывается, чтобы соединение вернулось в пул."""
+
+    def _error_response(self, status_code=503):
+        response = requests.Response()
+        response.status_code = status_code
+        response.close = mock.Mock()
+        return response
+
+    def test_gigachat_closes_error_response(self):
+        adapter = GigaChatAdapter()
+        adapter.api_key = 'key'
+        response = self._error_response()
+        with mock.patch.object(llm_service.gigachat_token_cache, 'get_token', return_value='token'), \
+                mock.patch.object(llm_service.http_client, 'post', return_value=response):
+            with self.assertRaises(requests.HTTPError):
+                next(adapter.stream(MODEL, [{'role': 'user', 'content': 'вопрос'}], 0.7, 1.0, 100))
+        response.close.assert_called()
+
+    def test_yandex_closes_error_response(self):
+        adapter = YandexAdapter()
+        adapter.api_key, adapter.folder_id = 'key', 'folder'
+        response = self._error_response()
+        with mock.patch.object(llm_service.http_client, 'post', return_value=response):
+            with self.assertRaises(requests.HTTPError):
+                next(adapter.stream('yandexgpt-lite', [{'role': 'user', 'content': 'вопрос'}], 0.7, 1.0, 100))
+        response.close.assert_called()
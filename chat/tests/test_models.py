@@ -0,0 +1,124 @@
+from datetime import datetime, timezone as dt_timezone
+from decimal import Decimal
+
+from django.db.models import Sum
+from django.test import TestCase
+
+from chat.models import Agent, ChatSession, Message, UsageRollup
+
+
+def _message(session, **kwargs):
+    kwargs.setdefault('role', 'user')
+    kwargs.setdefault('content', 'текст')
+    kwargs.setdefault('content_tokens', 1)
+    return Message.objects.create(session=session, **kwargs)
+
+
+class SessionCountersTests(TestCase):
+    """Инкрементальные счетчики сессии в Message.save."""
+
+    def setUp(self):
+        self.session = ChatSession.objects.create(session_id='counters', model='gpt-4o-mini')
+
+    def test_save_increments_counters(self):
+        _message(self.session, input_tokens=10, total_tokens=10, estimated_cost=0.001)
+        _message(self.session, role='assistant', output_tokens=5, total_tokens=5, estimated_cost=0.002)
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.message_count, 2)
+        self.assertEqual(self.session.total_input_tokens, 10)
+        self.assertEqual(self.session.total_output_tokens, 5)
+        self.assertEqual(self.session.total_tokens, 15)
+        self.assertEqual(self.session.total_estimated_cost, Decimal('0.003'))
+
+    def test_resave_does_not_increment(self):
+        message = _message(self.session, total_tokens=10, estimated_cost=0.001)
+        message.content = 'исправлено'
+        message.save()
+
+        self.session.refresh_from_db()
+        self.assertEqual(self.session.message_count, 1)
+        self.assertEqual(self.session.total_tokens, 10)
+
+    def test_cost_counter_matches_message_sum(self):
+        # Стоимости точнее decimal_places полей округляются одинаково для сообщения и счетчика
+        for cost in (0.0000045, 0.0000015, 0.1234567):
+            _message(self.session, estimated_cost=cost)
+
+        self.session.refresh_from_db()
+        message_sum = self.session.messages.aggregate(cost=Sum('estimated_cost'))['cost']
+        self.assertEqual(self.session.total_estimated_cost, message_sum)
+
+    def test_update_token_stats_matches_increments(self):
+        for cost in (0.0000045, 0.25):
+            _message(self.session, input_tokens=3, total_tokens=3, estimated_cost=cost)
+        self.session.refresh_from_db()
+        incremental = self.session.get_token_stats()
+
+        self.session.update_token_stats()
+        self.assertEqual(self.session.get_token_stats(), incremental)
+
+
+class UsageRollupTests(TestCase):
+    """Почасовая сводка использования: инкременты при сохранении и пересчет."""
+
+    def setUp(self):
+        self.agent = Agent.objects.create(name='Агент', model='gpt-4o-mini')
+        self.session = ChatSession.objects.create(session_id='rollup', model='gpt-4o-mini', agent=self.agent)
+        self.other = ChatSession.objects.create(session_id='other', model='gpt-4o-mini')
+
+    def _rollups(self):
+        return list(UsageRollup.objects.order_by('bucket', 'session_id', 'model').values(
+            'bucket', 'session_id', 'agent_id', 'model', 'messages',
+            'input_tokens', 'output_tokens', 'total_tokens', 'estimated_cost',
+        ))
+
+    def test_messages_of_one_hour_share_a_row(self):
+        hour = datetime(2026, 1, 1, 10, tzinfo=dt_timezone.utc)
+        _message(self.session, timestamp=hour.replace(minute=5), input_tokens=4, total_tokens=4, estimated_cost=0.0000045)
+        _message(self.session, timestamp=hour.replace(minute=55), output_tokens=6, total_tokens=6, estimated_cost=0.0000045)
+        _message(self.session, timestamp=hour.replace(hour=11), total_tokens=1)
+
+        rows = self._rollups()
+        self.assertEqual(len(rows), 2)
+        first = rows[0]
+        self.assertEqual(first['bucket'], hour)
+        self.assertEqual(first['agent_id'], self.agent.pk)
+        self.assertEqual(first['messages'], 2)
+        self.assertEqual(first['total_tokens'], 10)
+        self.assertEqual(first['estimated_cost'], self.session.messages.filter(
+            timestamp__lt=hour.replace(hour=11)
+        ).aggregate(cost=Sum('estimated_cost'))['cost'])
+
+    def test_rebuild_matches_increments(self):
+        for cost in (0.0000045, 0.0123456, 0.5):
+            _message(self.session, input_tokens=2, output_tokens=3, total_tokens=5, estimated_cost=cost)
+        _message(self.other, total_tokens=7, estimated_cost=0.0000015)
+        incremental = self._rollups()
+
+        UsageRollup.rebuild()
+        self.assertEqual(self._rollups(), incremental)
+
+    def test_agent_stats_from_rollup(self):
+        _message(self.session, total_tokens=10, estimated_cost=0.001)
+        _message(self.session, total_tokens=20, estimated_cost=0.002)
+        _message(self.other, total_tokens=100, estimated_cost=1)
+        ChatSession.objects.create(session_id='empty', model='gpt-4o-mini', agent=self.agent)
+
+        self.assertEqual(self.agent.get_total_stats(), {
+            'total_sessions': 2,
+            'total_messages': 2,
+            'total_tokens': 30,
+            'total_cost': 0.003,
+        })
+
+    def test_rebuild_keeps_history_on_previous_model(self):
+        _message(self.session, total_tokens=10)
+        ChatSession.objects.filter(pk=self.session.pk).update(model='gpt-4o')
+        self.session.refresh_from_db()
+        _message(self.session, total_tokens=20)
+        incremental = self._rollups()
+        self.assertEqual({row['model']: row['total_tokens'] for row in incremental}, {'gpt-4o-mini': 10, 'gpt-4o': 20})
+
+        UsageRollup.rebuild()
+        self.assertEqual(self._rollups(), incremental)
@@ -0,0 +1,99 @@
+from django.core.cache import caches
+from django.test import SimpleTestCase
+
+from chat.rate_limiter import CacheWindowCounter, ProviderLimiter, ProviderOverloadedError
+
+
+class ProviderLimiterTests(SimpleTestCase):
+    """Резервирование, возврат и отклонение запросов в ProviderLimiter (лимиты в памяти процесса)."""
+
+    def test_unused_reservation_is_refunded(self):
+        limiter = ProviderLimiter('test', tokens_per_minute=100, queue_timeout=0)
+        with limiter.acquire(tokens=80) as usage:
+            usage['tokens'] = 30
+        # Возвращено 50 из 80: следующий резерв на 60 проходит без ожидания
+        with limiter.acquire(tokens=60):
+            pass
+        self.assertEqual(limiter.get_stats()['rejected'], 0)
+
+    def test_failed_request_without_usage_is_refunded(self):
+        limiter = ProviderLimiter('test', tokens_per_minute=100, queue_timeout=0)
+        with self.assertRaises(RuntimeError):
+            with limiter.acquire(tokens=100):
+                raise RuntimeError('сбой')
+        with limiter.acquire(tokens=100):
+            pass
+
+    def test_rejects_when_limit_exhausted(self):
+        limiter = ProviderLimiter('test', requests_per_minute=1, queue_timeout=0)
+        with limiter.acquire():
+            pass
+        with self.assertRaises(ProviderOverloadedError) as ctx:
+            with limiter.acquire():
+                pass
+        self.assertGreater(ctx.exception.retry_after, 0)
+        stats = limiter.get_stats()
+        self.assertEqual((stats['acquired'], stats['rejected'], stats['active']), (1, 1, 0))
+
+    def test_token_rejection_returns_request_reservation(self):
+        limiter = ProviderLimiter('test', requests_per_minute=2, tokens_per_minute=10, queue_timeout=0)
+        with limiter.acquire(tokens=10) as usage:
+            usage['tokens'] = 10
+        with self.assertRaises(ProviderOverloadedError):
+            with limiter.acquire(tokens=10):
+                pass
+        self.assertAlmostEqual(limiter._requests.tokens, 1, places=2)
+
+    def test_rejects_when_no_free_slot(self):
+        limiter = ProviderLimiter('test', max_concurrent=1, queue_timeout=0.01)
+        with limiter.acquire():
+            with self.assertRaises(ProviderOverloadedError):
+                with limiter.acquire():
+                    pass
+        with limiter.acquire():
+            pass
+        self.assertEqual(limiter.get_stats()['active'], 0)
+
+    async def test_async_refund_and_rejection(self):
+        limiter = ProviderLimiter('test', tokens_per_minute=100, queue_timeout=0)
+        async with limiter.aacquire(tokens=100) as usage:
+            usage['tokens'] = 40
+        async with limiter.aacquire(tokens=60):
+            pass
+        with self.assertRaises(ProviderOverloadedError):
+            async with limiter.aacquire(tokens=100):
+                pass
+
+
+class CacheWindowCounterTests(SimpleTestCase):
+    """Поминутный счетчик в кеше Django."""
+
+    def setUp(self):
+        caches['default'].clear()
+        self.counter = CacheWindowCounter('llm-rate:test:tokens', 100, 'default')
+
+    def test_over_capacity_is_not_counted(self):
+        wait, window = self.counter.reserve(70)
+        self.assertEqual(wait, 0)
+        wait, rejected = self.counter.reserve(70)
+        self.assertGreater(wait, 0)
+        self.assertIsNone(rejected)
+        # Отклоненный резерв не остался в счетчике окна
+        self.assertEqual(caches['default'].get(window), 70)
+
+    def test_refund_goes_to_reserved_window(self):
+        _, window = self.counter.reserve(100)
+        self.counter.refund(60, window)
+        self.assertEqual(caches['default'].get(window), 40)
+        # Окно уже истекло — возврат игнорируется
+        self.counter.refund(10, 'llm-rate:test:tokens:0')
+
+    def test_cache_backend_limiter(self):
+        limiter = ProviderLimiter('test-cache', tokens_per_minute=100, queue_timeout=0, backend='cache')
+        with limiter.acquire(tokens=100) as usage:
+            usage['tokens'] = 20
+        with limiter.acquire(tokens=80):
+            pass
+        with self.assertRaises(ProviderOverloadedError):
+            with limiter.acquire(tokens=1):
+                pass
@@ -0,0 +1,159 @@
+from unittest import mock
+
+import requests
+from django.test import SimpleTestCase, override_settings
+
+from chat import resilience
+from chat.resilience import (
+    CircuitBreaker, CircuitOpenError, ProviderConfigError, ProviderRequestError,
+    ProviderUnavailableError, acall_with_retries, call_with_retries,
+)
+
+
+def _http_error(status_code, headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    return requests.HTTPError(response=response)
+
+
+class CircuitBreakerTests(SimpleTestCase):
+    """Переходы выключателя closed -> open -> half_open -> closed/open."""
+
+    def setUp(self):
+        self.now = 1000.0
+        patcher = mock.patch.object(resilience.time, 'monotonic', lambda: self.now)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker = CircuitBreaker('test', failure_threshold=2, reset_timeout=30)
+
+    def _open(self):
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+
+    def test_opens_after_threshold(self):
+        self.breaker.record_failure()
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.get_stats()['state'], CircuitBreaker.OPEN)
+        with self.assertRaises(CircuitOpenError) as ctx:
+            self.breaker.before_call()
+        self.assertEqual(ctx.exception.retry_after, 30)
+        self.assertEqual(self.breaker.get_stats()['rejected'], 1)
+
+    def test_success_resets_failures(self):
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.get_stats()['state'], CircuitBreaker.CLOSED)
+
+    def test_single_trial_after_timeout(self):
+        self._open()
+        self.now += 30
+        self.breaker.before_call()
+        self.assertEqual(self.breaker.get_stats()['state'], CircuitBreaker.HALF_OPEN)
+        # Пока пробный запрос выполняется, остальные отклоняются
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_trial_success_closes(self):
+        self._open()
+        self.now += 30
+        self.breaker.before_call()
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.get_stats()['state'], CircuitBreaker.CLOSED)
+        self.breaker.before_call()
+
+    def test_trial_failure_reopens(self):
+        self._open()
+        self.now += 30
+        self.breaker.before_call()
+        self.breaker.record_failure()
+        stats = self.breaker.get_stats()
+        self.assertEqual(stats['state'], CircuitBreaker.OPEN)
+        self.assertEqual(stats['times_opened'], 2)
+        with self.assertRaises(CircuitOpenError):
+            self.breaker.before_call()
+
+    def test_error_not_sent_frees_trial(self):
+        self._open()
+        self.now += 30
+        self.breaker.before_call()
+        self.breaker.record(ProviderConfigError('нет ключа', 'test'))
+        self.breaker.before_call()
+
+    def test_provider_response_counts_as_available(self):
+        self.breaker.record_failure()
+        self.breaker.record(ProviderRequestError('400', 'test'))
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.get_stats()['state'], CircuitBreaker.CLOSED)
+
+
+@override_settings(
+    LLM_RETRY_MAX_RETRIES=2, LLM_RETRY_BASE_DELAY=0.01, LLM_RETRY_MAX_DELAY=0.01,
+    LLM_RETRY_DEADLINE=10, LLM_CIRCUIT_FAILURE_THRESHOLD=3, LLM_CIRCUIT_RESET_TIMEOUT=30,
+)
+class CallWithRetriesTests(SimpleTestCase):
+    """Повторы временных сбоев в call_with_retries."""
+
+    def setUp(self):
+        resilience._breakers.clear()
+        self.addCleanup(resilience._breakers.clear)
+        patcher = mock.patch.object(resilience.time, 'sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_retries_transient_errors(self):
+        func = mock.Mock(side_effect=[requests.ConnectionError('сброс'), _http_error(503), 'ответ'])
+        self.assertEqual(call_with_retries('test', func), 'ответ')
+        self.assertEqual(func.call_count, 3)
+        self.assertEqual(self.sleep.call_count, 2)
+
+    def test_gives_up_after_max_retries(self):
+        func = mock.Mock(side_effect=_http_error(502))
+        with self.assertRaises(ProviderUnavailableError) as ctx:
+            call_with_retries('test', func)
+        self.assertEqual(func.call_count, 3)
+        self.assertEqual(ctx.exception.status_code, 502)
+
+    def test_does_not_retry_client_errors(self):
+        func = mock.Mock(side_effect=_http_error(400))
+        with self.assertRaises(ProviderRequestError):
+            call_with_retries('test', func)
+        self.assertEqual(func.call_count, 1)
+
+    def test_respects_retry_after(self):
+        func = mock.Mock(side_effect=[_http_error(429, {'Retry-After': '2'}), 'ответ'])
+        call_with_retries('test', func)
+        self.sleep.assert_called_once_with(2.0)
+
+    def test_retry_after_beyond_deadline_is_not_awaited(self):
+        func = mock.Mock(side_effect=_http_error(429, {'Retry-After': '60'}))
+        with self.assertRaises(ProviderUnavailableError) as ctx:
+            call_with_retries('test', func)
+        self.assertEqual(func.call_count, 1)
+        self.assertEqual(ctx.exception.retry_after, 60)
+        self.sleep.assert_not_called()
+
+    def test_open_circuit_rejects_without_calling(self):
+        func = mock.Mock(side_effect=_http_error(503))
+        with self.assertRaises(ProviderUnavailableError):
+            call_with_retries('test', func)
+        self.assertEqual(func.call_count, 3)
+        with self.assertRaises(CircuitOpenError):
+            call_with_retries('test', func)
+        self.assertEqual(func.call_count, 3)
+
+    async def test_async_retries(self):
+        attempts = []
+
+        async def func():
+            attempts.append(1)
+            if len(attempts) < 2:
+                raise _http_error(500)
+            return 'ответ'
+
+        with mock.patch.object(resilience.asyncio, 'sleep', mock.AsyncMock()) as sleep:
+            self.assertEqual(await acall_with_retries('test', func), 'ответ')
+        self.assertEqual(len(attempts), 2)
+        sleep.assert_awaited_once()
@@ -0,0 +1,77 @@
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from chat.models import ChatSession, FileBlob, FileChunk, FileExtraction, UploadedFile
+from chat.retrieval import index_extraction, retrieve_context, search_chunks, split_into_chunks
+
+
+class SplitIntoChunksTests(SimpleTestCase):
+    """Деление текста на фрагменты с перекрытием."""
+
+    def test_cuts_at_paragraph_boundary(self):
+        text = 'первый абзац текста\n\nвторой абзац текста'
+        self.assertEqual(split_into_chunks(text, 25, 0), ['первый абзац текста', 'второй абзац текста'])
+
+    def test_overlap_and_coverage(self):
+        text = 'x' * 100
+        chunks = split_into_chunks(text, 40, 10)
+        self.assertEqual([len(chunk) for chunk in chunks], [40, 40, 40])
+        self.assertEqual(split_into_chunks('   ', 40, 10), [])
+
+
+@override_settings(RETRIEVAL_CHUNK_CHARS=80, RETRIEVAL_CHUNK_OVERLAP=0, RETRIEVAL_TOP_K=2, RETRIEVAL_TOKEN_BUDGET=1000)
+class SearchChunksTests(TestCase):
+    """Ранжирование фрагментов по BM25."""
+
+    PARAGRAPHS = [
+        'Отчет о продажах за квартал. Продажи выросли, продажи в регионах стабильны.',
+        'Склад и логистика: поставки задерживаются, склад заполнен на треть.',
+        'Продажи упомянуты один раз среди длинного перечня прочих тем отчета и планов.',
+        'Кадровые изменения: новый руководитель отдела закупок приступил к работе.',
+    ]
+
+    def _extraction(self, name, paragraphs):
+        blob = FileBlob.objects.create(sha256=name * 64, file=f'blobs/{name}', size=1)
+        extraction = FileExtraction.objects.create(
+            blob=blob, processor_version='1', file_type='text',
+            training_data={'type': 'text', 'content': '\n\n'.join(paragraphs)},
+        )
+        index_extraction(extraction)
+        return extraction
+
+    def setUp(self):
+        self.extraction = self._extraction('a', self.PARAGRAPHS)
+
+    def test_index_has_one_chunk_per_paragraph(self):
+        self.assertEqual(self.extraction.chunk_count, len(self.PARAGRAPHS))
+        # Повторная индексация не создает фрагменты заново
+        self.assertEqual(index_extraction(self.extraction), len(self.PARAGRAPHS))
+        self.assertEqual(FileChunk.objects.filter(extraction=self.extraction).count(), len(self.PARAGRAPHS))
+
+    def test_ranks_by_term_frequency(self):
+        chunks = search_chunks([self.extraction.id], 'продажи', top_k=5)
+        self.assertEqual([chunk.position for chunk in chunks], [0, 2])
+
+    def test_rare_term_outweighs_common(self):
+        chunks = search_chunks([self.extraction.id], 'продажи склад', top_k=1)
+        self.assertEqual(chunks[0].position, 1)
+
+    def test_limits_to_given_extractions(self):
+        other = self._extraction('b', ['Продажи продажи продажи.'])
+        chunks = search_chunks([self.extraction.id], 'продажи', top_k=5)
+        self.assertNotIn(other.id, {chunk.extraction_id for chunk in chunks})
+        self.assertEqual(search_chunks([self.extraction.id], 'отсутствующий', top_k=5), [])
+        self.assertEqual(search_chunks([], 'продажи', top_k=5), [])
+
+    def test_retrieve_context(self):
+        session = ChatSession.objects.create(session_id='retrieval', model='GigaChat:latest')
+        UploadedFile.objects.create(
+            session=session, file='uploads/report.txt', filename='report.txt', file_type='text',
+            file_size=1, extraction=self.extraction,
+        )
+        context = retrieve_context(session.files.select_related('extraction'), 'склад', 'GigaChat:latest')
+        self.assertIn('[report.txt, фрагмент 2]', context)
+        self.assertNotIn('Кадровые', context)
+
+        # Ни один терм не найден — берутся начальные фрагменты
+        context = retrieve_context(session.files.select_related('extraction'), 'отсутствующий', 'GigaChat:latest')
+        self.assertIn('[report.txt, фрагмент 1]', context)
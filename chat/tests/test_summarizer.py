@@ -0,0 +1,171 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from django.utils import timezone
+
+from chat import summarizer
+from chat.context_builder import MESSAGE_OVERHEAD_TOKENS, load_history
+from chat.models import ChatSession, Message
+from chat.resilience import ProviderUnavailableError
+from chat.token_counter import TokenCounter
+
+MODEL = 'GigaChat:latest'
+
+
+def _result(content='Краткое содержание', total_tokens=30):
+    return {
+        'content': content,
+        'input_tokens': total_tokens - 10,
+        'output_tokens': 10,
+        'total_tokens': total_tokens,
+        'cost': {'total_cost': 0.001},
+    }
+
+
+class HistoryTestCase(TestCase):
+
+    def setUp(self):
+        self.session = ChatSession.objects.create(session_id='history', model=MODEL)
+        self.started = timezone.now() - timedelta(hours=1)
+        self.count = 0
+
+    def _message(self, content, tokens=10, role=None):
+        role = role or ('user' if self.count % 2 == 0 else 'assistant')
+        self.count += 1
+        return Message.objects.create(
+            session=self.session, role=role, content=content, content_tokens=tokens,
+            timestamp=self.started + timedelta(minutes=self.count),
+        )
+
+
+class SelectFoldTests(HistoryTestCase):
+    """Выбор сообщений для очередного сжатия."""
+
+    def setUp(self):
+        super().setUp()
+        self.counter = TokenCounter()
+
+    def test_takes_oldest_within_budget(self):
+        messages = [self._message(f'сообщение {i}') for i in range(4)]
+        selected, offset = summarizer._select_fold(messages, 2 * (10 + MESSAGE_OVERHEAD_TOKENS) + 1, self.counter, MODEL)
+        self.assertEqual(selected, messages[:2])
+        self.assertEqual(offset, 0)
+
+    def test_oversized_first_message_is_split(self):
+        content = 'слово ' * 100
+        message = self._message(content, tokens=200)
+        selected, offset = summarizer._select_fold([message, self._message('ответ')], 50, self.counter, MODEL)
+        self.assertEqual(len(selected), 1)
+        self.assertGreater(offset, 0)
+        self.assertLess(offset, len(content))
+        self.assertEqual(selected[0].content, content[:offset])
+
+    def test_continues_from_offset(self):
+        message = self._message('начало|продолжение', tokens=5)
+        selected, offset = summarizer._select_fold([message], 1000, self.counter, MODEL, offset=len('начало|'))
+        self.assertEqual(selected[0].content, 'продолжение')
+        self.assertEqual(offset, 0)
+
+
+@override_settings(CONTEXT_SUMMARY_KEEP_MESSAGES=2, CONTEXT_SUMMARY_MAX_TOKENS=100)
+class SummarizeSessionTests(HistoryTestCase):
+    """Сжатие ранней части диалога в краткое содержание."""
+
+    def _summarize(self, *results):
+        with mock.patch.object(summarizer, 'LLMService') as service:
+            service.return_value.generate_response.side_effect = list(results)
+            updated = summarizer.summarize_session(self.session)
+        self.session.refresh_from_db()
+        return updated, service.return_value.generate_response
+
+    def test_folds_all_but_recent_messages(self):
+        messages = [self._message(f'сообщение {i}') for i in range(5)]
+
+        updated, generate = self._summarize(_result())
+        self.assertTrue(updated)
+        self.assertEqual(self.session.summary, 'Краткое содержание')
+        self.assertEqual(self.session.summary_until, messages[2].timestamp)
+        self.assertEqual(self.session.summary_offset, 0)
+        prompt = generate.call_args.kwargs['messages'][1]['content']
+        self.assertIn('сообщение 2', prompt)
+        self.assertNotIn('сообщение 3', prompt)
+        # Запрос сжатия учтен в счетчиках, но не как сообщение
+        self.assertEqual(self.session.total_tokens, 30)
+        self.assertEqual(self.session.message_count, 5)
+
+    def test_oversized_message_is_folded_in_pieces(self):
+        content = ''.join(f'часть{i:03d} ' for i in range(200))
+        long_message = self._message(content, tokens=2000)
+        for i in range(2):
+            self._message(f'последнее {i}')
+
+        pieces = []
+        with mock.patch.object(summarizer, '_fold_budget', return_value=300):
+            for _ in range(20):
+                updated, generate = self._summarize(_result(f'Итог {len(pieces)}'))
+                self.assertTrue(updated)
+                prompt = generate.call_args.kwargs['messages'][1]['content']
+                pieces.append(prompt.split('Новые сообщения:\nПользователь: ', 1)[1])
+                if not self.session.summary_offset:
+                    break
+                # Пока сообщение сжато не целиком, оно остается в истории
+                self.assertIsNone(self.session.summary_until)
+                history = load_history(self.session, 10000)
+                self.assertEqual(history[0]['content'], content)
+
+        self.assertGreater(len(pieces), 1)
+        self.assertEqual(''.join(pieces), content)
+        self.assertEqual(self.session.summary_until, long_message.timestamp)
+
+    def test_provider_error_keeps_history(self):
+        for i in range(4):
+            self._message(f'сообщение {i}')
+
+        updated, _ = self._summarize(ProviderUnavailableError('недоступен', 'gigachat'))
+        self.assertFalse(updated)
+        self.assertIsNone(self.session.summary_until)
+        self.assertEqual(self.session.total_tokens, 0)
+
+    def test_concurrent_fold_is_discarded(self):
+        for i in range(4):
+            self._message(f'сообщение {i}')
+        ChatSession.objects.filter(pk=self.session.pk).update(summary='Другое', summary_offset=3)
+
+        updated, _ = self._summarize(_result())
+        self.assertFalse(updated)
+        self.assertEqual(self.session.summary, 'Другое')
+        # Запрос к модели оплачен и учтен, даже если результат отброшен
+        self.assertEqual(self.session.total_tokens, 30)
+
+
+class LoadHistoryTests(HistoryTestCase):
+    """Последние сообщения сессии в пределах бюджета токенов."""
+
+    def test_newest_messages_within_budget(self):
+        messages = [self._message(f'сообщение {i}') for i in range(5)]
+        history = load_history(self.session, 3 * (10 + MESSAGE_OVERHEAD_TOKENS))
+        self.assertEqual([item['content'] for item in history], [m.content for m in messages[2:]])
+
+    def test_stops_at_first_message_that_does_not_fit(self):
+        self._message('старое')
+        self._message('длинное', tokens=1000)
+        self._message('новое')
+        history = load_history(self.session, 100)
+        self.assertEqual([item['content'] for item in history], ['новое'])
+
+    def test_skips_summarized_and_excluded_messages(self):
+        first = self._message('в кратком содержании')
+        second = self._message('после краткого содержания')
+        current = self._message('текущее')
+        self.session.summary_until = first.timestamp
+        history = load_history(self.session, 1000, exclude_ids=[current.id])
+        self.assertEqual([item['content'] for item in history], [second.content])
+        self.assertEqual(load_history(self.session, 0), [])
+
+    def test_counts_missing_tokens_once(self):
+        message = self._message('без подсчета')
+        Message.objects.filter(pk=message.pk).update(content_tokens=None)
+        load_history(self.session, 1000)
+        message.refresh_from_db()
+        self.assertEqual(message.content_tokens, TokenCounter().count_tokens('без подсчета', MODEL))
@@ -1,51 +1,92 @@
 import tiktoken
 import re
+import hashlib
 import logging
+import threading
+from collections import OrderedDict
 from typing import Dict, List, Tuple
 
+from django.conf import settings
+
+from .model_config import DEFAULT_PRICE_PER_1K, DEFAULT_TOKENIZER, MODEL_REGISTRY, get_model_spec
+from .token_estimator import get_estimator
+
 logger = logging.getLogger(__name__)
 
 
 class TokenCounter:
-    """Сервис для подсчета токенов в тексте."""
+    """
+    Сервис для подсчета токенов в тексте.
+
+    Один экземпляр на процесс: кодировки tiktoken загружаются лениво при
+    первом обращении и затем используются всеми экземплярами LLMService.
+    Результаты кодирования хранятся в LRU-кеше по (кодировка, sha256 текста),
+    поэтому повторяющиеся тексты (например, системные промпты) не кодируются
+    повторно.
+    """
     
-    def __init__(self):
-        # Кодировки для разных моделей
-        self.encodings = {
-            'gpt-4': tiktoken.encoding_for_model('gpt-4'),
-            'gpt-3.5-turbo': tiktoken.encoding_for_model('gpt-3.5-turbo'),
-            'llama-3.1-sonar-small-128k-online': tiktoken.encoding_for_model('gpt-4'),  # Используем GPT-4 как приближение
-            'llama-3.1-sonar-large-128k-online': tiktoken.encoding_for_model('gpt-4'),
-            'llama-3.1-sonar-huge-128k-online': tiktoken.encoding_for_model('gpt-4'),
-            'GigaChat:latest': tiktoken.encoding_for_model('gpt-4'),
-            'GigaChat-Pro:latest': tiktoken.encoding_for_model('gpt-4'),
-            'yandexgpt': tiktoken.encoding_for_model('gpt-4'),
-            'yandexgpt-lite': tiktoken.encoding_for_model('gpt-4'),
-        }
+    _instance = None
+    _instance_lock = threading.Lock()
+    
+    def __new__(cls):
+        if cls._instance is None:
+            with cls._instance_lock:
+                if cls._instance is None:
+                    instance = super().__new__(cls)
+                    instance._encodings = {}
+                    instance._encodings_lock = threading.Lock()
+                    instance._counts = OrderedDict()
+                    instance._counts_lock = threading.Lock()
+                    cls._instance = instance
+        return cls._instance
+    
+    @staticmethod
+    def get_tokenizer(model: str) -> Tuple[str, str]:
+        """
+        Возвращает токенизатор модели из реестра моделей: ('estimator', семейство)
+        или ('tiktoken', модель tiktoken). Для моделей вне реестра — кодировка gpt-4.
+        """
+        spec = get_model_spec(model)
+        if spec is None:
+            kind, _, name = DEFAULT_TOKENIZER.partition(':')
+            return kind, name
+        return spec.tokenizer_kind, spec.tokenizer_name
+    
+    def get_encoding(self, tiktoken_model: str):
+        """Возвращает кодировку tiktoken, загружая ее при первом обращении."""
+        encoding = self._encodings.get(tiktoken_model)
+        if encoding is None:
+            with self._encodings_lock:
+                encoding = self._encodings.get(tiktoken_model)
+                if encoding is None:
+                    encoding = tiktoken.encoding_for_model(tiktoken_model)
+                    self._encodings[tiktoken_model] = encoding
+                    logger.info(f"Загружена кодировка tiktoken для '{tiktoken_model}'")
+        return encoding
+    
+    def warm_up(self):
+        """Заранее загружает все кодировки, чтобы первый запрос не ждал их построения."""
+        tiktoken_models = {spec.tokenizer_name for spec in MODEL_REGISTRY.values() if spec.tokenizer_kind == 'tiktoken'}
+        tiktoken_models.add(DEFAULT_TOKENIZER.partition(':')[2])
+        for tiktoken_model in tiktoken_models:
+            try:
+                self.get_encoding(tiktoken_model)
+            except Exception as e:
+                logger.warning(f"Не удалось загрузить кодировку '{tiktoken_model}': {e}")
     
     def count_tokens(self, text: str, model: str = 'gpt-4') -> int:
         """Подсчитывает количество токенов в тексте для указанной модели."""
         try:
-            # Специальная обработка для Yandex GPT - более точный подсчет
-            if 'yandex' in model.lower():
-                # Для Yandex GPT используем более точный подсчет
-                # Примерно 1 токен = 4-5 символов для русского текста
-                # Учитываем, что русские слова короче английских
-                token_count = len(text) // 4.5
-                logger.info(f"Подсчет токенов для Yandex модели '{model}': {int(token_count)} токенов для текста длиной {len(text)} символов")
-                return int(token_count)
-            
-            # Специальная обработка для GigaChat - более точный подсчет
-            if 'gigachat' in model.lower():
-                # Для GigaChat используем более точный подсчет
-                # Примерно 1 токен = 4-5 символов для русского текста
-                token_count = len(text) // 4.5
-                logger.info(f"Подсчет токенов для GigaChat модели '{model}': {int(token_count)} токенов для текста длиной {len(text)} символов")
-                return int(token_count)
+            tokenizer_kind, tokenizer_name = self.get_tokenizer(model)
+            # Для моделей, чей токенизатор недоступен локально (GigaChat, Yandex GPT), используем откалиброванную оценку
+            if tokenizer_kind == 'estimator':
+                token_count = get_estimator(tokenizer_name).estimate(text)
+                logger.debug(f"Оценка токенов для модели '{model}': {token_count} токенов для текста длиной {len(text)} символов")
+                return token_count
             
-            encoding = self.encodings.get(model, self.encodings['gpt-4'])
-            token_count = len(encoding.encode(text))
-            logger.info(f"Подсчет токенов для модели '{model}': {token_count} токенов для текста длиной {len(text)} символов")
+            encoding = self.get_encoding(tokenizer_name)
+            token_count = self._count_encoded(encoding, text)
+            logger.debug(f"Подсчет токенов для модели '{model}': {token_count} токенов для текста длиной {len(text)} символов")
             return token_count
         except Exception as e:
             # Fallback: приблизительный подсчет (1 токен ≈ 4 символа)
@@ -53,8 +94,30 @@ class TokenCounter:
             logger.warning(f"Ошибка подсчета токенов для модели '{model}': {e}. Используем приблизительный подсчет: {fallback_count}")
             return fallback_count
     
+    def _count_encoded(self, encoding, text: str) -> int:
+        """Кодирует текст, используя LRU-кеш результатов по (кодировка, sha256 текста)."""
+        key = (encoding.name, hashlib.sha256(text.encode('utf-8')).digest())
+        with self._counts_lock:
+            token_count = self._counts.get(key)
+            if token_count is not None:
+                self._counts.move_to_end(key)
+                return token_count
+        
+        token_count = len(encoding.encode(text))
+        with self._counts_lock:
+            self._counts[key] = token_count
+            self._counts.move_to_end(key)
+            while len(self._counts) > settings.TOKEN_COUNT_CACHE_SIZE:
+                self._counts.popitem(last=False)
+        return token_count
+    
     def count_messages_tokens(self, messages: List[Dict[str, str]], model: str = 'gpt-4') -> int:
-        """Подсчитывает общее количество токенов в списке сообщений."""
+        """
+        Подсчитывает общее количество токенов в списке сообщений.
+
+        Если в сообщении уже есть посчитанное количество токенов содержимого
+        (ключ tokens, например у сообщений истории), оно используется повторно.
+        """
         total_tokens = 0
         
         for i, message in enumerate(messages):
@@ -63,36 +126,30 @@ class TokenCounter:
             
             # Считаем токены для роли и контента
             role_tokens = self.count_tokens(role, model)
-            content_tokens = self.count_tokens(content, model)
+            content_tokens = message.get('tokens')
+            if content_tokens is None:
+                content_tokens = self.count_tokens(content, model)
             
             # Для каждого сообщения добавляем токены форматирования (примерно 3-4 токена)
             message_tokens = role_tokens + content_tokens + 3
             total_tokens += message_tokens
             
-            logger.info(f"Сообщение {i+1}: роль='{role}' ({role_tokens} токенов), контент={len(content)} символов ({content_tokens} токенов), всего для сообщения: {message_tokens}")
+            logger.debug(f"Сообщение {i+1}: роль='{role}' ({role_tokens} токенов), контент={len(content)} символов ({content_tokens} токенов), всего для сообщения: {message_tokens}")
         
         # Добавляем токены для начала и конца разговора (примерно 2-3 токена)
         total_tokens += 2
         
-        logger.info(f"Общее количество токенов для {len(messages)} сообщений: {total_tokens}")
+        logger.debug(f"Общее количество токенов для {len(messages)} сообщений: {total_tokens}")
         return total_tokens
     
     def estimate_cost(self, input_tokens: int, output_tokens: int, model: str) -> Dict[str, float]:
         """Оценивает стоимость запроса на основе количества токенов."""
-        # Примерные цены за 1000 токенов (в долларах)
-        pricing = {
-            'gpt-4': {'input': 0.03, 'output': 0.06},
-            'gpt-3.5-turbo': {'input': 0.001, 'output': 0.002},
-            'llama-3.1-sonar-small-128k-online': {'input': 0.0002, 'output': 0.0002},
-            'llama-3.1-sonar-large-128k-online': {'input': 0.0005, 'output': 0.0005},
-            'llama-3.1-sonar-huge-128k-online': {'input': 0.001, 'output': 0.001},
-            'GigaChat:latest': {'input': 0.0001, 'output': 0.0001},
-            'GigaChat-Pro:latest': {'input': 0.0002, 'output': 0.0002},
-            'yandexgpt': {'input': 0.0001, 'output': 0.0001},
-            'yandexgpt-lite': {'input': 0.00005, 'output': 0.00005},
-        }
-        
-        model_pricing = pricing.get(model, pricing['gpt-4'])
+        # Цены за 1000 токенов (в долларах) берутся из реестра моделей
+        spec = get_model_spec(model)
+        if spec is not None:
+            model_pricing = {'input': spec.input_price, 'output': spec.output_price}
+        else:
+            model_pricing = DEFAULT_PRICE_PER_1K
         
         input_cost = (input_tokens / 1000) * model_pricing['input']
         output_cost = (output_tokens / 1000) * model_pricing['output']
@@ -0,0 +1,290 @@
+"""
+Локальная оценка количества токенов для GigaChat и YandexGPT.
+
+Токенизаторы этих моделей недоступны локально, поэтому количество токенов
+оценивается линейной моделью по числу символов разных классов (кириллица,
+латиница, цифры, пробельные символы, пунктуация, прочие) и числу слов.
+Коэффициенты подбираются офлайн по точным подсчетам токенизатора провайдера:
+python manage.py calibrate_token_estimator. Пока подобранных коэффициентов для
+семейства нет, используется прежняя оценка len // 4.5.
+"""
+import json
+import math
+import codecs
+import logging
+import string
+import threading
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from django.conf import settings
+
+from .model_config import MODEL_REGISTRY, get_model_spec
+
+logger = logging.getLogger(__name__)
+
+# Признаки в порядке коэффициентов
+FEATURES = ('cyrillic', 'latin', 'digits', 'whitespace', 'punctuation', 'other', 'words')
+
+# Семейства моделей, токены которых оцениваются локально (по реестру моделей)
+MODEL_FAMILIES = tuple(sorted({
+    spec.tokenizer_name for spec in MODEL_REGISTRY.values() if spec.tokenizer_kind == 'estimator'
+}))
+
+# Текст кодируется в однобайтовую кодировку, покрывающую кириллицу и типографские знаки,
+# чтобы классы символов размечались bytes.translate по таблице из 256 байт
+_ENCODING = 'cp1251'
+_ENCODE_ERRORS = 'token_estimator'
+
+# Байт, которым размечается класс символа; прочие символы размечаются _OTHER
+_CLASS_MARKS = {name: bytes([code]) for code, name in enumerate(FEATURES[:5], start=1)}
+_OTHER = b'\x06'
+
+# Символ того же класса, которым заменяется символ вне кодировки
+_REPRESENTATIVES = {'cyrillic': 'а', 'latin': 'a', 'digits': '0', 'whitespace': ' ', 'punctuation': '.'}
+
+_CYRILLIC_RANGES = ((0x0400, 0x0530), (0x1C80, 0x1C90), (0x2DE0, 0x2E00), (0xA640, 0xA6A0))
+_PUNCTUATION = frozenset(string.punctuation + '«»—–…“”„’‘№')
+
+
+def _char_class(char: str) -> Optional[str]:
+    """Класс символа из FEATURES или None для прочих символов."""
+    if char in string.ascii_letters:
+        return 'latin'
+    if char in string.digits:
+        return 'digits'
+    if char.isspace():
+        return 'whitespace'
+    if char in _PUNCTUATION:
+        return 'punctuation'
+    code = ord(char)
+    if any(low <= code < high for low, high in _CYRILLIC_RANGES):
+        return 'cyrillic'
+    return None
+
+
+def _substitute(error: UnicodeEncodeError) -> Tuple[str, int]:
+    """Заменяет каждый символ вне кодировки одним символом того же класса (длина текста сохраняется)."""
+    chars = error.object[error.start:error.end]
+    return ''.join(_REPRESENTATIVES.get(_char_class(char), '\x00') for char in chars), error.end
+
+
+codecs.register_error(_ENCODE_ERRORS, _substitute)
+
+
+def _build_class_table() -> bytes:
+    table = bytearray(_OTHER * 256)
+    for code in range(256):
+        try:
+            char = bytes([code]).decode(_ENCODING)
+        except UnicodeDecodeError:
+            continue
+        name = _char_class(char)
+        if name is not None:
+            table[code] = _CLASS_MARKS[name][0]
+    return bytes(table)
+
+
+_CLASS_TABLE = _build_class_table()
+# Пробельные символы размеченного текста переводятся в пробел, остальные — в 'w': слово начинается на b' w'
+_WORD_TABLE = bytes(ord(' ') if bytes([code]) == _CLASS_MARKS['whitespace'] else ord('w') for code in range(256))
+
+
+def model_family(model: str) -> Optional[str]:
+    """
+    Возвращает семейство коэффициентов для модели по реестру моделей или None,
+    если модель неизвестна или ее токены считаются через tiktoken.
+    """
+    spec = get_model_spec(model)
+    if spec is None or spec.tokenizer_kind != 'estimator':
+        return None
+    return spec.tokenizer_name
+
+
+def extract_features_batch(texts: Sequence[str]) -> List[Tuple[int, ...]]:
+    """
+    Считает признаки текстов в порядке FEATURES за один проход: тексты
+    склеиваются и размечаются по классам символов одним encode/translate,
+    а признаки каждого текста считаются bytes.count по его диапазону.
+    """
+    marked = ''.join(texts).encode(_ENCODING, _ENCODE_ERRORS).translate(_CLASS_TABLE)
+    spaces = marked.translate(_WORD_TABLE)
+    features = []
+    start = 0
+    for text in texts:
+        end = start + len(text)
+        counts = [marked.count(_CLASS_MARKS[name], start, end) for name in FEATURES[:5]]
+        words = spaces.count(b' w', start, end) + (end > start and spaces[start] != ord(' '))
+        features.append((*counts, len(text) - sum(counts), words))
+        start = end
+    return features
+
+
+def extract_features(text: str) -> Tuple[int, ...]:
+    """Считает признаки текста в порядке FEATURES."""
+    return extract_features_batch([text])[0]
+
+
+class TokenEstimator:
+    """
+    Линейная оценка количества токенов по признакам текста. Без коэффициентов
+    (для семейства еще не выполнена калибровка) используется оценка len // 4.5.
+    """
+
+    def __init__(self, coefficients: Optional[Dict[str, float]] = None):
+        self.coefficients = dict(coefficients) if coefficients is not None else None
+        self._weights = tuple((coefficients or {}).get(name, 0.0) for name in FEATURES)
+        self._intercept = (coefficients or {}).get('intercept', 0.0)
+
+    @property
+    def fitted(self) -> bool:
+        return self.coefficients is not None
+
+    def _predict(self, features: Tuple[int, ...]) -> int:
+        return max(1, round(self._intercept + sum(w * x for w, x in zip(self._weights, features))))
+
+    def estimate(self, text: str) -> int:
+        """Оценивает количество токенов в тексте."""
+        if not self.fitted:
+            return legacy_estimate(text)
+        if not text:
+            return 0
+        return self._predict(extract_features(text))
+
+    def estimate_batch(self, texts: Iterable[str]) -> List[int]:
+        """Оценивает количество токенов для набора текстов за один проход разметки (см. extract_features_batch)."""
+        texts = list(texts)
+        if not self.fitted:
+            return [legacy_estimate(text) for text in texts]
+        return [
+            self._predict(features) if text else 0
+            for text, features in zip(texts, extract_features_batch(texts))
+        ]
+
+    @classmethod
+    def fit(cls, texts: Sequence[str], tokens: Sequence[int], ridge: float = 1e-3) -> 'TokenEstimator':
+        """
+        Подбирает коэффициенты методом наименьших квадратов (с небольшой
+        L2-регуляризацией). Признаки с отрицательным коэффициентом исключаются
+        и модель переобучается, чтобы оценка не убывала с ростом текста.
+        """
+        rows = [(1.0, *features) for features in extract_features_batch(list(texts))]
+        names = ('intercept', *FEATURES)
+        active = list(range(len(names)))
+        while True:
+            solution = _least_squares(
+                [[row[i] for i in active] for row in rows], list(map(float, tokens)), ridge
+            )
+            negative = [i for i, value in zip(active, solution) if value < 0 and i != 0]
+            if not negative:
+                break
+            active = [i for i in active if i not in negative]
+
+        coefficients = {name: 0.0 for name in names}
+        for i, value in zip(active, solution):
+            coefficients[names[i]] = round(value, 6)
+        return cls(coefficients)
+
+
+def _least_squares(rows: List[List[float]], targets: List[float], ridge: float) -> List[float]:
+    """Решает нормальные уравнения (XᵀX + λI)β = Xᵀy методом Гаусса."""
+    size = len(rows[0])
+    matrix = [[0.0] * size for _ in range(size)]
+    vector = [0.0] * size
+    for row, target in zip(rows, targets):
+        for i in range(size):
+            vector[i] += row[i] * target
+            for j in range(size):
+                matrix[i][j] += row[i] * row[j]
+    for i in range(size):
+        matrix[i][i] += ridge
+
+    # Прямой ход с выбором ведущего элемента
+    for col in range(size):
+        pivot = max(range(col, size), key=lambda r: abs(matrix[r][col]))
+        matrix[col], matrix[pivot] = matrix[pivot], matrix[col]
+        vector[col], vector[pivot] = vector[pivot], vector[col]
+        if math.isclose(matrix[col][col], 0.0, abs_tol=1e-12):
+            continue
+        for r in range(col + 1, size):
+            factor = matrix[r][col] / matrix[col][col]
+            for c in range(col, size):
+                matrix[r][c] -= factor * matrix[col][c]
+            vector[r] -= factor * vector[col]
+
+    solution = [0.0] * size
+    for i in reversed(range(size)):
+        if math.isclose(matrix[i][i], 0.0, abs_tol=1e-12):
+            continue
+        solution[i] = (vector[i] - sum(matrix[i][j] * solution[j] for j in range(i + 1, size))) / matrix[i][i]
+    return solution
+
+
+def load_coefficients() -> Dict[str, Optional[Dict[str, float]]]:
+    """
+    Коэффициенты по семействам моделей из файла TOKEN_ESTIMATOR_COEFFICIENTS
+    (результат calibrate_token_estimator). Для семейств без подобранных
+    коэффициентов значение None: используется оценка len // 4.5.
+    """
+    coefficients: Dict[str, Optional[Dict[str, float]]] = {family: None for family in MODEL_FAMILIES}
+    path = getattr(settings, 'TOKEN_ESTIMATOR_COEFFICIENTS', '')
+    if path:
+        try:
+            with open(path, encoding='utf-8') as f:
+                for family, values in json.load(f).items():
+                    coefficients[family] = dict(values)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Не удалось загрузить коэффициенты оценки токенов из {path}: {e}")
+    return coefficients
+
+
+_estimators: Dict[str, TokenEstimator] = {}
+_estimators_lock = threading.Lock()
+
+
+def get_estimator(family: str) -> TokenEstimator:
+    """Возвращает общий для процесса экземпляр оценщика для семейства моделей."""
+    estimator = _estimators.get(family)
+    if estimator is None:
+        with _estimators_lock:
+            if not _estimators:
+                for name, values in load_coefficients().items():
+                    _estimators[name] = TokenEstimator(values)
+            estimator = _estimators[family]
+    return estimator
+
+
+def legacy_estimate(text: str) -> int:
+    """Прежняя оценка TokenCounter для GigaChat и Yandex GPT (4.5 символа на токен): используется до калибровки."""
+    return int(len(text) // 4.5)
+
+
+def load_samples(path: str, family: Optional[str] = None) -> Tuple[List[str], List[int]]:
+    """
+    Читает выборку из JSONL-файла: по строке {"text": ..., "tokens": ..., "model": ...}
+    на пример, где tokens — точный подсчет токенизатора провайдера. Если задано
+    семейство, берутся только примеры его моделей (и примеры без модели).
+    """
+    texts, tokens = [], []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            sample = json.loads(line)
+            if family and sample.get('model') and model_family(sample['model']) != family:
+                continue
+            texts.append(sample['text'])
+            tokens.append(int(sample['tokens']))
+    return texts, tokens
+
+
+def error_stats(predicted: Sequence[int], actual: Sequence[int]) -> Dict[str, float]:
+    """Ошибки оценки: средняя абсолютная (MAE), средняя относительная (MAPE), 90-й перцентиль относительной и суммарная."""
+    relative = sorted(abs(p - a) / a for p, a in zip(predicted, actual) if a)
+    total_actual = sum(actual)
+    return {
+        'mae': sum(abs(p - a) for p, a in zip(predicted, actual)) / max(len(actual), 1),
+        'mape': sum(relative) / max(len(relative), 1),
+        'p90': relative[int(len(relative) * 0.9)] if relative else 0.0,
+        'total_error': (sum(predicted) - total_actual) / total_actual if total_actual else 0.0,
+    }
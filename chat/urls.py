@@ -16,9 +16,13 @@ urlpatterns = [
     path('csrf-simple/', views.csrf_simple, name='csrf_simple'),
     path('api/health/', views.health_check, name='health_check'),
     path('api/send-message/', views.send_message, name='send_message'),
+    path('api/send-message/stream/', views.send_message_stream, name='send_message_stream'),
     path('api/create-session/', views.create_session, name='create_session'),
     path('api/update-session/', views.update_session, name='update_session'),
     path('api/upload-file/', views.upload_file, name='upload_file'),
+    path('api/async/send-message/', views.asend_message, name='asend_message'),
+    path('api/async/upload-file/', views.aupload_file, name='aupload_file'),
+    path('api/ingestion/<uuid:job_id>/', views.ingestion_status, name='ingestion_status'),
     path('api/session/<str:session_id>/files/', views.get_session_files, name='get_session_files'),
     path('api/agents/create/', views.create_agent, name='create_agent'),
     path('api/agents/check/', views.check_agent_exists, name='check_agent_exists'),
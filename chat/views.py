@@ -1,16 +1,28 @@
 import json
+import math
 import uuid
 import logging
 from django.shortcuts import render, get_object_or_404
-from django.http import JsonResponse
+from django.http import JsonResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
 from django.core.files.storage import default_storage
 from django.core.files.base import ContentFile
+from django.conf import settings
 from django.utils import timezone
-from .models import ChatSession, Message, UploadedFile, Agent, PythonFunction
-from .llm_service import LLMService
+from django.db import transaction
+from django.db.models import Prefetch
+from asgiref.sync import sync_to_async
+from .models import ChatSession, Message, UploadedFile, Agent, PythonFunction, IngestionJob
+from .llm_service import LLMService, http_client, response_cache
+from .rate_limiter import get_stats as get_rate_limit_stats
+from .resilience import ProviderError, get_stats as get_circuit_stats
 from .file_processor import FileProcessor
+from .ingestion import enqueue_upload, ensure_inprocess_workers
+from .retrieval import retrieve_context
+from .context_builder import build_messages
+from .summarizer import schedule_summary
+from .pagination import keyset_paginate, InvalidCursor
 
 # Настройка логирования
 logger = logging.getLogger(__name__)
@@ -31,9 +43,14 @@ def playground(request):
 
 
 def history(request):
-    """Страница истории чатов."""
-    sessions = ChatSession.objects.all()[:50]  # Последние 50 сессий
-    return render(request, 'chat/history.html', {'sessions': sessions})
+    """Страница истории чатов (по 50 сессий, переход дальше по курсору)."""
+    files = UploadedFile.objects.only('id', 'session_id', 'filename', 'file_type', 'uploaded_at')
+    sessions = ChatSession.objects.prefetch_related(Prefetch('files', queryset=files))
+    try:
+        sessions, next_cursor = keyset_paginate(sessions, request.GET.get('cursor'), 50)
+    except InvalidCursor:
+        sessions, next_cursor = keyset_paginate(sessions, None, 50)
+    return render(request, 'chat/history.html', {'sessions': sessions, 'next_cursor': next_cursor})
 
 
 def token_stats(request):
@@ -71,7 +88,11 @@ def health_check(request):
         return JsonResponse({
             'status': 'ok',
             'message': 'Сервер работает',
-            'timestamp': timezone.now().isoformat()
+            'timestamp': timezone.now().isoformat(),
+            'http_pools': http_client.get_stats(),
+            'response_cache': response_cache.get_stats(),
+            'rate_limits': get_rate_limit_stats(),
+            'circuit_breakers': get_circuit_stats(),
         })
     except Exception as e:
         logger.error(f"Health check error: {str(e)}")
@@ -97,6 +118,7 @@ def create_session(request):
             max_tokens=int(data.get('max_tokens', 4000)),
             system_prompt=data.get('system_prompt', ''),
             web_search=bool(data.get('web_search', False)),
+            response_cache=bool(data.get('response_cache', False)),
         )
         
         # Обрабатываем функции если они переданы (просто логируем)
@@ -122,6 +144,249 @@ def create_session(request):
         return JsonResponse({'success': False, 'error': str(e)})
 
 
+def _session_files(session):
+    """
+    Файлы сессии вместе с задачами обработки и результатами разбора (одним запросом).
+
+    Извлеченный текст не загружается: проиндексированные файлы попадают в запрос
+    фрагментами, а текст остальных читается по требованию в _get_training_files.
+    """
+    return session.files.select_related('ingestion_job', 'extraction').defer(
+        'training_data', 'extraction__training_data'
+    )
+
+
+def _is_indexed(uploaded_file):
+    """Проверяет, построен ли для файла поисковый индекс по фрагментам."""
+    return bool(uploaded_file.extraction_id and uploaded_file.extraction.chunk_count)
+
+
+def _get_training_files(files):
+    """
+    Собирает сохраненное содержимое файлов сессии, для которых нет поискового индекса
+    (изображения и файлы, загруженные до появления индекса). Проиндексированные файлы
+    попадают в запрос только релевантными фрагментами, см. _with_file_context.
+    """
+    training_files = []
+    
+    for uploaded_file in files:
+        if _is_indexed(uploaded_file):
+            continue
+        try:
+            # Текст отложен в _session_files и загружается только для непроиндексированных файлов
+            file_data = uploaded_file.get_training_data()
+            if 'error' not in file_data:
+                training_files.append(dict(file_data, filename=uploaded_file.filename))
+            else:
+                logger.warning(f"Ошибка обработки файла {uploaded_file.filename}: {file_data['error']}")
+        except Exception as e:
+            logger.error(f"Ошибка при обработке файла {uploaded_file.filename}: {str(e)}")
+    
+    return training_files
+
+
+def _files_context(files):
+    """Формирует контекст из превью загруженных файлов без поискового индекса (для обратной совместимости)."""
+    context = ""
+    for file in files:
+        if file.content_preview and not _is_indexed(file):
+            context += f"\n\nКонтекст из файла {file.filename}:\n{file.content_preview}"
+    return context
+
+
+def _with_file_context(user_message, files, model):
+    """Дополняет сообщение пользователя фрагментами файлов сессии, релевантными этому сообщению."""
+    context = retrieve_context(files, user_message, model)
+    if not context:
+        return user_message
+    return f"{user_message}\n\n{context}"
+
+
+def _compose_system_content(session, context):
+    """Собирает системный промпт из промпта сессии, контекста файлов и настроек ответа."""
+    logger.info(f"Модель: {session.model}, температура: {session.temperature}, top_p: {session.top_p}")
+    logger.info("Отправляем запрос к LLM сервису")
+    
+    # Подготавливаем системный промпт с учетом всех настроек
+    settings_prompt = f"\n\nНастройки ответа:\n"
+    settings_prompt += f"Максимум токенов: {session.max_tokens}\n"
+    
+    if session.temperature <= 0.3:
+        settings_prompt += f"Стиль: Кратко и по делу.\n"
+    elif session.temperature <= 0.7:
+        settings_prompt += f"Стиль: Умеренно, с примерами.\n"
+    else:
+        settings_prompt += f"Стиль: Развернуто, с деталями.\n"
+        
+    if session.top_p <= 0.5:
+        settings_prompt += f"Подход: Фактический, проверенная информация.\n"
+    else:
+        settings_prompt += f"Подход: Креативный, нестандартные идеи.\n"
+        
+    # Проверяем, есть ли системный промпт
+    if not session.system_prompt.strip():
+        logger.warning("Системный промпт пустой!")
+        system_content = "Ты полезный ассистент. " + context + settings_prompt
+    else:
+        # Добавляем системный промпт пользователя
+        system_content = f"{session.system_prompt}\n\n" + context + settings_prompt
+    
+    # Проверяем длину системного промпта
+    if len(system_content) > 4000:
+        logger.warning(f"Системный промпт слишком длинный: {len(system_content)} символов")
+        # Обрезаем до 4000 символов
+        system_content = system_content[:4000] + "..."
+    
+    # Логируем системный промпт для отладки
+    logger.info(f"Системный промпт пользователя: '{session.system_prompt}'")
+    logger.info(f"Контекст из файлов: '{context[:200]}...' (длина: {len(context)})")
+    logger.info(f"Настройки модели: '{settings_prompt[:200]}...' (длина: {len(settings_prompt)})")
+    logger.info(f"Итоговый системный промпт: '{system_content[:500]}...' (длина: {len(system_content)})")
+    logger.info(f"Полный системный промпт: '{system_content}'")
+    
+    return system_content
+
+
+def _append_search_results(system_content, search_results):
+    """Добавляет результаты поиска к системному промпту."""
+    logger.info(f"Получены результаты поиска: {len(search_results)} символов")
+    logger.info(f"Результаты поиска: {search_results[:200]}...")
+    if search_results:
+        system_content += f"\n\n{search_results}"
+        logger.info("Результаты поиска добавлены к системному промпту")
+    return system_content
+
+
+def _build_system_content(session, user_message, files):
+    """Собирает системный промпт с контекстом файлов, настройками ответа и результатами поиска."""
+    system_content = _compose_system_content(session, _files_context(files))
+    
+    # Проверяем, нужно ли выполнить поиск в интернете
+    logger.info(f"Проверяем web_search для сессии {session.session_id}: {session.web_search}")
+    if session.web_search:
+        logger.info("Включен поиск в интернете, выполняем поиск...")
+        llm_service = LLMService()
+        search_results_list = llm_service.search_web(user_message, max_results=3)
+        system_content = _append_search_results(
+            system_content, llm_service.format_search_results(search_results_list)
+        )
+    else:
+        logger.info("Поиск в интернете отключен для этой сессии")
+    
+    return system_content
+
+
+async def _abuild_system_content(session, user_message, files):
+    """Асинхронная версия _build_system_content."""
+    system_content = _compose_system_content(session, _files_context(files))
+    
+    if session.web_search:
+        logger.info("Включен поиск в интернете, выполняем поиск...")
+        llm_service = LLMService()
+        search_results_list = await llm_service.asearch_web(user_message, max_results=3)
+        system_content = _append_search_results(
+            system_content, llm_service.format_search_results(search_results_list)
+        )
+    
+    return system_content
+
+
+def _save_assistant_message(session, response_data, user_msg):
+    """
+    Сохраняет сообщение пользователя и ответ ассистента с информацией о токенах.
+
+    Сообщение пользователя сохраняется только вместе с ответом: при ошибке
+    провайдера в истории и счетчиках сессии не остается реплики без ответа.
+    """
+    with transaction.atomic():
+        user_msg.save()
+        assistant_msg = _create_assistant_message(session, response_data)
+    
+    # Счетчики сессии увеличены в Message.save, перечитываем только их
+    session.refresh_from_db(fields=ChatSession.TOKEN_STAT_FIELDS)
+    schedule_summary(session)
+    
+    return assistant_msg
+
+
+def _create_assistant_message(session, response_data):
+    return Message.objects.create(
+        session=session,
+        role='assistant',
+        content=response_data['content'],
+        input_tokens=response_data['input_tokens'],
+        output_tokens=response_data['output_tokens'],
+        total_tokens=response_data['total_tokens'],
+        estimated_cost=response_data['cost']['total_cost'],
+        # Содержимое ответа уже посчитано как output_tokens
+        content_tokens=response_data['output_tokens'],
+        metadata={
+            'model': session.model,
+            'token_stats': {
+                'input_tokens': response_data['input_tokens'],
+                'output_tokens': response_data['output_tokens'],
+                'total_tokens': response_data['total_tokens'],
+                'cost': response_data['cost']
+            },
+            # provider — токены из usage ответа провайдера, local — локальный подсчет
+            'token_source': response_data.get('token_source', 'local'),
+            'finish_reason': response_data.get('finish_reason'),
+            'latency_ms': response_data.get('latency_ms'),
+            **({'cache': response_data['cache']} if 'cache' in response_data else {})
+        }
+    )
+
+
+async def _asave_assistant_message(session, response_data, user_msg):
+    """Асинхронная версия _save_assistant_message (транзакция выполняется в потоке ORM)."""
+    return await sync_to_async(_save_assistant_message)(session, response_data, user_msg)
+
+
+def _serialize_user_message(user_msg):
+    return {
+        'id': str(user_msg.id),
+        'content': user_msg.content,
+        'timestamp': user_msg.timestamp.isoformat(),
+    }
+
+
+def _serialize_assistant_message(assistant_msg):
+    return {
+        'id': str(assistant_msg.id),
+        'content': assistant_msg.content,
+        'timestamp': assistant_msg.timestamp.isoformat(),
+        'token_stats': {
+            'input_tokens': assistant_msg.input_tokens,
+            'output_tokens': assistant_msg.output_tokens,
+            'total_tokens': assistant_msg.total_tokens,
+            'estimated_cost': float(assistant_msg.estimated_cost),
+        }
+    }
+
+
+def _sse_event(event, data):
+    """Форматирует событие Server-Sent Events."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _provider_error_payload(error: ProviderError) -> dict:
+    return {'error': str(error), 'error_type': type(error).__name__, 'retry_after': error.retry_after}
+
+
+def _provider_error_response(error: ProviderError) -> JsonResponse:
+    """
+    Ответ на ошибку провайдера: 503 — провайдер перегружен или временно
+    недоступен (с Retry-After, если время ожидания известно), 502 — провайдер
+    отклонил запрос, 500 — провайдер не настроен. Ответ ассистента при этом
+    не сохраняется.
+    """
+    logger.error(f"Ошибка провайдера {error.provider}: {error}")
+    response = JsonResponse({'success': False, **_provider_error_payload(error)}, status=error.status)
+    if error.retry_after:
+        response['Retry-After'] = str(math.ceil(error.retry_after))
+    return response
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def send_message(request):
@@ -139,9 +404,7 @@ def send_message(request):
             session = ChatSession.objects.get(session_id=session_id)
             logger.info(f"Найдена сессия: {session_id}")
             
-            # Проверяем количество сообщений в сессии
-            message_count = session.messages.count()
-            logger.info(f"Количество сообщений в сессии: {message_count}")
+            logger.info(f"Количество сообщений в сессии: {session.message_count}")
             
         except ChatSession.DoesNotExist:
             logger.error(f"Сессия не найдена: {session_id}")
@@ -155,169 +418,252 @@ def send_message(request):
         # Получаем функции из запроса
         functions = data.get('functions', [])
         
-        logger.info(f"Сохраняем сообщение пользователя: {user_message[:100]}...")
-        # Сохраняем сообщение пользователя
-        user_msg = Message.objects.create(
-            session=session,
-            role='user',
-            content=user_message
+        logger.info(f"Сообщение пользователя: {user_message[:100]}...")
+        # Сообщение пользователя сохраняется вместе с ответом ассистента
+        user_msg = Message(session=session, role='user', content=user_message)
+        
+        # Файлы сессии загружаются одним запросом, их содержимое уже извлечено при загрузке
+        files = list(_session_files(session))
+        training_files = _get_training_files(files)
+        system_content = _build_system_content(session, user_message, files)
+        # Из проиндексированных файлов в запрос попадают только релевантные фрагменты
+        user_content = _with_file_context(user_message, files, session.model)
+        
+        # Отправляем запрос к LLM с файлами и функциями
+        logger.info(f"Передаем в LLM сервис модель: '{session.model}'")
+        messages = build_messages(session, system_content, user_content)
+        llm_service = LLMService()
+        response_data = llm_service.generate_response(
+            model=session.model,
+            messages=messages,
+            temperature=session.temperature,
+            top_p=session.top_p,
+            max_tokens=session.max_tokens,
+            files=training_files,
+            functions=functions,
+            use_cache=session.response_cache
         )
         
-        # Получаем и обрабатываем файлы для обучения
-        training_files = []
-        processor = FileProcessor()
+        logger.info("Получен ответ от LLM сервиса")
         
-        for uploaded_file in session.files.all():
-            try:
-                # Обрабатываем файл для обучения
-                file_data = processor.process_file_for_training(uploaded_file.file)
-                if 'error' not in file_data:
-                    file_data['filename'] = uploaded_file.filename
-                    training_files.append(file_data)
-                else:
-                    logger.warning(f"Ошибка обработки файла {uploaded_file.filename}: {file_data['error']}")
-            except Exception as e:
-                logger.error(f"Ошибка при обработке файла {uploaded_file.filename}: {str(e)}")
+        # Сохраняем ответ ассистента с информацией о токенах
+        assistant_msg = _save_assistant_message(session, response_data, user_msg)
+        
+        logger.info("Сообщение успешно обработано и сохранено")
+        
+        return JsonResponse({
+            'success': True,
+            'user_message': _serialize_user_message(user_msg),
+            'assistant_message': _serialize_assistant_message(assistant_msg),
+            'session_stats': session.get_token_stats()
+        })
+        
+    except ProviderError as e:
+        return _provider_error_response(e)
+    except Exception as e:
+        logger.error(f"Ошибка при обработке сообщения: {str(e)}")
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def send_message_stream(request):
+    """
+    Отправка сообщения в чат с потоковым ответом (Server-Sent Events).
+
+    События: start (сообщение пользователя), delta (фрагмент ответа), done
+    (сохраненный ответ ассистента и статистика сессии), error (ошибка
+    генерации). Сообщение пользователя сохраняется вместе с ответом, поэтому
+    после ошибки или обрыва потока оно не остается в истории сессии.
+    """
+    try:
+        logger.info("Получен запрос на потоковую отправку сообщения")
+        data = json.loads(request.body)
+        session_id = data.get('session_id')
         
-        # Получаем контекст из загруженных файлов (для обратной совместимости)
-        context = ""
-        for file in session.files.all():
-            if file.content_preview:
-                context += f"\n\nКонтекст из файла {file.filename}:\n{file.content_preview}"
+        if not session_id:
+            return JsonResponse({'success': False, 'error': 'Session ID required'})
         
-        logger.info(f"Модель: {session.model}, температура: {session.temperature}, top_p: {session.top_p}")
-        logger.info("Отправляем запрос к LLM сервису")
+        try:
+            session = ChatSession.objects.get(session_id=session_id)
+        except ChatSession.DoesNotExist:
+            logger.error(f"Сессия не найдена: {session_id}")
+            return JsonResponse({'success': False, 'error': 'Session not found'})
         
-        # Подготавливаем системный промпт с учетом всех настроек
-        settings_prompt = f"\n\nНастройки ответа:\n"
-        settings_prompt += f"Максимум токенов: {session.max_tokens}\n"
+        user_message = data.get('message', '').strip()
+        if not user_message:
+            return JsonResponse({'success': False, 'error': 'Message cannot be empty'})
         
-        if session.temperature <= 0.3:
-            settings_prompt += f"Стиль: Кратко и по делу.\n"
-        elif session.temperature <= 0.7:
-            settings_prompt += f"Стиль: Умеренно, с примерами.\n"
-        else:
-            settings_prompt += f"Стиль: Развернуто, с деталями.\n"
+        functions = data.get('functions', [])
+        
+        # Сообщение пользователя сохраняется вместе с ответом ассистента
+        user_msg = Message(session=session, role='user', content=user_message)
+    except Exception as e:
+        logger.error(f"Ошибка при обработке сообщения: {str(e)}")
+        return JsonResponse({'success': False, 'error': str(e)})
+    
+    def event_stream():
+        # Первое событие уходит клиенту сразу, до обращения к файлам, поиску и модели
+        yield _sse_event('start', {'user_message': _serialize_user_message(user_msg)})
+        
+        try:
+            files = list(_session_files(session))
+            training_files = _get_training_files(files)
+            system_content = _build_system_content(session, user_message, files)
+            user_content = _with_file_context(user_message, files, session.model)
             
-        if session.top_p <= 0.5:
-            settings_prompt += f"Подход: Фактический, проверенная информация.\n"
-        else:
-            settings_prompt += f"Подход: Креативный, нестандартные идеи.\n"
+            messages = build_messages(session, system_content, user_content)
             
-        # Проверяем, есть ли системный промпт
-        if not session.system_prompt.strip():
-            logger.warning("Системный промпт пустой!")
-            system_content = "Ты полезный ассистент. " + context + settings_prompt
-        else:
-            # Добавляем системный промпт пользователя
-            system_content = f"{session.system_prompt}\n\n" + context + settings_prompt
-        
-        # Проверяем длину системного промпта
-        if len(system_content) > 4000:
-            logger.warning(f"Системный промпт слишком длинный: {len(system_content)} символов")
-            # Обрезаем до 4000 символов
-            system_content = system_content[:4000] + "..."
-        
-        # Логируем системный промпт для отладки
-        logger.info(f"Системный промпт пользователя: '{session.system_prompt}'")
-        logger.info(f"Контекст из файлов: '{context[:200]}...' (длина: {len(context)})")
-        logger.info(f"Настройки модели: '{settings_prompt[:200]}...' (длина: {len(settings_prompt)})")
-        logger.info(f"Итоговый системный промпт: '{system_content[:500]}...' (длина: {len(system_content)})")
-        logger.info(f"Полный системный промпт: '{system_content}'")
-        
-        # Функции уже получены из запроса выше
-        
-        # Проверяем, нужно ли выполнить поиск в интернете
-        search_results = ""
-        logger.info(f"Проверяем web_search для сессии {session_id}: {session.web_search}")
-        if session.web_search:
-            logger.info("Включен поиск в интернете, выполняем поиск...")
             llm_service = LLMService()
-            search_results_list = llm_service.search_web(user_message, max_results=3)
-            search_results = llm_service.format_search_results(search_results_list)
-            logger.info(f"Получены результаты поиска: {len(search_results)} символов")
-            logger.info(f"Результаты поиска: {search_results[:200]}...")
+            events = llm_service.generate_response_stream(
+                model=session.model,
+                messages=messages,
+                temperature=session.temperature,
+                top_p=session.top_p,
+                max_tokens=session.max_tokens,
+                files=training_files,
+                functions=functions,
+                use_cache=session.response_cache
+            )
             
-            # Добавляем результаты поиска к системному промпту
-            if search_results:
-                system_content += f"\n\n{search_results}"
-                logger.info("Результаты поиска добавлены к системному промпту")
-        else:
-            logger.info("Поиск в интернете отключен для этой сессии")
+            for event in events:
+                if event['type'] == 'delta':
+                    yield _sse_event('delta', {'content': event['content']})
+                elif event['type'] == 'error':
+                    # Обрыв потока после начала ответа: событие того же вида, что и при ошибке до ответа
+                    yield _sse_event('error', _provider_error_payload(event['error']))
+                elif event['type'] == 'done':
+                    assistant_msg = _save_assistant_message(session, event, user_msg)
+                    logger.info("Потоковое сообщение успешно обработано и сохранено")
+                    yield _sse_event('done', {
+                        'assistant_message': _serialize_assistant_message(assistant_msg),
+                        'session_stats': session.get_token_stats()
+                    })
+        except ProviderError as e:
+            logger.error(f"Ошибка провайдера {e.provider}: {e}")
+            yield _sse_event('error', _provider_error_payload(e))
+        except Exception as e:
+            logger.error(f"Ошибка при потоковой обработке сообщения: {str(e)}")
+            yield _sse_event('error', {'error': str(e)})
+    
+    response = StreamingHttpResponse(event_stream(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Отключаем буферизацию ответа в nginx
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def asend_message(request):
+    """
+    Асинхронная отправка сообщения в чат (для запуска под ASGI).
+
+    Формат запроса и ответа совпадает с send_message, но ожидание ответа
+    провайдера не занимает поток воркера.
+    """
+    try:
+        data = json.loads(request.body)
+        session_id = data.get('session_id')
+        
+        if not session_id:
+            return JsonResponse({'success': False, 'error': 'Session ID required'})
+        
+        try:
+            session = await ChatSession.objects.aget(session_id=session_id)
+        except ChatSession.DoesNotExist:
+            logger.error(f"Сессия не найдена: {session_id}")
+            return JsonResponse({'success': False, 'error': 'Session not found'})
+        
+        user_message = data.get('message', '').strip()
+        if not user_message:
+            return JsonResponse({'success': False, 'error': 'Message cannot be empty'})
+        
+        functions = data.get('functions', [])
+        
+        # Сообщение пользователя сохраняется вместе с ответом ассистента
+        user_msg = Message(session=session, role='user', content=user_message)
+        
+        files = [file async for file in _session_files(session)]
+        # Для старых файлов без сохраненного содержимого оно извлекается в пуле потоков
+        training_files = await sync_to_async(_get_training_files, thread_sensitive=False)(files)
+        system_content = await _abuild_system_content(session, user_message, files)
+        user_content = await sync_to_async(_with_file_context, thread_sensitive=False)(user_message, files, session.model)
+        
+        messages = await sync_to_async(build_messages, thread_sensitive=False)(
+            session, system_content, user_content
+        )
         
-        # Отправляем запрос к LLM с файлами и функциями
-        logger.info(f"Передаем в LLM сервис модель: '{session.model}'")
         llm_service = LLMService()
-        response_data = llm_service.generate_response(
+        response_data = await llm_service.agenerate_response(
             model=session.model,
-            messages=[
-                {'role': 'system', 'content': system_content},
-                {'role': 'user', 'content': user_message}
-            ],
+            messages=messages,
             temperature=session.temperature,
             top_p=session.top_p,
             max_tokens=session.max_tokens,
             files=training_files,
-            functions=functions
+            functions=functions,
+            use_cache=session.response_cache
         )
         
-        logger.info("Получен ответ от LLM сервиса")
-        
-        # Сохраняем ответ ассистента с информацией о токенах
-        assistant_msg = Message.objects.create(
-            session=session,
-            role='assistant',
-            content=response_data['content'],
-            input_tokens=response_data['input_tokens'],
-            output_tokens=response_data['output_tokens'],
-            total_tokens=response_data['total_tokens'],
-            estimated_cost=response_data['cost']['total_cost'],
-            metadata={
-                'model': session.model,
-                'token_stats': {
-                    'input_tokens': response_data['input_tokens'],
-                    'output_tokens': response_data['output_tokens'],
-                    'total_tokens': response_data['total_tokens'],
-                    'cost': response_data['cost']
-                }
-            }
-        )
-        
-        # Проверяем количество сообщений после сохранения
-        final_message_count = session.messages.count()
-        logger.info(f"Количество сообщений после сохранения ответа: {final_message_count}")
-        
-        # Обновляем статистику токенов сессии
-        session.update_token_stats()
-        
-        logger.info("Сообщение успешно обработано и сохранено")
+        assistant_msg = await _asave_assistant_message(session, response_data, user_msg)
+        session_stats = await sync_to_async(session.get_token_stats)()
         
         return JsonResponse({
             'success': True,
-            'user_message': {
-                'id': str(user_msg.id),
-                'content': user_msg.content,
-                'timestamp': user_msg.timestamp.isoformat(),
-            },
-            'assistant_message': {
-                'id': str(assistant_msg.id),
-                'content': assistant_msg.content,
-                'timestamp': assistant_msg.timestamp.isoformat(),
-                'token_stats': {
-                    'input_tokens': assistant_msg.input_tokens,
-                    'output_tokens': assistant_msg.output_tokens,
-                    'total_tokens': assistant_msg.total_tokens,
-                    'estimated_cost': float(assistant_msg.estimated_cost),
-                }
-            },
-            'session_stats': session.get_token_stats()
+            'user_message': _serialize_user_message(user_msg),
+            'assistant_message': _serialize_assistant_message(assistant_msg),
+            'session_stats': session_stats
         })
         
+    except ProviderError as e:
+        return _provider_error_response(e)
     except Exception as e:
         logger.error(f"Ошибка при обработке сообщения: {str(e)}")
         return JsonResponse({'success': False, 'error': str(e)})
 
 
+def _serialize_uploaded_file(uploaded_file, job):
+    """Формирует ответ с информацией о загруженном файле и состоянии его обработки."""
+    response_data = {
+        'id': str(uploaded_file.id),
+        'filename': uploaded_file.filename,
+        'file_type': uploaded_file.file_type,
+        'file_size': uploaded_file.file_size,
+        'content_preview': uploaded_file.content_preview[:500] + '...' if len(uploaded_file.content_preview) > 500 else uploaded_file.content_preview,
+        'job_id': str(job.id),
+        'status': job.status,
+        'progress': job.progress,
+    }
+    
+    # Добавляем информацию о готовности для обучения
+    if job.status != IngestionJob.STATUS_READY:
+        response_data['training_ready'] = False
+        if job.status == IngestionJob.STATUS_ERROR:
+            response_data['training_error'] = job.error
+        return response_data
+    
+    training_data = uploaded_file.stored_training_data or {}
+    if 'error' not in training_data:
+        response_data['training_ready'] = True
+        response_data['training_type'] = training_data.get('type', 'unknown')
+        response_data['training_size'] = training_data.get('size', 0)
+    else:
+        response_data['training_ready'] = False
+        response_data['training_error'] = training_data['error']
+    
+    return response_data
+
+
+def _validate_upload(file):
+    """Проверяет размер и тип загружаемого файла; возвращает текст ошибки или None."""
+    if file.size > settings.MAX_UPLOAD_SIZE:
+        return f'File too large. Maximum size is {settings.MAX_UPLOAD_SIZE // (1024 * 1024)}MB.'
+    if FileProcessor().get_file_type(file.name) == 'unknown':
+        return 'Unsupported file type'
+    return None
+
+
 @csrf_exempt
 @require_http_methods(["POST"])
 def upload_file(request):
@@ -350,59 +696,78 @@ def upload_file(request):
         
         file = request.FILES['file']
         
-        # Проверяем размер файла (максимум 10MB)
-        if file.size > 10 * 1024 * 1024:
-            return JsonResponse({'success': False, 'error': 'File too large. Maximum size is 10MB.'})
-        
-        # Обрабатываем файл
-        processor = FileProcessor()
-        file_type, content_preview = processor.process_file(file)
-        
-        # Проверяем, поддерживается ли тип файла
-        if file_type == 'unknown':
-            return JsonResponse({'success': False, 'error': 'Unsupported file type'})
-        
-        # Обрабатываем файл для обучения
-        training_data = processor.process_file_for_training(file)
-        
-        # Сохраняем файл
-        uploaded_file = UploadedFile.objects.create(
-            session=session,
-            file=file,
-            filename=file.name,
-            file_type=file_type,
-            file_size=file.size,
-            content_preview=content_preview
-        )
+        error = _validate_upload(file)
+        if error:
+            return JsonResponse({'success': False, 'error': error})
+        
+        # Сохраняем файл и ставим его в очередь на обработку, разбор выполняет фоновый воркер
+        job = enqueue_upload(session, file)
+        uploaded_file = job.uploaded_file
         
         logger.info(f"Создан файл: filename='{uploaded_file.filename}', file_type='{uploaded_file.file_type}'")
         logger.info(f"Filename bytes: {uploaded_file.filename.encode('utf-8')}")
         logger.info(f"Filename repr: {repr(uploaded_file.filename)}")
         
         # Подготавливаем ответ с информацией о файле
-        response_data = {
-            'id': str(uploaded_file.id),
-            'filename': uploaded_file.filename,
-            'file_type': uploaded_file.file_type,
-            'file_size': uploaded_file.file_size,
-            'content_preview': uploaded_file.content_preview[:500] + '...' if len(uploaded_file.content_preview) > 500 else uploaded_file.content_preview,
-        }
-        
-        # Добавляем информацию о готовности для обучения
-        if 'error' not in training_data:
-            response_data['training_ready'] = True
-            response_data['training_type'] = training_data.get('type', 'unknown')
-            response_data['training_size'] = training_data.get('size', 0)
-        else:
-            response_data['training_ready'] = False
-            response_data['training_error'] = training_data['error']
+        response_data = _serialize_uploaded_file(uploaded_file, job)
         
         logger.info(f"Файл успешно загружен: {uploaded_file.filename} для сессии {session_id}")
         logger.info(f"Response data: {response_data}")
         
         return JsonResponse({
             'success': True,
-            'file': response_data
+            'file': response_data,
+            'job_id': str(job.id)
+        })
+        
+    except Exception as e:
+        logger.error(f"Ошибка при загрузке файла: {str(e)}")
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
+@csrf_exempt
+@require_http_methods(["POST"])
+async def aupload_file(request):
+    """Асинхронная загрузка файла для сессии (для запуска под ASGI)."""
+    try:
+        session_id = request.POST.get('session_id')
+        
+        if not session_id:
+            return JsonResponse({'success': False, 'error': 'Session ID required'})
+        
+        session, created = await ChatSession.objects.aget_or_create(
+            session_id=session_id,
+            defaults={
+                'model': 'GigaChat:latest',  # Значение по умолчанию
+                'temperature': 0.7,
+                'top_p': 1.0,
+                'max_tokens': 4000,
+                'system_prompt': '',
+                'web_search': False,
+            }
+        )
+        if created:
+            logger.info(f"Создана новая сессия для загрузки файла: {session_id}")
+        
+        if 'file' not in request.FILES:
+            return JsonResponse({'success': False, 'error': 'No file provided'})
+        
+        file = request.FILES['file']
+        
+        error = _validate_upload(file)
+        if error:
+            return JsonResponse({'success': False, 'error': error})
+        
+        # Хеширование и сохранение содержимого выполняются в пуле потоков
+        job = await sync_to_async(enqueue_upload, thread_sensitive=False)(session, file)
+        uploaded_file = job.uploaded_file
+        
+        logger.info(f"Файл успешно загружен: {uploaded_file.filename} для сессии {session_id}")
+        
+        return JsonResponse({
+            'success': True,
+            'file': _serialize_uploaded_file(uploaded_file, job),
+            'job_id': str(job.id)
         })
         
     except Exception as e:
@@ -416,15 +781,14 @@ def get_session_files(request, session_id):
     """Получение списка файлов сессии."""
     try:
         session = get_object_or_404(ChatSession, session_id=session_id)
-        files = session.files.all()
+        files = session.files.select_related('ingestion_job', 'extraction')
         
         files_data = []
-        processor = FileProcessor()
         
         for file in files:
             # Проверяем готовность файла для обучения
             try:
-                training_data = processor.process_file_for_training(file.file)
+                training_data = file.get_training_data()
                 training_ready = 'error' not in training_data
                 training_type = training_data.get('type', 'unknown') if training_ready else None
                 training_size = training_data.get('size', 0) if training_ready else 0
@@ -440,6 +804,7 @@ def get_session_files(request, session_id):
                 'file_size': file.file_size,
                 'content_preview': file.content_preview[:200] + '...' if len(file.content_preview) > 200 else file.content_preview,
                 'uploaded_at': file.uploaded_at.isoformat(),
+                'status': file.ingestion_status,
                 'training_ready': training_ready,
                 'training_type': training_type,
                 'training_size': training_size,
@@ -456,6 +821,26 @@ def get_session_files(request, session_id):
         return JsonResponse({'success': False, 'error': str(e)})
 
 
+def ingestion_status(request, job_id):
+    """Статус фоновой обработки загруженного файла."""
+    try:
+        job = get_object_or_404(IngestionJob.objects.select_related('uploaded_file__extraction'), id=job_id)
+        
+        # Если веб-процесс был перезапущен, воркеры поднимутся при первом опросе
+        if job.status in (IngestionJob.STATUS_PENDING, IngestionJob.STATUS_EXTRACTING):
+            ensure_inprocess_workers()
+        
+        return JsonResponse({
+            'success': True,
+            'job': job.to_dict(),
+            'file': _serialize_uploaded_file(job.uploaded_file, job)
+        })
+        
+    except Exception as e:
+        logger.error(f"Ошибка при получении статуса обработки файла: {str(e)}")
+        return JsonResponse({'success': False, 'error': str(e)})
+
+
 # Agent views
 def agents_list(request):
     """Страница со списком всех агентов."""
@@ -502,9 +887,7 @@ def update_session(request):
             session = ChatSession.objects.get(session_id=session_id)
             logger.info(f"Найдена сессия, текущая модель: {session.model}")
             
-            # Проверяем количество сообщений в сессии
-            message_count = session.messages.count()
-            logger.info(f"Количество сообщений в сессии: {message_count}")
+            logger.info(f"Количество сообщений в сессии: {session.message_count}")
             
         except ChatSession.DoesNotExist:
             return JsonResponse({'success': False, 'error': 'Session not found'})
@@ -537,15 +920,15 @@ def update_session(request):
             session.web_search = bool(data['web_search'])
             update_fields.append('web_search')
         
+        if 'response_cache' in data:
+            session.response_cache = bool(data['response_cache'])
+            update_fields.append('response_cache')
+        
         if update_fields:
             session.save(update_fields=update_fields)
             logger.info(f"Настройки сессии {session_id} обновлены: {', '.join(update_fields)}")
             logger.info(f"Новая модель в сессии: {session.model}")
             
-            # Проверяем, что количество сообщений не изменилось
-            new_message_count = session.messages.count()
-            logger.info(f"Количество сообщений после обновления: {new_message_count}")
-            
         else:
             logger.info(f"Нет полей для обновления в сессии {session_id}")
         
@@ -578,6 +961,7 @@ def get_agent(request, agent_id):
                 'top_p': agent.top_p,
                 'system_prompt': agent.system_prompt,
                 'web_search': agent.web_search,
+                'response_cache': agent.response_cache,
             },
             'messages': [{
                 'id': msg.id,
@@ -609,6 +993,7 @@ def create_agent(request):
             existing_agent.top_p = float(data.get('top_p', existing_agent.top_p))
             existing_agent.max_tokens = int(data.get('max_tokens', existing_agent.max_tokens))
             existing_agent.system_prompt = data.get('system_prompt', existing_agent.system_prompt)
+            existing_agent.response_cache = bool(data.get('response_cache', existing_agent.response_cache))
             existing_agent.updated_at = timezone.now()
             existing_agent.save()
             
@@ -637,6 +1022,7 @@ def create_agent(request):
                 max_tokens=int(data.get('max_tokens', 4000)),
                 system_prompt=data.get('system_prompt', ''),
                 web_search=bool(data.get('web_search', False)),
+                response_cache=bool(data.get('response_cache', False)),
             )
             
             return JsonResponse({
@@ -701,6 +1087,7 @@ def update_agent(request, agent_id):
         agent.top_p = float(data.get('top_p', agent.top_p))
         agent.system_prompt = data.get('system_prompt', agent.system_prompt)
         agent.web_search = bool(data.get('web_search', agent.web_search))
+        agent.response_cache = bool(data.get('response_cache', agent.response_cache))
         agent.save()
         
         return JsonResponse({
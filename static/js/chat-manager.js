@@ -92,6 +92,75 @@ class ChatAPI {
         throw new Error(`Failed to send message: ${response.statusText}`);
     }
 
+    async sendMessageStream(session_id, message, functions, onEvent) {
+        const response = await fetch(`${this.base_url}/send-message/stream/`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+                'Accept': 'text/event-stream',
+                'X-CSRFToken': this.csrf_token
+            },
+            body: JSON.stringify({
+                session_id: session_id,
+                message: message,
+                functions: functions
+            })
+        });
+
+        if (!response.ok) {
+            throw new Error(`Failed to send message: ${response.statusText}`);
+        }
+
+        // Ошибки валидации приходят обычным JSON до начала потока
+        const contentType = response.headers.get('Content-Type') || '';
+        if (!contentType.includes('text/event-stream')) {
+            const data = await response.json();
+            throw new Error(data.error || 'Failed to send message');
+        }
+
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let result = null;
+
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+
+            // События SSE разделены пустой строкой
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const raw = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+
+                let event = 'message';
+                let data = '';
+                for (const line of raw.split('\n')) {
+                    if (line.startsWith('event:')) {
+                        event = line.slice(6).trim();
+                    } else if (line.startsWith('data:')) {
+                        data += line.slice(5).trim();
+                    }
+                }
+
+                const payload = data ? JSON.parse(data) : {};
+                if (event === 'error') {
+                    throw new Error(payload.error || 'Stream error');
+                }
+                if (event === 'done') {
+                    result = payload;
+                }
+                onEvent(event, payload);
+            }
+        }
+
+        if (!result) {
+            throw new Error('Stream ended unexpectedly');
+        }
+        return result;
+    }
+
     async updateSessionSettings(session_id, settings) {
         const response = await fetch(`${this.base_url}/update-session/`, {
             method: 'POST',
@@ -195,6 +264,66 @@ class ChatManager {
         return assistant_message;
     }
 
+    async sendMessageStream(chat_id, message, onUpdate = () => {}) {
+        if (!this.sessions.has(chat_id)) {
+            throw new Error(`Chat session ${chat_id} not found`);
+        }
+
+        const session = this.sessions.get(chat_id);
+
+        // Если нет session_id, инициализируем сессию
+        if (!session.session_id) {
+            await this.initializeSession(chat_id);
+        }
+
+        session.messages.push(new ChatMessage(
+            Date.now().toString(),
+            'user',
+            message,
+            new Date().toISOString()
+        ));
+
+        // Ответ ассистента дописывается по мере поступления фрагментов
+        const assistant_message = new ChatMessage(
+            (Date.now() + 1).toString(),
+            'assistant',
+            '',
+            new Date().toISOString()
+        );
+        session.messages.push(assistant_message);
+
+        let response;
+        try {
+            response = await this.api.sendMessageStream(
+                session.session_id,
+                message,
+                session.settings.functions,
+                (event, payload) => {
+                    if (event === 'delta') {
+                        assistant_message.content += payload.content;
+                        onUpdate(assistant_message);
+                    }
+                }
+            );
+        } catch (error) {
+            // Убираем незавершенный ответ ассистента
+            session.messages = session.messages.filter(msg => msg !== assistant_message);
+            onUpdate(null);
+            throw error;
+        }
+
+        assistant_message.content = response.assistant_message.content;
+        assistant_message.timestamp = response.assistant_message.timestamp;
+        assistant_message.token_stats = response.assistant_message.token_stats;
+
+        if (response.session_stats) {
+            session.stats = response.session_stats;
+        }
+
+        onUpdate(assistant_message);
+        return assistant_message;
+    }
+
     async updateSettings(chat_id, settings) {
         if (!this.sessions.has(chat_id)) {
             throw new Error(`Chat session ${chat_id} not found`);